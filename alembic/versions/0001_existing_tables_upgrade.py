@@ -0,0 +1,107 @@
+"""Дополняет таблицы, созданные до появления новых колонок и индексов
+
+create_all не изменяет уже существующие таблицы, поэтому на развёрнутой БД эта миграция добавляет:
+users.deleted_at, tokens.family_id, comment_pages.comment_count, индексы ix_comments_thread
+и ix_users_username_prefix, полнотекстовый поиск комментариев (search_vector или comments_fts).
+Таблицы, которых ещё нет, пропускаются: их целиком создаст create_all при старте приложения.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import COMMENTS_SEARCH_BACKFILL, COMMENTS_SEARCH_DDL, USERNAME_PREFIX_INDEX_DDL
+
+# revision identifiers, used by Alembic.
+revision: str = "0001"
+down_revision: Union[str, Sequence[str], None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns(inspector, table: str) -> set[str]:
+    return {column["name"] for column in inspector.get_columns(table)}
+
+def _has_index(bind, name: str) -> bool:
+    # Инспектор SQLAlchemy не видит индексы по выражениям, поэтому проверка идёт по каталогу БД
+    query = (
+        "SELECT 1 FROM pg_indexes WHERE indexname = :name" if bind.dialect.name == "postgresql"
+        else "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = :name"
+    )
+    return bind.execute(sa.text(query), {"name": name}).first() is not None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    dialect = bind.dialect.name
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+
+    if "users" in tables:
+        if "deleted_at" not in _columns(inspector, "users"):
+            op.add_column("users", sa.Column("deleted_at", sa.DateTime(timezone=True), nullable=True))
+        if not _has_index(bind, "ix_users_deleted_at"):
+            op.create_index("ix_users_deleted_at", "users", ["deleted_at"])
+        if not _has_index(bind, "ix_users_username_prefix"):
+            for statement in USERNAME_PREFIX_INDEX_DDL.get(dialect, ()):
+                op.execute(statement)
+
+    if "tokens" in tables:
+        if "family_id" not in _columns(inspector, "tokens"):
+            op.add_column("tokens", sa.Column("family_id", sa.String(), nullable=True))
+        if not _has_index(bind, "ix_tokens_family_id"):
+            op.create_index("ix_tokens_family_id", "tokens", ["family_id"])
+
+    if "comment_pages" in tables and "comment_count" not in _columns(inspector, "comment_pages"):
+        op.add_column("comment_pages", sa.Column("comment_count", sa.Integer(), nullable=False, server_default="0"))
+        # Страницы без строки в comment_pages досчитывает python -m app.comment_pages rebuild
+        op.execute(
+            "UPDATE comment_pages SET comment_count = (SELECT count(*) FROM comments c "
+            "WHERE c.game_name = comment_pages.game_name AND c.page = comment_pages.page)"
+        )
+
+    if "comments" in tables:
+        if not _has_index(bind, "ix_comments_thread"):
+            op.create_index("ix_comments_thread", "comments", ["game_name", "page", "created_at", "id"])
+        search_ready = (
+            "search_vector" in _columns(inspector, "comments") if dialect == "postgresql"
+            else "comments_fts" in tables
+        )
+        if not search_ready:
+            for statement in COMMENTS_SEARCH_DDL.get(dialect, ()):
+                op.execute(statement)
+            # Триггеры индексируют только новые строки: существующие комментарии заносятся в индекс разом
+            for statement in COMMENTS_SEARCH_BACKFILL.get(dialect, ()):
+                op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    inspector = sa.inspect(bind)
+    tables = set(inspector.get_table_names())
+    if "comments" in tables:
+        if bind.dialect.name == "postgresql":
+            op.execute("DROP INDEX IF EXISTS ix_comments_search")
+            op.execute("ALTER TABLE comments DROP COLUMN IF EXISTS search_vector")
+        else:
+            for trigger in ("comments_fts_insert", "comments_fts_delete", "comments_fts_update"):
+                op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+            op.execute("DROP TABLE IF EXISTS comments_fts")
+            op.execute("DROP TABLE IF EXISTS comments_fts_ids")
+        op.execute("DROP INDEX IF EXISTS ix_comments_thread")
+    if "comment_pages" in tables and "comment_count" in _columns(inspector, "comment_pages"):
+        op.drop_column("comment_pages", "comment_count")
+    if "tokens" in tables and "family_id" in _columns(inspector, "tokens"):
+        op.execute("DROP INDEX IF EXISTS ix_tokens_family_id")
+        op.drop_column("tokens", "family_id")
+    if "users" in tables and "deleted_at" in _columns(inspector, "users"):
+        op.execute("DROP INDEX IF EXISTS ix_users_username_prefix")
+        op.execute("DROP INDEX IF EXISTS ix_users_deleted_at")
+        op.drop_column("users", "deleted_at")
@@ -0,0 +1,38 @@
+"""Добавляет users.sessions_revoked_at — момент массового отзыва сессий пользователя
+
+Подписанные access-токены, выпущенные раньше этого момента, отклоняются и воркером,
+который был перезапущен после отзыва и не получил событие sessions_revoked.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0002"
+down_revision: Union[str, Sequence[str], None] = "0001"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def _columns(inspector, table: str) -> set[str]:
+    return {column["name"] for column in inspector.get_columns(table)}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if "users" in inspector.get_table_names() and "sessions_revoked_at" not in _columns(inspector, "users"):
+        op.add_column("users", sa.Column("sessions_revoked_at", sa.DateTime(timezone=True), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if "users" in inspector.get_table_names() and "sessions_revoked_at" in _columns(inspector, "users"):
+        op.drop_column("users", "sessions_revoked_at")
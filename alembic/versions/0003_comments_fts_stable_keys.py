@@ -0,0 +1,70 @@
+"""Перестраивает полнотекстовый индекс комментариев в SQLite на стабильные ключи
+
+Прежняя FTS5-таблица с внешним содержимым ссылалась на неявный rowid comments, который при строковом
+первичном ключе может перенумеровать VACUUM. Новая таблица без содержимого ключуется по comments_fts_ids
+(id комментария и игра). В Postgres изменений нет.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+from app.models import COMMENTS_SEARCH_BACKFILL, COMMENTS_SEARCH_DDL
+
+# revision identifiers, used by Alembic.
+revision: str = "0003"
+down_revision: Union[str, Sequence[str], None] = "0002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+_TRIGGERS = ("comments_fts_insert", "comments_fts_delete", "comments_fts_update")
+
+
+def _drop_search() -> None:
+    for trigger in _TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    op.execute("DROP TABLE IF EXISTS comments_fts")
+    op.execute("DROP TABLE IF EXISTS comments_fts_ids")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite":
+        return
+    tables = set(sa.inspect(bind).get_table_names())
+    if "comments" not in tables or "comments_fts_ids" in tables:
+        return
+    _drop_search()
+    for statement in COMMENTS_SEARCH_DDL["sqlite"] + COMMENTS_SEARCH_BACKFILL["sqlite"]:
+        op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != "sqlite" or "comments" not in sa.inspect(bind).get_table_names():
+        return
+    _drop_search()
+    op.execute("CREATE VIRTUAL TABLE comments_fts USING fts5(title, comment_text, content='comments')")
+    op.execute(
+        "CREATE TRIGGER comments_fts_insert AFTER INSERT ON comments BEGIN "
+        "INSERT INTO comments_fts(rowid, title, comment_text) VALUES (new.rowid, new.title, new.comment_text); END"
+    )
+    op.execute(
+        "CREATE TRIGGER comments_fts_delete AFTER DELETE ON comments BEGIN "
+        "INSERT INTO comments_fts(comments_fts, rowid, title, comment_text) "
+        "VALUES ('delete', old.rowid, old.title, old.comment_text); END"
+    )
+    op.execute(
+        "CREATE TRIGGER comments_fts_update AFTER UPDATE OF title, comment_text ON comments BEGIN "
+        "INSERT INTO comments_fts(comments_fts, rowid, title, comment_text) "
+        "VALUES ('delete', old.rowid, old.title, old.comment_text); "
+        "INSERT INTO comments_fts(rowid, title, comment_text) VALUES (new.rowid, new.title, new.comment_text); END"
+    )
+    op.execute("INSERT INTO comments_fts(comments_fts) VALUES ('rebuild')")
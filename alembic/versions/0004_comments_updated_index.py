@@ -0,0 +1,31 @@
+"""Добавляет индекс ix_comments_updated для инкрементальной выгрузки комментариев в порядке (updated_at, id)
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "0004"
+down_revision: Union[str, Sequence[str], None] = "0003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    inspector = sa.inspect(op.get_bind())
+    if "comments" not in inspector.get_table_names():
+        return
+    if "ix_comments_updated" not in {index["name"] for index in inspector.get_indexes("comments")}:
+        op.create_index("ix_comments_updated", "comments", ["updated_at", "id"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DROP INDEX IF EXISTS ix_comments_updated")
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+from collections import Counter
+
+from sqlalchemy import delete, func, select, text
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .comment_pages import bump_page
+from .config import ACCOUNT_PURGE_BATCH_SIZE, ACCOUNT_PURGE_INTERVAL_S
+from .database import SessionLocal
+from .invalidation import invalidation_bus
+from .metrics import register_metrics
+from .models import Comment, Token, User
+
+logger = logging.getLogger(__name__)
+
+# Ключ advisory-блокировки Postgres: проход удаления выполняет только один воркер
+PURGE_LOCK_KEY = 7_301_020
+
+
+async def pending_deletions(session: AsyncSession) -> list[dict]:
+    """Аккаунты, ожидающие удаления, с числом ещё не удалённых токенов и комментариев."""
+    tokens_left = select(func.count()).select_from(Token).where(Token.user_id == User.id).scalar_subquery()
+    comments_left = select(func.count()).select_from(Comment).where(Comment.user_id == User.id).scalar_subquery()
+    res = await session.execute(
+        select(User.id, User.username, User.deleted_at, tokens_left, comments_left)
+        .where(User.deleted_at.is_not(None))
+        .order_by(User.deleted_at)
+    )
+    return [
+        {
+            "user_id": user_id,
+            "username": username,
+            "deleted_at": deleted_at.isoformat(),
+            "tokens_left": tokens,
+            "comments_left": comments,
+        }
+        for user_id, username, deleted_at, tokens, comments in res.all()
+    ]
+
+
+class AccountPurger:
+    """Фоново удаляет аккаунты, помеченные на удаление: токены и комментарии — ограниченными пачками
+    в коротких транзакциях, затем саму строку пользователя. ORM-каскад не используется."""
+
+    def __init__(self, session_factory: async_sessionmaker, batch_size: int = ACCOUNT_PURGE_BATCH_SIZE,
+                 interval_s: float = ACCOUNT_PURGE_INTERVAL_S):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self.pending = 0
+        self.accounts_purged = 0
+        self.tokens_deleted = 0
+        self.comments_deleted = 0
+        self.errors = 0
+        self.skipped = 0
+
+    async def purge_once(self) -> int:
+        """Один проход: полностью удаляет все помеченные аккаунты; возвращает их число.
+        Если проход уже идёт на другом воркере, ничего не делает."""
+        async with self.session_factory() as lock_session:
+            if not await _try_lock(lock_session):
+                self.skipped += 1
+                return 0
+            try:
+                return await self._purge_pending()
+            finally:
+                await _unlock(lock_session)
+
+    async def _purge_pending(self) -> int:
+        async with self.session_factory() as session:
+            res = await session.execute(
+                select(User.id).where(User.deleted_at.is_not(None)).order_by(User.deleted_at)
+            )
+            user_ids = res.scalars().all()
+        self.pending = len(user_ids)
+        for user_id in user_ids:
+            await self.purge_account(user_id)
+            self.pending -= 1
+        return len(user_ids)
+
+    async def purge_account(self, user_id: str) -> None:
+        """Удаляет токены и комментарии пользователя пачками, затем строку пользователя."""
+        while await self._delete_tokens(user_id) >= self.batch_size:
+            pass
+        while await self._delete_comments(user_id) >= self.batch_size:
+            pass
+        async with self.session_factory() as session:
+            await session.execute(
+                delete(User).where(User.id == user_id, User.deleted_at.is_not(None))
+                .execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        self.accounts_purged += 1
+        await invalidation_bus.user_changed(user_id)
+
+    def wake(self) -> None:
+        """Будит удаление сразу после пометки аккаунта, не дожидаясь интервала."""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Бесконечный цикл удаления."""
+        while True:
+            try:
+                await self.purge_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("Ошибка фонового удаления аккаунтов")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        """Запускает фоновую задачу удаления."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу удаления."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Возвращает счётчики удаления."""
+        return {
+            "pending": self.pending,
+            "accounts_purged": self.accounts_purged,
+            "tokens_deleted": self.tokens_deleted,
+            "comments_deleted": self.comments_deleted,
+            "errors": self.errors,
+            "skipped": self.skipped,
+        }
+
+    async def _delete_tokens(self, user_id: str) -> int:
+        batch = select(Token.id).where(Token.user_id == user_id).limit(self.batch_size).scalar_subquery()
+        async with self.session_factory() as session:
+            res = await session.execute(
+                delete(Token).where(Token.id.in_(batch)).execution_options(synchronize_session=False)
+            )
+            await session.commit()
+        deleted = res.rowcount or 0
+        self.tokens_deleted += deleted
+        return deleted
+
+    async def _delete_comments(self, user_id: str) -> int:
+        batch = select(Comment.id).where(Comment.user_id == user_id).limit(self.batch_size).scalar_subquery()
+        async with self.session_factory() as session:
+            # Счётчики страниц уменьшаются ровно на удалённые этой транзакцией строки (RETURNING),
+            # а не на выбранные: строки, которые успел удалить кто-то другой, не вычитаются повторно
+            res = await session.execute(
+                delete(Comment).where(Comment.id.in_(batch))
+                .returning(Comment.id, Comment.game_name, Comment.page)
+                .execution_options(synchronize_session=False)
+            )
+            rows = res.all()
+            if not rows:
+                await session.commit()
+                return 0
+            for (game_name, page), count in Counter((game, page) for _, game, page in rows).items():
+                await bump_page(session, game_name, page, count_delta=-count)
+            await session.commit()
+        self.comments_deleted += len(rows)
+        for game_name, page in dict.fromkeys((game, page) for _, game, page in rows):
+            await invalidation_bus.author_comments_deleted(game_name, page, user_id)
+        return len(rows)
+
+
+async def _try_lock(session: AsyncSession) -> bool:
+    if session.get_bind().dialect.name != "postgresql":
+        return True
+    # Сессионная блокировка на соединении в режиме autocommit: не держит открытую транзакцию на весь проход
+    conn = await session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+    return await conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), {"key": PURGE_LOCK_KEY})
+
+async def _unlock(session: AsyncSession) -> None:
+    if session.get_bind().dialect.name == "postgresql":
+        conn = await session.connection()
+        await conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": PURGE_LOCK_KEY})
+
+
+account_purger = AccountPurger(SessionLocal)
+register_metrics("account_purge", account_purger.stats)
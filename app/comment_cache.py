@@ -0,0 +1,173 @@
+from collections import OrderedDict
+from datetime import datetime
+import time
+from threading import Lock
+from typing import Hashable, Iterable, NamedTuple
+
+from .config import COMMENT_CACHE_ENABLED, COMMENT_CACHE_MAX_ENTRIES, COMMENT_CACHE_MAX_BYTES, COMMENT_CACHE_MAX_AGE_S
+from .invalidation import invalidation_bus, COMMENT_PAGE_CHANGED, RESYNC, USERNAME_CHANGED
+from .metrics import register_metrics
+
+# Ключ записи: (game_name, page, limit, cursor)
+CacheKey = tuple[str, str, int, str | None]
+
+
+class CachedThread(NamedTuple):
+    """Сериализованная порция ветки комментариев вместе с заголовками ответа."""
+    body: bytes
+    headers: dict[str, str]
+    last_modified: datetime | None
+
+
+class CommentThreadCache:
+    """LRU-кэш сериализованных веток комментариев с ограничением по числу записей и по объёму в байтах.
+    Записи живут не дольше max_age_s: если событие инвалидации потеряется, устаревшая ветка отдаётся ограниченное время."""
+
+    def __init__(self, max_entries: int, max_bytes: int, max_age_s: float, enabled: bool = True):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age_s = max_age_s
+        self.enabled = enabled
+        self._entries: OrderedDict[CacheKey, CachedThread] = OrderedDict()
+        self._stored_at: dict[CacheKey, float] = {}
+        self._by_page: dict[tuple[str, str], set[CacheKey]] = {}
+        # Авторы комментариев каждой записи: смена username сбрасывает только записи с его комментариями
+        self._authors: dict[CacheKey, frozenset[str]] = {}
+        self._by_author: dict[str, set[CacheKey]] = {}
+        # Моменты последней инвалидации страниц и авторов: ответ, собранный до неё, не попадёт в кэш.
+        # Хранятся не дольше max_age_s — более долгие чтения в кэш не кладутся, так что словари не растут без предела
+        self._invalidated_at: dict[tuple[str, str], float] = {}
+        self._author_invalidated_at: dict[str, float] = {}
+        self._bytes = 0
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+
+    @staticmethod
+    def read_started() -> float:
+        """Момент начала чтения из БД; передаётся в put, чтобы не закэшировать ответ, устаревший во время чтения."""
+        return time.monotonic()
+
+    def get(self, key: CacheKey) -> CachedThread | None:
+        """Возвращает закэшированную порцию ветки или None."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - self._stored_at[key] > self.max_age_s:
+                self._drop(key)
+                self.expired += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key: CacheKey, entry: CachedThread, started_at: float, author_ids: Iterable[str] = ()) -> None:
+        """Кладёт порцию ветки, если ни страница, ни авторы её комментариев не менялись с момента started_at
+        и запись влезает в лимит."""
+        if not self.enabled or len(entry.body) > self.max_bytes:
+            return
+        page_key = (key[0], key[1])
+        authors = frozenset(str(author_id) for author_id in author_ids)
+        now = time.monotonic()
+        with self._lock:
+            if now - started_at > self.max_age_s or self._invalidated_at.get(page_key, float("-inf")) >= started_at:
+                return
+            if any(self._author_invalidated_at.get(author, float("-inf")) >= started_at for author in authors):
+                return
+            self._drop(key)
+            self._entries[key] = entry
+            self._stored_at[key] = now
+            self._by_page.setdefault(page_key, set()).add(key)
+            self._authors[key] = authors
+            for author in authors:
+                self._by_author.setdefault(author, set()).add(key)
+            self._bytes += len(entry.body)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_page(self, game_name: str, page: str) -> None:
+        """Удаляет все порции ветки страницы."""
+        page_key = (game_name, page)
+        with self._lock:
+            self._mark(self._invalidated_at, page_key)
+            for key in list(self._by_page.get(page_key, ())):
+                self._drop(key)
+
+    def invalidate_author(self, user_id: str) -> None:
+        """Удаляет порции веток, в которых есть комментарии пользователя (смена username)."""
+        with self._lock:
+            self._mark(self._author_invalidated_at, str(user_id))
+            for key in list(self._by_author.get(str(user_id), ())):
+                self._drop(key)
+
+    def clear(self) -> None:
+        """Полностью очищает кэш."""
+        with self._lock:
+            self._entries.clear()
+            self._stored_at.clear()
+            self._by_page.clear()
+            self._authors.clear()
+            self._by_author.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Возвращает число записей, объём и долю попаданий."""
+        total = self.hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def _mark(self, marks: dict[Hashable, float], mark_key: Hashable) -> None:
+        # Словарь упорядочен по времени инвалидации: устаревшие метки снимаются с начала
+        now = time.monotonic()
+        marks.pop(mark_key, None)
+        marks[mark_key] = now
+        for old_key, invalidated_at in list(marks.items()):
+            if now - invalidated_at <= self.max_age_s:
+                break
+            del marks[old_key]
+
+    def _drop(self, key: CacheKey) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        del self._stored_at[key]
+        self._bytes -= len(entry.body)
+        page_key = (key[0], key[1])
+        keys = self._by_page.get(page_key)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_page[page_key]
+        for author in self._authors.pop(key, ()):
+            keys = self._by_author.get(author)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_author[author]
+
+
+comment_cache = CommentThreadCache(
+    COMMENT_CACHE_MAX_ENTRIES, COMMENT_CACHE_MAX_BYTES, COMMENT_CACHE_MAX_AGE_S, enabled=COMMENT_CACHE_ENABLED
+)
+register_metrics("comment_cache", comment_cache.stats)
+invalidation_bus.subscribe(
+    COMMENT_PAGE_CHANGED, lambda event: comment_cache.invalidate_page(event["game_name"], event["page"])
+)
+invalidation_bus.subscribe(RESYNC, lambda event: comment_cache.clear())
+invalidation_bus.subscribe(USERNAME_CHANGED, lambda event: comment_cache.invalidate_author(event["user_id"]))
@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from typing import AsyncIterator
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .config import COMMENT_FEED_QUEUE_SIZE, COMMENT_FEED_MAX_CONNECTIONS, COMMENT_FEED_HEARTBEAT_S
+from .database import SessionLocal
+from .invalidation import invalidation_bus, COMMENT_PAGE_CHANGED
+from .metrics import register_metrics
+from .queries import fetch_comment
+from .serialization import comment_out
+
+logger = logging.getLogger(__name__)
+
+
+class FeedSubscription:
+    """Подписка одного подключения на ленту страницы: собственная ограниченная очередь событий."""
+
+    def __init__(self, game_name: str, page: str, queue_size: int):
+        self.game_name = game_name
+        self.page = page
+        self.queue: asyncio.Queue[dict | None] = asyncio.Queue(maxsize=queue_size)
+        self.dropped = False
+
+
+class CommentFeed:
+    """In-process pub/sub живой ленты комментариев: раздаёт события страницы всем её подписчикам.
+    Подписчик, не успевающий забирать события, отключается, чтобы не держать память и не тормозить остальных."""
+
+    def __init__(self, queue_size: int, max_connections: int, session_factory: async_sessionmaker | None = None):
+        self.queue_size = queue_size
+        self.max_connections = max_connections
+        # Откуда перечитывать комментарии из событий других воркеров (в событии приходят только ключи)
+        self.session_factory = session_factory
+        self._subscribers: dict[tuple[str, str], set[FeedSubscription]] = {}
+        # Очереди событий страниц, ожидающих раздачи по порядку, и задачи, которые их разбирают (по одной на страницу)
+        self._pending: dict[tuple[str, str], deque[tuple[str, str | None, dict | None]]] = {}
+        self._drains: set[asyncio.Task] = set()
+        self.connections = 0
+        self.published = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.rejected = 0
+
+    def subscribe(self, game_name: str, page: str) -> FeedSubscription:
+        """Регистрирует подключение; при превышении лимита подключений отвечает 503."""
+        if self.connections >= self.max_connections:
+            self.rejected += 1
+            raise HTTPException(status_code=503, detail="Слишком много подключений к ленте", headers={"Retry-After": "5"})
+        sub = FeedSubscription(game_name, page, self.queue_size)
+        self._subscribers.setdefault((game_name, page), set()).add(sub)
+        self.connections += 1
+        return sub
+
+    def unsubscribe(self, sub: FeedSubscription) -> None:
+        """Снимает подписку (повторный вызов безопасен)."""
+        subs = self._subscribers.get((sub.game_name, sub.page))
+        if subs is None or sub not in subs:
+            return
+        subs.discard(sub)
+        if not subs:
+            del self._subscribers[(sub.game_name, sub.page)]
+        self.connections -= 1
+
+    def publish(self, game_name: str, page: str, event: dict) -> None:
+        """Раздаёт событие подписчикам страницы без ожидания; переполненные очереди отключаются."""
+        self.published += 1
+        for sub in list(self._subscribers.get((game_name, page), ())):
+            try:
+                sub.queue.put_nowait(event)
+                self.delivered += 1
+            except asyncio.QueueFull:
+                self._drop(sub)
+
+    def has_subscribers(self, game_name: str, page: str) -> bool:
+        """Есть ли у страницы подписчики в этом процессе."""
+        return (game_name, page) in self._subscribers
+
+    def publish_in_order(self, game_name: str, page: str, action: str,
+                         comment: dict | None = None, comment_id: str | None = None) -> None:
+        """Раздаёт событие после всех предыдущих событий страницы. Без comment комментарий comment_id
+        перечитывается из БД; пока идёт чтение, следующие события страницы ждут в её очереди."""
+        page_key = (game_name, page)
+        pending = self._pending.get(page_key)
+        if pending is None:
+            if comment is not None:
+                self.publish(game_name, page, {"action": action, "comment": comment})
+                return
+            pending = self._pending[page_key] = deque()
+            task = asyncio.get_running_loop().create_task(self._drain(page_key, pending))
+            self._drains.add(task)
+            task.add_done_callback(self._drains.discard)
+        pending.append((action, comment_id, comment))
+
+    async def _drain(self, page_key: tuple[str, str], pending: deque) -> None:
+        try:
+            while pending:
+                action, comment_id, comment = pending[0]
+                if comment is None:
+                    comment = await self._load(comment_id)
+                # Комментарий мог быть удалён после события: о нём придёт своё событие deleted
+                if comment is not None:
+                    self.publish(*page_key, {"action": action, "comment": comment})
+                pending.popleft()
+        finally:
+            self._pending.pop(page_key, None)
+
+    async def _load(self, comment_id: str) -> dict | None:
+        try:
+            async with self.session_factory() as session:
+                row = await fetch_comment(session, comment_id)
+        except Exception:
+            logger.exception("Не удалось перечитать комментарий %s для ленты", comment_id)
+            return None
+        return comment_out(row, row.username) if row is not None else None
+
+    def stats(self) -> dict:
+        """Возвращает число подключений и счётчики событий."""
+        return {
+            "connections": self.connections,
+            "pages": len(self._subscribers),
+            "pages_reloading": len(self._pending),
+            "published": self.published,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+        }
+
+    def _drop(self, sub: FeedSubscription) -> None:
+        self.unsubscribe(sub)
+        sub.dropped = True
+        self.dropped += 1
+        # Недоставленные события больше не нужны: клиент перечитает ветку после переподключения
+        while not sub.queue.empty():
+            sub.queue.get_nowait()
+        sub.queue.put_nowait(None)
+        logger.info("Медленный подписчик ленты %s/%s отключён", sub.game_name, sub.page)
+
+
+async def sse_events(feed: CommentFeed, sub: FeedSubscription, heartbeat_s: float = COMMENT_FEED_HEARTBEAT_S) -> AsyncIterator[str]:
+    """Превращает очередь подписки в поток Server-Sent Events; при закрытии потока подписка снимается."""
+    try:
+        yield "retry: 3000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(sub.queue.get(), timeout=heartbeat_s)
+            except asyncio.TimeoutError:
+                # Комментарий-пинг держит соединение через прокси и выявляет отвалившихся клиентов
+                yield ": ping\n\n"
+                continue
+            if event is None:
+                yield "event: dropped\ndata: {}\n\n"
+                return
+            yield f"event: {event['action']}\ndata: {json.dumps(event['comment'], ensure_ascii=False)}\n\n"
+    finally:
+        feed.unsubscribe(sub)
+
+
+comment_feed = CommentFeed(COMMENT_FEED_QUEUE_SIZE, COMMENT_FEED_MAX_CONNECTIONS, session_factory=SessionLocal)
+register_metrics("comment_feed", comment_feed.stats)
+
+
+def _on_page_changed(event: dict) -> None:
+    action = event.get("action")
+    if not action:
+        return
+    game_name, page = event["game_name"], event["page"]
+    comment = event.get("comment")
+    if comment is None:
+        if not comment_feed.has_subscribers(game_name, page):
+            return
+        # Событие другого воркера: в NOTIFY только ключи, тело created/updated читается из БД
+        if action == "deleted":
+            comment = {"id": event["comment_id"], "game_name": game_name, "page": page}
+        elif action == "author_deleted":
+            comment = {"user_id": event["user_id"], "game_name": game_name, "page": page}
+    # Все события страницы идут через её очередь: deleted не обгонит ещё не перечитанный created
+    comment_feed.publish_in_order(game_name, page, action, comment, event.get("comment_id"))
+
+# События приходят через шину инвалидации, поэтому подписчики получают изменения, сделанные на любом воркере
+invalidation_bus.subscribe(COMMENT_PAGE_CHANGED, _on_page_changed)
@@ -0,0 +1,146 @@
+import asyncio
+import hashlib
+import sys
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from sqlalchemy import func, select, tuple_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Comment, CommentPage
+
+
+def _upsert(session: AsyncSession):
+    dialect = session.get_bind().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+async def bump_page(session: AsyncSession, game_name: str, page: str, count_delta: int = 0) -> None:
+    """Увеличивает версию ветки страницы и сдвигает счётчик комментариев на count_delta
+    в текущей транзакции (коммит делает вызывающий код)."""
+    now = datetime.now(timezone.utc)
+    insert = _upsert(session)
+    if insert is not None:
+        stmt = insert(CommentPage).values(
+            game_name=game_name, page=page, version=1, last_modified=now, comment_count=max(count_delta, 0)
+        )
+        await session.execute(stmt.on_conflict_do_update(
+            index_elements=[CommentPage.game_name, CommentPage.page],
+            set_={
+                "version": CommentPage.version + 1,
+                "last_modified": now,
+                "comment_count": CommentPage.comment_count + count_delta,
+            },
+        ))
+        return
+    res = await session.execute(
+        update(CommentPage)
+        .where(CommentPage.game_name == game_name, CommentPage.page == page)
+        .values(version=CommentPage.version + 1, last_modified=now, comment_count=CommentPage.comment_count + count_delta)
+    )
+    if not res.rowcount:
+        session.add(CommentPage(
+            game_name=game_name, page=page, version=1, last_modified=now, comment_count=max(count_delta, 0)
+        ))
+
+async def bump_author_pages(session: AsyncSession, user_id: str) -> int:
+    """Увеличивает версии всех веток с комментариями пользователя одним UPDATE (смена username меняет их ответы);
+    возвращает число затронутых страниц. Коммит делает вызывающий код."""
+    pages = select(Comment.game_name, Comment.page).where(Comment.user_id == user_id).distinct()
+    res = await session.execute(
+        update(CommentPage)
+        .where(tuple_(CommentPage.game_name, CommentPage.page).in_(pages))
+        .values(version=CommentPage.version + 1, last_modified=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount or 0
+
+async def get_comment_counts(session: AsyncSession, game_name: str) -> dict[str, int]:
+    """Возвращает число комментариев по всем страницам игры одним запросом к счётчикам."""
+    res = await session.execute(
+        select(CommentPage.page, CommentPage.comment_count)
+        .where(CommentPage.game_name == game_name, CommentPage.comment_count > 0)
+        .order_by(CommentPage.page)
+    )
+    return {page: count for page, count in res.all()}
+
+async def rebuild_comment_counts(session: AsyncSession, game_name: str | None = None) -> int:
+    """Сверяет счётчики с таблицей comments (для одной игры или всех) и исправляет расхождения.
+    Возвращает число исправленных страниц."""
+    counted = select(Comment.game_name, Comment.page, func.count()).group_by(Comment.game_name, Comment.page)
+    states = select(CommentPage).with_for_update()
+    if game_name is not None:
+        counted = counted.where(Comment.game_name == game_name)
+        states = states.where(CommentPage.game_name == game_name)
+    actual = {(game, page): count for game, page, count in (await session.execute(counted)).all()}
+    fixed = 0
+    for state in (await session.execute(states)).scalars().all():
+        count = actual.pop((state.game_name, state.page), 0)
+        if state.comment_count != count:
+            state.comment_count = count
+            fixed += 1
+    now = datetime.now(timezone.utc)
+    for (game, page), count in actual.items():
+        session.add(CommentPage(game_name=game, page=page, version=1, last_modified=now, comment_count=count))
+        fixed += 1
+    await session.commit()
+    return fixed
+
+async def get_page_state(session: AsyncSession, game_name: str, page: str) -> tuple[int, datetime | None]:
+    """Возвращает (версия, время последнего изменения) ветки; для страницы без комментариев — (0, None)."""
+    res = await session.execute(
+        select(CommentPage.version, CommentPage.last_modified)
+        .where(CommentPage.game_name == game_name, CommentPage.page == page)
+    )
+    row = res.first()
+    if row is None:
+        return 0, None
+    version, last_modified = row
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return version, last_modified
+
+def make_etag(version: int, last_modified: datetime | None, *variant) -> str:
+    """Слабый ETag ветки: версия, время изменения и параметры выборки (limit, cursor)."""
+    stamp = int(last_modified.timestamp() * 1000) if last_modified else 0
+    digest = hashlib.sha1(repr(variant).encode()).hexdigest()[:8]
+    return f'W/"{version}-{stamp}-{digest}"'
+
+def http_date(value: datetime) -> str:
+    """Форматирует время для заголовка Last-Modified."""
+    return format_datetime(value.astimezone(timezone.utc), usegmt=True)
+
+def not_modified(etag: str, last_modified: datetime | None, if_none_match: str | None, if_modified_since: str | None) -> bool:
+    """Проверяет условные заголовки запроса; If-None-Match имеет приоритет над If-Modified-Since."""
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags
+    if if_modified_since and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(microsecond=0) <= since
+    return False
+
+
+async def _rebuild(game_name: str | None) -> None:
+    from .database import SessionLocal, engine
+    async with SessionLocal() as session:
+        fixed = await rebuild_comment_counts(session, game_name)
+    await engine.dispose()
+    print(f"Исправлено счётчиков: {fixed}")
+
+
+if __name__ == "__main__":
+    # python -m app.comment_pages rebuild [game_name]
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        sys.exit("usage: python -m app.comment_pages rebuild [game_name]")
+    asyncio.run(_rebuild(sys.argv[2] if len(sys.argv) > 2 else None))
@@ -0,0 +1,53 @@
+import re
+
+from sqlalchemy import Float, and_, cast, column, func, literal, literal_column, or_, select, table
+from sqlalchemy.dialects.postgresql import REGCONFIG, TSVECTOR
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .config import COMMENTS_SEARCH_CONFIG
+from .models import Comment
+from .queries import CommentRow, comment_rows_select, split_rank
+
+_TERM = re.compile(r"\w+")
+
+
+def _fts5_query(q: str) -> str:
+    """Превращает пользовательский запрос в запрос FTS5: все слова обязательны, спецсимволы отбрасываются."""
+    return " ".join(f'"{term}"' for term in _TERM.findall(q))
+
+def _ranked_matches(session: AsyncSession, q: str, game_name: str):
+    """Выборка совпадений игры в колонках CommentRow с релевантностью rank (больше — лучше) и выражение rank
+    для keyset-условия. Игра отбирается в том же запросе, что и совпадения, без повторного соединения с comments."""
+    if session.get_bind().dialect.name == "postgresql":
+        query = func.websearch_to_tsquery(cast(literal(COMMENTS_SEARCH_CONFIG), REGCONFIG), q)
+        vector = literal_column("comments.search_vector", TSVECTOR)
+        rank = func.ts_rank(vector, query, type_=Float)
+        return (
+            comment_rows_select().add_columns(rank.label("rank"))
+            .where(vector.op("@@")(query), Comment.game_name == game_name)
+        ), rank
+    fts = table("comments_fts", column("rowid"))
+    ids = table("comments_fts_ids", column("id"), column("comment_id"), column("game_name"))
+    # bm25 тем меньше, чем лучше совпадение; заголовок весит вдвое больше текста
+    matches = (
+        select(ids.c.comment_id.label("key"), (-func.bm25(literal_column("comments_fts"), 2.0, 1.0)).label("rank"))
+        .select_from(fts.join(ids, ids.c.id == fts.c.rowid))
+        .where(literal_column("comments_fts").op("MATCH")(_fts5_query(q)), ids.c.game_name == game_name)
+        .subquery()
+    )
+    return comment_rows_select().add_columns(matches.c.rank).join(matches, matches.c.key == Comment.id), matches.c.rank
+
+async def search_comments(
+        session: AsyncSession, q: str, game_name: str, limit: int, after: tuple[float, str] | None = None
+) -> list[tuple[CommentRow, float]]:
+    """Ищет комментарии игры по заголовку и тексту; возвращает пары (комментарий, релевантность)
+    по убыванию релевантности. after — ключ (релевантность, id) последней записи предыдущей порции."""
+    if session.get_bind().dialect.name != "postgresql" and not _fts5_query(q):
+        return []
+    stmt, rank = _ranked_matches(session, q, game_name)
+    if after is not None:
+        after_rank, comment_id = after
+        stmt = stmt.where(or_(rank < after_rank, and_(rank == after_rank, Comment.id > comment_id)))
+    conn = await session.connection()
+    result = await conn.execute(stmt.order_by(rank.desc(), Comment.id).limit(limit))
+    return split_rank(result)
@@ -1,7 +1,9 @@
+import hmac
 from typing import Annotated, Optional
 from fastapi import Depends, HTTPException, status, Header
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
+from . import config
 from .database import SessionLocal
 from .utils import get_user_by_access_token, get_user_by_refresh_token
 from .models import User
@@ -11,6 +13,10 @@ async def get_db() -> AsyncSession:
     async with SessionLocal() as session:
         yield session
 
+def get_session_factory() -> async_sessionmaker:
+    """Даёт фабрику сессий для обработчиков, которым сессия нужна дольше запроса (потоковые ответы)."""
+    return SessionLocal
+
 async def get_current_user(
     authorization: Annotated[Optional[str], Header(alias="Authorization")] = None,
     db: Annotated[AsyncSession, Depends(get_db)] = None,
@@ -29,4 +35,20 @@ async def get_user_by_refresh(
     if not authorization or not authorization.lower().startswith("bearer "):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Требуется Bearer refresh-токен")
     token = authorization.split(" ", 1)[1].strip()
-    return await get_user_by_refresh_token(db, token)
\ No newline at end of file
+    return await get_user_by_refresh_token(db, token)
+
+async def get_current_admin(current: Annotated[User, Depends(get_current_user)]) -> User:
+    """Отдаёт текущего пользователя, если у него роль admin."""
+    if current.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Требуются права администратора")
+    return current
+
+async def require_service_token(
+    service_token: Annotated[Optional[str], Header(alias="X-Service-Token")] = None,
+) -> None:
+    """Пропускает только внутренние сервисы, предъявившие общий секрет INTROSPECT_SERVICE_TOKEN."""
+    expected = config.INTROSPECT_SERVICE_TOKEN
+    if not expected:
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Интроспекция токенов не настроена")
+    if not service_token or not hmac.compare_digest(service_token.encode(), expected.encode()):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Требуется сервисный токен")
@@ -0,0 +1,179 @@
+import asyncio
+import json
+import logging
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime
+from typing import Callable
+
+from .config import DATABASE_URL, INVALIDATION_BACKEND, INVALIDATION_CHANNEL
+from .metrics import register_metrics
+
+logger = logging.getLogger(__name__)
+
+# Типы событий
+TOKEN_REVOKED = "token_revoked"
+USER_CHANGED = "user_changed"
+SESSIONS_REVOKED = "sessions_revoked"
+COMMENT_PAGE_CHANGED = "comment_page_changed"
+USERNAME_CHANGED = "username_changed"
+# Локальное событие после переподключения LISTEN: пропущенные за время разрыва события восполняются сбросом кэшей
+RESYNC = "resync"
+
+
+class InvalidationBus:
+    """Шина инвалидации локальных кэшей: событие сначала применяется в своём процессе, затем рассылается остальным."""
+
+    backend = "local"
+
+    def __init__(self):
+        self._handlers: dict[str, list[Callable[[dict], None]]] = defaultdict(list)
+        self.published = 0
+        self.received = 0
+        self.resyncs = 0
+
+    def subscribe(self, kind: str, handler: Callable[[dict], None]) -> None:
+        """Подписывает обработчик на события указанного типа."""
+        self._handlers[kind].append(handler)
+
+    async def publish(self, kind: str, local: dict | None = None, **payload) -> None:
+        """Публикует событие: применяет его локально и передаёт другим воркерам.
+        Поля local доступны только обработчикам своего процесса и между воркерами не передаются."""
+        event = {"kind": kind, **payload}
+        self.published += 1
+        self._dispatch({**event, **local} if local else event)
+        await self._broadcast(event)
+
+    async def token_revoked(self, token_hash: str, expires_at: datetime | None = None, signed: bool = False) -> None:
+        """Сообщает об отзыве токена."""
+        await self.publish(
+            TOKEN_REVOKED, token_hash=token_hash,
+            expires_at=expires_at.timestamp() if expires_at else None, signed=signed,
+        )
+
+    async def user_changed(self, user_id: str) -> None:
+        """Сообщает об изменении данных пользователя (профиль, пароль, удаление)."""
+        await self.publish(USER_CHANGED, user_id=str(user_id))
+
+    async def sessions_revoked(self, user_id: str) -> None:
+        """Сообщает о массовом отзыве сессий: все токены пользователя, выпущенные до этого момента, недействительны."""
+        await self.publish(SESSIONS_REVOKED, user_id=str(user_id), before_ms=int(time.time() * 1000))
+
+    async def username_changed(self, user_id: str, username: str | None) -> None:
+        """Сообщает о появлении, смене (username) или удалении (None) имени пользователя."""
+        await self.publish(USERNAME_CHANGED, user_id=str(user_id), username=username)
+
+    async def comment_page_changed(
+            self, game_name: str, page: str, action: str | None = None, comment: dict | None = None
+    ) -> None:
+        """Сообщает об изменении ветки комментариев страницы; action и comment описывают изменение для живой ленты.
+        Другим воркерам уходят только ключи (NOTIFY ограничен 8000 байт), комментарий они перечитывают сами."""
+        await self.publish(
+            COMMENT_PAGE_CHANGED, game_name=game_name, page=page, action=action,
+            comment_id=comment["id"] if comment else None, local={"comment": comment},
+        )
+
+    async def author_comments_deleted(self, game_name: str, page: str, user_id: str) -> None:
+        """Сообщает, что со страницы удалены все комментарии автора (удаление аккаунта): одно событие на страницу
+        вместо события на каждый комментарий; подписчики ленты убирают комментарии этого автора."""
+        await self.publish(COMMENT_PAGE_CHANGED, game_name=game_name, page=page, action="author_deleted",
+                           comment_id=None, user_id=str(user_id))
+
+    async def start(self) -> None:
+        """Подключает транспорт между воркерами."""
+
+    async def stop(self) -> None:
+        """Отключает транспорт между воркерами."""
+
+    def stats(self) -> dict:
+        """Возвращает счётчики событий."""
+        return {"backend": self.backend, "published": self.published, "received": self.received, "resyncs": self.resyncs}
+
+    def _dispatch(self, event: dict) -> None:
+        for handler in self._handlers.get(event.get("kind"), ()):
+            try:
+                handler(event)
+            except Exception:
+                logger.exception("Ошибка обработчика события инвалидации %s", event.get("kind"))
+
+    async def _broadcast(self, event: dict) -> None:
+        pass
+
+
+class LocalInvalidationBus(InvalidationBus):
+    """Шина в пределах одного процесса (тесты, запуск с одним воркером)."""
+
+
+class PostgresInvalidationBus(InvalidationBus):
+    """Шина поверх PostgreSQL LISTEN/NOTIFY: события доходят до всех воркеров и подов за миллисекунды."""
+
+    backend = "postgres"
+
+    def __init__(self, dsn: str, channel: str):
+        super().__init__()
+        self.dsn = dsn.replace("postgresql+asyncpg://", "postgresql://", 1)
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self._conn = None
+        self._lock = asyncio.Lock()
+        self._stopping = False
+
+    async def start(self) -> None:
+        import asyncpg
+
+        self._stopping = False
+        self._conn = await asyncpg.connect(self.dsn)
+        await self._conn.add_listener(self.channel, self._on_notify)
+        self._conn.add_termination_listener(self._on_terminated)
+
+    async def stop(self) -> None:
+        self._stopping = True
+        if self._conn is not None:
+            await self._conn.close()
+            self._conn = None
+
+    async def _broadcast(self, event: dict) -> None:
+        if self._conn is None:
+            return
+        message = json.dumps({**event, "origin": self.origin})
+        try:
+            async with self._lock:
+                await self._conn.execute("SELECT pg_notify($1, $2)", self.channel, message)
+        except Exception:
+            logger.exception("Не удалось разослать событие инвалидации")
+
+    def _on_notify(self, _conn, _pid, _channel, payload: str) -> None:
+        event = json.loads(payload)
+        if event.pop("origin", None) == self.origin:
+            return
+        self.received += 1
+        self._dispatch(event)
+
+    def _on_terminated(self, _conn) -> None:
+        self._conn = None
+        if not self._stopping:
+            asyncio.get_running_loop().create_task(self._reconnect())
+
+    async def _reconnect(self) -> None:
+        while not self._stopping and self._conn is None:
+            try:
+                await self.start()
+            except Exception:
+                logger.exception("Переподключение шины инвалидации не удалось")
+                await asyncio.sleep(1)
+        if self._conn is not None:
+            logger.warning("Шина инвалидации переподключена, локальные кэши сбрасываются")
+            self.resyncs += 1
+            self._dispatch({"kind": RESYNC})
+
+
+def create_bus(backend: str) -> InvalidationBus:
+    """Создаёт шину по имени бэкенда: local | postgres."""
+    if backend == "postgres":
+        return PostgresInvalidationBus(DATABASE_URL, INVALIDATION_CHANNEL)
+    return LocalInvalidationBus()
+
+
+invalidation_bus = create_bus(INVALIDATION_BACKEND)
+register_metrics("invalidation_bus", invalidation_bus.stats)
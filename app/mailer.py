@@ -0,0 +1,261 @@
+import asyncio
+import logging
+import smtplib
+import time
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from typing import NamedTuple
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from .config import (
+    SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_FROM, SMTP_TLS,
+    EMAIL_OUTBOX_BATCH_SIZE, EMAIL_OUTBOX_INTERVAL_S, EMAIL_OUTBOX_MAX_ATTEMPTS, EMAIL_OUTBOX_LEASE_S,
+    EMAIL_OUTBOX_RETENTION_H,
+)
+from .database import SessionLocal
+from .metrics import register_metrics
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_email(session: AsyncSession, to: str, subject: str, text: str) -> None:
+    """Кладёт письмо в outbox; оно сохранится тем же коммитом, что и остальные изменения сессии."""
+    session.add(EmailOutbox(recipient=to, subject=subject, body=text))
+
+
+class ClaimedEmail(NamedTuple):
+    """Письмо, захваченное отправителем; attempts уже учитывает текущую попытку."""
+    id: int
+    recipient: str
+    subject: str
+    body: str
+    attempts: int
+
+
+class SMTPConnection:
+    """Постоянное SMTP-соединение: STARTTLS и логин выполняются один раз, при обрыве — переподключение."""
+
+    def __init__(self, host: str | None, port: int, username: str | None, password: str | None, use_tls: bool):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_tls = use_tls
+        self._smtp: smtplib.SMTP | None = None
+
+    def send(self, msg: EmailMessage) -> None:
+        """Отправляет письмо, при разорванном соединении переподключается один раз."""
+        if not self.host:
+            print("\n=== EMAIL (mock) ===\nTo:", msg["To"], "\nSubject:", msg["Subject"], "\n", msg.get_content(), "\n====================\n")
+            return
+        try:
+            self._connection().send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self.close()
+            self._connection().send_message(msg)
+
+    def close(self) -> None:
+        """Закрывает соединение."""
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except (smtplib.SMTPException, OSError):
+                pass
+            self._smtp = None
+
+    def _connection(self) -> smtplib.SMTP:
+        if self._smtp is None:
+            smtp = smtplib.SMTP(self.host, self.port, timeout=30)
+            if self.use_tls:
+                smtp.starttls()
+            if self.username and self.password:
+                smtp.login(self.username, self.password)
+            self._smtp = smtp
+        return self._smtp
+
+
+class OutboxSender:
+    """Фоновый отправитель писем из email_outbox: пачками, через одно SMTP-соединение, с повторами и backoff.
+    Тело письма (в нём ссылки и коды из токенов) стирается, как только письмо отправлено или попытки исчерпаны,
+    а сами строки удаляются через retention_h часов."""
+
+    # Как часто удалять устаревшие строки outbox
+    purge_interval_s = 300.0
+
+    def __init__(self, session_factory: async_sessionmaker, smtp: SMTPConnection,
+                 batch_size: int = EMAIL_OUTBOX_BATCH_SIZE, interval_s: float = EMAIL_OUTBOX_INTERVAL_S,
+                 max_attempts: int = EMAIL_OUTBOX_MAX_ATTEMPTS, sender: str = SMTP_FROM,
+                 retention_h: float = EMAIL_OUTBOX_RETENTION_H, lease_s: float = EMAIL_OUTBOX_LEASE_S):
+        self.session_factory = session_factory
+        self.smtp = smtp
+        self.batch_size = batch_size
+        self.interval_s = interval_s
+        self.max_attempts = max_attempts
+        self.sender = sender
+        self.retention_h = retention_h
+        self.lease_s = lease_s
+        self._task: asyncio.Task | None = None
+        self._wakeup = asyncio.Event()
+        self._next_purge = 0.0
+        self.queue_depth = 0
+        self.dead = 0
+        self.sent = 0
+        self.failed = 0
+        self.dead_lettered = 0
+        self.purged = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    async def send_pending(self) -> int:
+        """Отправляет одну пачку готовых к отправке писем; возвращает число успешно отправленных.
+        Пачка захватывается короткой транзакцией, SMTP-отправка идёт без открытой транзакции и блокировок строк."""
+        items = await self._claim()
+        results: list[dict] = []
+        sent = 0
+        for item in items:
+            started = time.perf_counter()
+            try:
+                await asyncio.to_thread(self.smtp.send, self._message(item))
+            except (smtplib.SMTPException, OSError) as exc:
+                self.smtp.close()
+                result = {
+                    "id": item.id, "last_error": str(exc)[:500],
+                    "next_attempt_at": datetime.now(timezone.utc) + timedelta(seconds=self.interval_s * 2 ** item.attempts),
+                }
+                self.failed += 1
+                logger.warning("Не удалось отправить письмо %s: %s", item.id, exc)
+                if item.attempts >= self.max_attempts:
+                    result["body"] = ""
+                    self.dead_lettered += 1
+                    logger.error("Письмо %s не отправлено за %d попыток", item.id, item.attempts)
+                results.append(result)
+                continue
+            elapsed = time.perf_counter() - started
+            results.append({"id": item.id, "sent_at": datetime.now(timezone.utc), "body": ""})
+            self.sent += 1
+            self._latency_total += elapsed
+            self._latency_max = max(self._latency_max, elapsed)
+            sent += 1
+        await self._record(results)
+        return sent
+
+    async def _claim(self) -> list[ClaimedEmail]:
+        """Захватывает пачку: засчитывает попытку и сдвигает next_attempt_at на lease_s, после чего сразу коммитит.
+        Если воркер упадёт посреди отправки, письма снова станут доступны по истечении аренды."""
+        now = datetime.now(timezone.utc)
+        async with self.session_factory() as session:
+            res = await session.execute(
+                select(EmailOutbox.id, EmailOutbox.recipient, EmailOutbox.subject, EmailOutbox.body, EmailOutbox.attempts)
+                .where(EmailOutbox.sent_at.is_(None), EmailOutbox.attempts < self.max_attempts,
+                       EmailOutbox.next_attempt_at <= now)
+                .order_by(EmailOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = res.all()
+            if rows:
+                await session.execute(
+                    update(EmailOutbox)
+                    .where(EmailOutbox.id.in_([row.id for row in rows]))
+                    .values(attempts=EmailOutbox.attempts + 1, next_attempt_at=now + timedelta(seconds=self.lease_s))
+                )
+            await session.commit()
+        return [ClaimedEmail(row.id, row.recipient, row.subject, row.body, row.attempts + 1) for row in rows]
+
+    async def _record(self, results: list[dict]) -> None:
+        """Сохраняет итоги отправки пачки и обновляет глубину очереди."""
+        async with self.session_factory() as session:
+            for result in results:
+                await session.execute(
+                    update(EmailOutbox).where(EmailOutbox.id == result["id"])
+                    .values({key: value for key, value in result.items() if key != "id"})
+                )
+            await session.commit()
+            counts = await session.execute(
+                select(
+                    func.count().filter(EmailOutbox.attempts < self.max_attempts),
+                    func.count().filter(EmailOutbox.attempts >= self.max_attempts),
+                ).where(EmailOutbox.sent_at.is_(None))
+            )
+            self.queue_depth, self.dead = counts.one()
+
+    async def purge_old(self) -> int:
+        """Удаляет отправленные и исчерпавшие попытки письма старше retention_h часов; возвращает число удалённых."""
+        cutoff = datetime.now(timezone.utc) - timedelta(hours=self.retention_h)
+        async with self.session_factory() as session:
+            res = await session.execute(
+                delete(EmailOutbox).where(or_(
+                    EmailOutbox.sent_at < cutoff,
+                    and_(EmailOutbox.sent_at.is_(None), EmailOutbox.attempts >= self.max_attempts,
+                         EmailOutbox.created_at < cutoff),
+                ))
+            )
+            await session.commit()
+        purged = res.rowcount or 0
+        self.purged += purged
+        return purged
+
+    def wake(self) -> None:
+        """Будит отправителя сразу после коммита новых писем, не дожидаясь интервала."""
+        self._wakeup.set()
+
+    async def run(self) -> None:
+        """Бесконечный цикл отправки."""
+        while True:
+            try:
+                while await self.send_pending() >= self.batch_size:
+                    pass
+                if time.monotonic() >= self._next_purge:
+                    self._next_purge = time.monotonic() + self.purge_interval_s
+                    await self.purge_old()
+            except Exception:
+                logger.exception("Ошибка отправки писем из outbox")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval_s)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    def start(self) -> None:
+        """Запускает фоновую задачу отправки."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу и закрывает SMTP-соединение."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await asyncio.to_thread(self.smtp.close)
+
+    def stats(self) -> dict:
+        """Возвращает глубину очереди, число писем с исчерпанными попытками и задержки отправки."""
+        return {
+            "queue_depth": self.queue_depth,
+            "dead": self.dead,
+            "sent": self.sent,
+            "failed": self.failed,
+            "dead_lettered": self.dead_lettered,
+            "purged": self.purged,
+            "send_latency_avg_ms": self._latency_total / self.sent * 1000 if self.sent else 0.0,
+            "send_latency_max_ms": self._latency_max * 1000,
+        }
+
+    def _message(self, item: ClaimedEmail) -> EmailMessage:
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = item.recipient
+        msg["Subject"] = item.subject
+        msg.set_content(item.body)
+        return msg
+
+
+outbox_sender = OutboxSender(SessionLocal, SMTPConnection(SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_TLS))
+register_metrics("email_outbox", outbox_sender.stats)
@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from dotenv import load_dotenv
@@ -5,7 +6,17 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer
 
-from .database import create_all
+from .account_purge import account_purger
+from .config import TOKEN_REAPER_ENABLED, TOKENS_PARTITIONED
+from .database import SessionLocal, create_all, engine
+from .invalidation import invalidation_bus, RESYNC
+from .mailer import outbox_sender
+from .metrics import collect_metrics
+from .passwords import password_hasher
+from .token_maintenance import ensure_token_partitions, token_partition_keeper, token_reaper
+from .username_index import username_index
+from .utils import load_revoked_signed_tokens
+from .routers.admin import admin
 from .routers.auth import auth
 from .routers.comments import comments
 from .routers.users import users
@@ -18,11 +29,39 @@ origins = [
     "http://localhost:8080",
 ]
 
+def _resync(_event: dict) -> None:
+    # Кэши уже сброшены своими обработчиками RESYNC; состояние, которое нельзя просто сбросить, перечитывается из БД
+    loop = asyncio.get_running_loop()
+    loop.create_task(load_revoked_signed_tokens(SessionLocal))
+    loop.create_task(username_index.load(SessionLocal))
+
+invalidation_bus.subscribe(RESYNC, _resync)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Создание таблиц базы данных при запуске приложения."""
+    """Создание таблиц базы данных и запуск фоновых задач при старте, их остановка при завершении."""
     await create_all()
+    async with engine.begin() as conn:
+        await ensure_token_partitions(conn)
+    await invalidation_bus.start()
+    await load_revoked_signed_tokens(SessionLocal)
+    # Загрузка после подключения шины: переименования во время загрузки не теряются
+    await username_index.load(SessionLocal)
+    username_index.start(SessionLocal)
+    outbox_sender.start()
+    account_purger.start()
+    if TOKENS_PARTITIONED:
+        token_partition_keeper.start()
+    if TOKEN_REAPER_ENABLED:
+        token_reaper.start()
     yield
+    await token_reaper.stop()
+    await username_index.stop()
+    await token_partition_keeper.stop()
+    await account_purger.stop()
+    await outbox_sender.stop()
+    await invalidation_bus.stop()
+    password_hasher.shutdown()
 
 # Схема безопасности для Swagger UI
 security = HTTPBearer()
@@ -31,7 +70,7 @@ app = FastAPI(
     title="Opaque Auth Service",
     version="1.0.0",
     lifespan=lifespan,
-    openapi_tags=[{"name": "auth", "description": "Authentication operations"}, {"name": "users", "description": "User operations"}]
+    openapi_tags=[{"name": "auth", "description": "Authentication operations"}, {"name": "users", "description": "User operations"}, {"name": "admin", "description": "Admin operations"}]
 )
 app.add_middleware(
     CORSMiddleware,
@@ -39,12 +78,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "X-Total-Estimate", "ETag"],
 )
 app.include_router(auth)
 app.include_router(users)
 app.include_router(comments)
+app.include_router(admin)
 
 @app.get("/healthz")
 async def healthz():
     """Проверка здоровья сервиса."""
-    return {"status": "ok"}
\ No newline at end of file
+    return {"status": "ok"}
+
+@app.get("/metrics")
+async def metrics():
+    """Счётчики внутренних компонентов сервиса (кэши, фоновые задачи)."""
+    return collect_metrics()
@@ -0,0 +1,12 @@
+from typing import Callable
+
+# Реестр источников метрик: имя компонента -> функция, возвращающая его счётчики
+_providers: dict[str, Callable[[], dict]] = {}
+
+def register_metrics(name: str, provider: Callable[[], dict]) -> None:
+    """Регистрирует источник метрик под указанным именем."""
+    _providers[name] = provider
+
+def collect_metrics() -> dict[str, dict]:
+    """Собирает текущие значения всех зарегистрированных метрик."""
+    return {name: provider() for name, provider in _providers.items()}
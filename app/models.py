@@ -1,9 +1,10 @@
 from datetime import datetime, timezone
 
-from sqlalchemy import String, Boolean, DateTime, ForeignKey, UniqueConstraint, text
+from sqlalchemy import DDL, String, Boolean, DateTime, ForeignKey, Index, Integer, UniqueConstraint, event, text
 from sqlalchemy.dialects.postgresql import UUID as PGUUID
 from sqlalchemy.orm import Mapped, mapped_column, relationship
 
+from .config import COMMENTS_SEARCH_CONFIG, TOKENS_PARTITIONED
 from .database import Base
 
 
@@ -19,24 +20,53 @@ class User(Base):
     bio: Mapped[str | None] = mapped_column(String, nullable=True, default=None)
     is_profile_public: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
     is_collection_public: Mapped[bool] = mapped_column(Boolean, default=True, nullable=False)
+    # Момент запроса на удаление: аккаунт сразу недоступен, данные удаляются фоново (AccountPurger)
+    deleted_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, default=None, index=True)
+    # Момент последнего массового отзыва сессий: подписанные токены, выпущенные раньше, недействительны
+    # и после перезапуска воркера, когда список отзыва в памяти пуст
+    sessions_revoked_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, default=None)
 
-    tokens: Mapped[list["Token"]] = relationship(back_populates="user", cascade="all, delete-orphan")
+    # passive_deletes: токены не загружаются при удалении пользователя, их удаляет ON DELETE CASCADE или AccountPurger
+    tokens: Mapped[list["Token"]] = relationship(back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
+
+# Префиксный поиск username без учёта регистра (GET /users/search): диапазон по lower(username).
+# В Postgres индекс в сортировке "C" работает как text_pattern_ops и при этом отдаёт строки в порядке выдачи.
+# DDL, выполняемые после create_all, собраны по диалектам: те же команды применяет миграция Alembic к существующей БД.
+USERNAME_PREFIX_INDEX_DDL = {
+    "postgresql": [
+        'CREATE INDEX ix_users_username_prefix ON users ((lower(username) COLLATE "C"), (username COLLATE "C")) '
+        "WHERE deleted_at IS NULL",
+    ],
+    "sqlite": ["CREATE INDEX ix_users_username_prefix ON users (lower(username), username) WHERE deleted_at IS NULL"],
+}
+for _dialect, _statements in USERNAME_PREFIX_INDEX_DDL.items():
+    for _ddl in _statements:
+        event.listen(User.__table__, "after_create", DDL(_ddl).execute_if(dialect=_dialect))
 
 class Token(Base):
-    """Модель токена: хранит непрозрачные токены разных типов с TTL."""
+    """Модель токена: хранит непрозрачные токены разных типов с TTL.
+    При TOKENS_PARTITIONED таблица партиционируется по expires_at, и ключ партиции входит в PK и уникальный индекс."""
     __tablename__ = "tokens"
     id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
     user_id: Mapped[str] = mapped_column(ForeignKey("users.id", ondelete="CASCADE"), index=True)
-    token_hash: Mapped[str] = mapped_column(String, index=True, unique=True)
-    type: Mapped[str] = mapped_column(String)  # access | email_verify | reset
-    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True))
+    token_hash: Mapped[str] = mapped_column(String, index=True, unique=not TOKENS_PARTITIONED)
+    type: Mapped[str] = mapped_column(String)  # access | refresh | email_verify | reset | signed_revoked
+    expires_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), primary_key=TOKENS_PARTITIONED)
     revoked: Mapped[bool] = mapped_column(Boolean, default=False)
+    # Семейство токенов одной сессии: при повторном использовании refresh-токена отзывается всё семейство
+    family_id: Mapped[str | None] = mapped_column(String, nullable=True, index=True)
 
     user: Mapped[User] = relationship(back_populates="tokens")
 
-    __table_args__ = (
-        UniqueConstraint("token_hash", name="uq_token_hash"),
-    )
+    if TOKENS_PARTITIONED:
+        __table_args__ = (
+            UniqueConstraint("token_hash", "expires_at", name="uq_token_hash"),
+            {"postgresql_partition_by": "RANGE (expires_at)"},
+        )
+    else:
+        __table_args__ = (
+            UniqueConstraint("token_hash", name="uq_token_hash"),
+        )
 
 
 class Comment(Base):
@@ -51,3 +81,84 @@ class Comment(Base):
     created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
     updated_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc),
                                                  onupdate=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (
+        # Покрывает выборку ветки страницы с keyset-пагинацией по (created_at, id)
+        Index("ix_comments_thread", "game_name", "page", "created_at", "id"),
+        # Инкрементальная выгрузка GET /admin/comments/export?since=... в порядке (updated_at, id)
+        Index("ix_comments_updated", "updated_at", "id"),
+    )
+
+
+# Полнотекстовый индекс комментариев создаётся вместе с таблицей и обновляется самой БД при insert/update/delete.
+_search_config = COMMENTS_SEARCH_CONFIG.replace("'", "''")
+COMMENTS_SEARCH_DDL = {
+    # Postgres: генерируемая колонка tsvector (заголовок весомее текста) с GIN-индексом
+    "postgresql": [
+        f"ALTER TABLE comments ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+        f"setweight(to_tsvector('{_search_config}'::regconfig, coalesce(title, '')), 'A') || "
+        f"setweight(to_tsvector('{_search_config}'::regconfig, coalesce(comment_text, '')), 'B')) STORED",
+        "CREATE INDEX ix_comments_search ON comments USING GIN (search_vector)",
+    ],
+    # SQLite (тесты, встроенный режим): FTS5-таблица без содержимого, синхронизируемая триггерами. Её rowid —
+    # ключ из comments_fts_ids, а не неявный rowid comments (при String PK его может перенумеровать VACUUM);
+    # там же game_name, чтобы отбирать совпадения игры прямо в подзапросе поиска
+    "sqlite": [
+        "CREATE TABLE comments_fts_ids (id INTEGER PRIMARY KEY, comment_id TEXT NOT NULL UNIQUE, game_name TEXT NOT NULL)",
+        "CREATE VIRTUAL TABLE comments_fts USING fts5(title, comment_text, content='')",
+        "CREATE TRIGGER comments_fts_insert AFTER INSERT ON comments BEGIN "
+        "INSERT INTO comments_fts_ids(comment_id, game_name) VALUES (new.id, new.game_name); "
+        "INSERT INTO comments_fts(rowid, title, comment_text) "
+        "SELECT id, new.title, new.comment_text FROM comments_fts_ids WHERE comment_id = new.id; END",
+        "CREATE TRIGGER comments_fts_delete AFTER DELETE ON comments BEGIN "
+        "INSERT INTO comments_fts(comments_fts, rowid, title, comment_text) "
+        "SELECT 'delete', id, old.title, old.comment_text FROM comments_fts_ids WHERE comment_id = old.id; "
+        "DELETE FROM comments_fts_ids WHERE comment_id = old.id; END",
+        "CREATE TRIGGER comments_fts_update AFTER UPDATE OF title, comment_text ON comments BEGIN "
+        "INSERT INTO comments_fts(comments_fts, rowid, title, comment_text) "
+        "SELECT 'delete', id, old.title, old.comment_text FROM comments_fts_ids WHERE comment_id = old.id; "
+        "INSERT INTO comments_fts(rowid, title, comment_text) "
+        "SELECT id, new.title, new.comment_text FROM comments_fts_ids WHERE comment_id = new.id; END",
+    ],
+}
+# Заполнение индекса для комментариев, созданных до появления поиска (выполняет миграция Alembic);
+# в Postgres генерируемая колонка вычисляется сама
+COMMENTS_SEARCH_BACKFILL = {
+    "sqlite": [
+        "INSERT INTO comments_fts_ids(comment_id, game_name) SELECT id, game_name FROM comments",
+        "INSERT INTO comments_fts(rowid, title, comment_text) "
+        "SELECT m.id, c.title, c.comment_text FROM comments_fts_ids m JOIN comments c ON c.id = m.comment_id",
+    ],
+}
+for _dialect, _statements in COMMENTS_SEARCH_DDL.items():
+    for _ddl in _statements:
+        event.listen(Comment.__table__, "after_create", DDL(_ddl).execute_if(dialect=_dialect))
+
+
+class EmailOutbox(Base):
+    """Модель исходящего письма: пишется в одной транзакции с токеном, отправляется фоновым отправителем."""
+    __tablename__ = "email_outbox"
+    id: Mapped[int] = mapped_column(primary_key=True, autoincrement=True)
+    recipient: Mapped[str] = mapped_column(String, nullable=False)
+    subject: Mapped[str] = mapped_column(String, nullable=False)
+    body: Mapped[str] = mapped_column(String, nullable=False)
+    created_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    next_attempt_at: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
+    attempts: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    sent_at: Mapped[datetime | None] = mapped_column(DateTime(timezone=True), nullable=True, default=None)
+    last_error: Mapped[str | None] = mapped_column(String, nullable=True, default=None)
+
+    __table_args__ = (
+        Index("ix_email_outbox_pending", "sent_at", "next_attempt_at"),
+    )
+
+
+class CommentPage(Base):
+    """Модель состояния ветки комментариев страницы: версия для ETag, время последнего изменения и число комментариев."""
+    __tablename__ = "comment_pages"
+    game_name: Mapped[str] = mapped_column(String, primary_key=True)
+    page: Mapped[str] = mapped_column(String, primary_key=True)
+    version: Mapped[int] = mapped_column(Integer, default=0, nullable=False)
+    # Материализованное число комментариев страницы, поддерживается create/delete и пересчитывается командой rebuild
+    comment_count: Mapped[int] = mapped_column(Integer, default=0, server_default=text("0"), nullable=False)
+    last_modified: Mapped[datetime] = mapped_column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
@@ -0,0 +1,18 @@
+import base64
+
+from fastapi import HTTPException
+
+
+def encode_cursor(*values: str) -> str:
+    """Кодирует значения ключа сортировки последней записи в непрозрачный курсор."""
+    return base64.urlsafe_b64encode("\x1f".join(values).encode()).rstrip(b"=").decode()
+
+def decode_cursor(cursor: str, size: int) -> list[str]:
+    """Раскодирует курсор в значения ключа сортировки; при порче курсора отвечает 400."""
+    try:
+        values = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode().split("\x1f")
+    except ValueError:
+        values = []
+    if len(values) != size:
+        raise HTTPException(status_code=400, detail="Неверный курсор")
+    return values
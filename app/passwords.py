@@ -0,0 +1,91 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from typing import Callable
+
+from fastapi import HTTPException, status
+from passlib.context import CryptContext
+
+from .config import PASSWORD_HASH_WORKERS, PASSWORD_HASH_MAX_QUEUE
+from .metrics import register_metrics
+
+# Инициализация контекста для хеширования паролей
+pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+def _hash(password: str) -> str:
+    return pwd_ctx.hash(password)
+
+def _verify(password: str, hashed: str) -> bool:
+    return pwd_ctx.verify(password, hashed)
+
+
+class PasswordHasher:
+    """Асинхронное хеширование паролей в пуле процессов, чтобы bcrypt не блокировал event loop."""
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self._executor: Executor | None = None
+        self._pending = 0
+        self.calls = 0
+        self.rejected = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    async def hash(self, password: str) -> str:
+        """Возвращает bcrypt-хеш пароля."""
+        return await self._run(_hash, password)
+
+    async def verify(self, password: str, hashed: str) -> bool:
+        """Проверяет пароль против сохранённого хеша."""
+        return await self._run(_verify, password, hashed)
+
+    def shutdown(self) -> None:
+        """Останавливает пул процессов."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self) -> dict:
+        """Возвращает глубину очереди и задержки хеширования."""
+        return {
+            "workers": self.workers,
+            "queue_depth": self._pending,
+            "max_queue": self.max_queue,
+            "calls": self.calls,
+            "rejected": self.rejected,
+            "latency_avg_ms": self._latency_total / self.calls * 1000 if self.calls else 0.0,
+            "latency_max_ms": self._latency_max * 1000,
+        }
+
+    def _get_executor(self) -> Executor | None:
+        # При workers=0 используется пул потоков event loop по умолчанию (bcrypt отпускает GIL)
+        if self._executor is None and self.workers > 0:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    async def _run(self, fn: Callable, *args):
+        if self._pending >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Сервер перегружен, повторите попытку позже",
+                headers={"Retry-After": "1"},
+            )
+        self._pending += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._pending -= 1
+            elapsed = time.perf_counter() - started
+            self.calls += 1
+            self._latency_total += elapsed
+            self._latency_max = max(self._latency_max, elapsed)
+
+
+password_hasher = PasswordHasher(workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_MAX_QUEUE)
+register_metrics("password_hasher", password_hasher.stats)
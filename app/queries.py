@@ -0,0 +1,157 @@
+from datetime import datetime
+from typing import Iterable, NamedTuple, TypeVar
+
+from sqlalchemy import Select, asc, false, func, or_, select, text, tuple_, union_all
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from .models import Comment, User
+
+# Read-only слой для списочных эндпоинтов: Core-запросы только по нужным колонкам,
+# строки — компактные кортежи без identity map и ORM-инструментации. Изменения данных идут через ORM.
+
+_comments = Comment.__table__
+_users = User.__table__
+
+
+class CommentRow(NamedTuple):
+    """Комментарий с именем автора для выдачи в списках."""
+    id: str
+    user_id: str
+    username: str
+    game_name: str
+    page: str
+    title: str
+    comment_text: str
+    created_at: datetime
+    updated_at: datetime
+
+
+class UserRow(NamedTuple):
+    """Колонки пользователя, нужные для выдачи в списках (без хеша пароля)."""
+    id: str
+    username: str
+    email: str
+    role: str
+    is_email_verified: bool
+    bio: str | None
+    is_profile_public: bool
+    is_collection_public: bool
+
+
+class UsernameMatch(NamedTuple):
+    """Вариант автодополнения username."""
+    id: str
+    username: str
+
+
+Row = TypeVar("Row", bound=tuple)
+
+COMMENT_COLUMNS = tuple(
+    _users.c.username if name == "username" else _comments.c[name] for name in CommentRow._fields
+)
+USER_COLUMNS = tuple(_users.c[name] for name in UserRow._fields)
+
+
+def comment_rows_select() -> Select:
+    """SELECT колонок CommentRow из comments JOIN users; условия и сортировку добавляет вызывающий код."""
+    return select(*COMMENT_COLUMNS).select_from(_comments.join(_users, _comments.c.user_id == _users.c.id))
+
+async def fetch(session: AsyncSession, stmt: Select, dto: type[Row]) -> list[Row]:
+    """Выполняет Core-запрос на соединении сессии и упаковывает строки в dto."""
+    conn = await session.connection()
+    result = await conn.execute(stmt)
+    return list(map(dto._make, result))
+
+def split_rank(rows: Iterable[tuple]) -> list[tuple[CommentRow, float]]:
+    """Разделяет строки вида (колонки CommentRow..., rank) на пары (CommentRow, rank)."""
+    return [(CommentRow._make(row[:-1]), row[-1]) for row in rows]
+
+
+async def fetch_comment(session: AsyncSession, comment_id: str) -> CommentRow | None:
+    """Один комментарий с именем автора или None."""
+    rows = await fetch(session, comment_rows_select().where(_comments.c.id == comment_id), CommentRow)
+    return rows[0] if rows else None
+
+async def fetch_comment_thread(
+        session: AsyncSession, game_name: str, page: str, limit: int, after: tuple[datetime, str] | None = None
+) -> list[CommentRow]:
+    """Порция ветки страницы в порядке (created_at, id) после ключа after."""
+    stmt = comment_rows_select().where(_comments.c.game_name == game_name, _comments.c.page == page)
+    if after is not None:
+        stmt = stmt.where(tuple_(_comments.c.created_at, _comments.c.id) > tuple_(*after))
+    return await fetch(session, stmt.order_by(_comments.c.created_at, _comments.c.id).limit(limit), CommentRow)
+
+async def fetch_comment_pages(session: AsyncSession, game_name: str, pages: list[str], limit: int) -> list[CommentRow]:
+    """Первые limit комментариев каждой из страниц одним запросом, по порядку (page, created_at, id).
+    UNION ALL подзапросов со своим LIMIT: каждая страница читает по ix_comments_thread не больше limit строк."""
+    per_page = [
+        select(*comment_rows_select()
+               .where(_comments.c.game_name == game_name, _comments.c.page == page)
+               .order_by(_comments.c.created_at, _comments.c.id)
+               .limit(limit)
+               .subquery().c)
+        for page in pages
+    ]
+    combined = union_all(*per_page).subquery()
+    stmt = select(*combined.c).order_by(combined.c.page, combined.c.created_at, combined.c.id)
+    return await fetch(session, stmt, CommentRow)
+
+async def fetch_users(session: AsyncSession, limit: int, offset: int = 0, after_username: str | None = None) -> list[UserRow]:
+    """Страница неудалённых пользователей по алфавиту username.
+    С after_username — продолжение после этого имени по уникальному индексу, без пропуска offset строк."""
+    stmt = select(*USER_COLUMNS).where(_users.c.deleted_at.is_(None))
+    if after_username is not None:
+        stmt = stmt.where(_users.c.username > after_username)
+    stmt = stmt.order_by(asc(_users.c.username)).offset(offset or None).limit(limit)
+    return await fetch(session, stmt, UserRow)
+
+async def fetch_users_by_keys(session: AsyncSession, ids: list[str], usernames: list[str]) -> list[UserRow]:
+    """Неудалённые пользователи с id из ids или username из usernames — одним запросом с IN."""
+    conditions = []
+    if ids:
+        conditions.append(_users.c.id.in_(ids))
+    if usernames:
+        conditions.append(_users.c.username.in_(usernames))
+    stmt = select(*USER_COLUMNS).where(_users.c.deleted_at.is_(None), or_(false(), *conditions))
+    return await fetch(session, stmt, UserRow)
+
+def username_prefix_bounds(prefix: str) -> tuple[str, str]:
+    """Диапазон [lo, hi) ключей lower(username), начинающихся с prefix (символы username — ASCII)."""
+    lo = prefix.lower()
+    return lo, lo[:-1] + chr(ord(lo[-1]) + 1)
+
+async def fetch_username_matches(session: AsyncSession, prefix: str, limit: int) -> list[UsernameMatch]:
+    """Первые limit неудалённых пользователей, чей username начинается с prefix без учёта регистра.
+    Диапазонное условие по lower(username) обслуживается индексом ix_users_username_prefix."""
+    conn = await session.connection()
+    key, name = func.lower(_users.c.username), _users.c.username
+    if conn.dialect.name == "postgresql":
+        # Индекс построен в побайтовой сортировке "C": он же отдаёт строки уже упорядоченными
+        key, name = key.collate("C"), name.collate("C")
+    lo, hi = username_prefix_bounds(prefix)
+    stmt = (
+        select(_users.c.id, _users.c.username)
+        .where(_users.c.deleted_at.is_(None), key >= lo, key < hi)
+        .order_by(key, name)
+        .limit(limit)
+    )
+    return list(map(UsernameMatch._make, await conn.execute(stmt)))
+
+async def estimate_user_count(session: AsyncSession) -> int:
+    """Примерное число неудалённых пользователей. В PostgreSQL — из статистики планировщика без COUNT(*):
+    pg_class.reltuples, умноженное на долю NULL в deleted_at (pg_stats), чтобы, как и точный подсчёт,
+    не учитывать аккаунты, ожидающие удаления. До первого ANALYZE и в SQLite — точный подсчёт."""
+    conn = await session.connection()
+    if conn.dialect.name == "postgresql":
+        estimate = await conn.scalar(
+            text(
+                "SELECT round(c.reltuples * s.null_frac)::bigint FROM pg_class c "
+                "JOIN pg_namespace n ON n.oid = c.relnamespace "
+                "JOIN pg_stats s ON s.schemaname = n.nspname AND s.tablename = c.relname AND s.attname = 'deleted_at' "
+                "WHERE c.oid = CAST(:table AS regclass) AND c.reltuples >= 0"
+            ),
+            {"table": _users.name},
+        )
+        if estimate is not None:
+            return estimate
+    return await conn.scalar(select(func.count()).select_from(_users).where(_users.c.deleted_at.is_(None)))
@@ -0,0 +1,204 @@
+import json
+import logging
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Annotated, AsyncIterator, Optional
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+from fastapi.security import HTTPBearer
+from pydantic import ValidationError
+from sqlalchemy import and_, insert, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
+
+from ..account_purge import pending_deletions
+from ..comment_pages import bump_page
+from ..config import COMMENTS_EXPORT_BATCH_SIZE, COMMENTS_IMPORT_CHUNK_SIZE, COMMENTS_IMPORT_MAX_ROWS
+from ..dependencies import get_current_admin, get_db, get_session_factory
+from ..invalidation import invalidation_bus
+from ..models import Comment, User
+from ..schemas import CommentImportIn, CommentImportError, CommentImportOut
+from ..serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+NDJSON_TYPES = {"application/x-ndjson", "application/jsonl", "application/x-jsonlines"}
+
+security = HTTPBearer()
+
+admin = APIRouter(prefix="/admin", tags=["admin"], dependencies=[Depends(security), Depends(get_current_admin)])
+
+
+async def _export_comments(
+        session_factory: async_sessionmaker, game_name: Optional[str], since: Optional[datetime],
+        after_id: Optional[str] = None,
+) -> AsyncIterator[bytes]:
+    """Читает комментарии с серверного курсора пачками и отдаёт каждую пачку строками NDJSON.
+    Комментарии удалённых аккаунтов не выгружаются."""
+    stmt = (
+        select(
+            Comment.id, Comment.user_id, User.username, Comment.game_name, Comment.page,
+            Comment.title, Comment.comment_text, Comment.created_at, Comment.updated_at,
+        )
+        .join(User, Comment.user_id == User.id)
+        .where(User.deleted_at.is_(None))
+        .execution_options(yield_per=COMMENTS_EXPORT_BATCH_SIZE)
+    )
+    if game_name is not None:
+        stmt = stmt.where(Comment.game_name == game_name)
+    if since is None:
+        stmt = stmt.order_by(Comment.game_name, Comment.page, Comment.created_at, Comment.id)
+    else:
+        # Инкрементальная выгрузка идёт в порядке (updated_at, id): прерванную выгрузку продолжают
+        # с since и after_id последней полученной строки, ничего не пропуская и не повторяя
+        if after_id is None:
+            stmt = stmt.where(Comment.updated_at > since)
+        else:
+            stmt = stmt.where(or_(Comment.updated_at > since, and_(Comment.updated_at == since, Comment.id > after_id)))
+        stmt = stmt.order_by(Comment.updated_at, Comment.id)
+    # Сессия живёт столько же, сколько поток: зависимость get_db закрылась бы до отправки тела.
+    # Следующая пачка читается только после того, как клиент забрал предыдущую
+    async with session_factory() as session:
+        result = await session.stream(stmt)
+        async for rows in result.partitions():
+            yield b"".join(
+                dumps({
+                    "id": str(comment_id),
+                    "user_id": str(user_id),
+                    "username": username,
+                    "game_name": game,
+                    "page": page,
+                    "title": title,
+                    "comment_text": text,
+                    "created_at": created_at.isoformat(),
+                    "updated_at": updated_at.isoformat(),
+                }) + b"\n"
+                for comment_id, user_id, username, game, page, title, text, created_at, updated_at in rows
+            )
+
+
+@admin.get("/comments/export")
+async def export_comments(
+        session_factory: Annotated[async_sessionmaker, Depends(get_session_factory)],
+        game_name: Optional[str] = Query(None, description="Название игры; без него выгружаются все игры"),
+        since: Optional[datetime] = Query(None, description="Только комментарии, изменённые позже этого момента"),
+        after_id: Optional[str] = Query(None, description="id последней полученной строки с updated_at, равным since"),
+):
+    """
+    Потоково выгружает комментарии в формате NDJSON (по объекту на строку) с постоянным расходом памяти.
+    С параметром since строки идут в порядке (updated_at, id); прерванную выгрузку можно продолжить,
+    передав updated_at и id последней полученной строки в since и after_id.
+    """
+    if after_id is not None and since is None:
+        raise HTTPException(status_code=400, detail="after_id передаётся только вместе с since")
+    return StreamingResponse(
+        _export_comments(session_factory, game_name, since, after_id), media_type="application/x-ndjson"
+    )
+
+
+def _parse_import_body(body: bytes, content_type: str) -> tuple[list[tuple[int, object]], list[CommentImportError]]:
+    """Разбирает тело импорта (JSON-массив или NDJSON) в пары (номер строки, объект) и ошибки разбора."""
+    if content_type.split(";")[0].strip().lower() in NDJSON_TYPES:
+        rows, errors = [], []
+        for number, line in enumerate(body.splitlines(), start=1):
+            if not line.strip():
+                continue
+            try:
+                rows.append((number, json.loads(line)))
+            except ValueError:
+                errors.append(CommentImportError(row=number, detail="Неверный JSON"))
+        return rows, errors
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, list):
+        raise HTTPException(status_code=400, detail="Тело должно быть JSON-массивом или NDJSON")
+    return list(enumerate(data, start=1)), []
+
+def _describe(exc: ValidationError) -> str:
+    error = exc.errors()[0]
+    location = ".".join(str(part) for part in error["loc"])
+    return f"{location}: {error['msg']}" if location else error["msg"]
+
+
+@admin.post("/comments/import", response_model=CommentImportOut)
+async def import_comments(
+        request: Request,
+        current: Annotated[User, Depends(get_current_admin)],
+        db: Annotated[AsyncSession, Depends(get_db)],
+):
+    """
+    Массово импортирует комментарии из JSON-массива или NDJSON (Content-Type: application/x-ndjson).
+    Строки проверяются схемой CommentCreate и пишутся пачками многострочными INSERT;
+    ошибочные строки попадают в отчёт и не прерывают импорт остальных.
+    """
+    rows, errors = _parse_import_body(await request.body(), request.headers.get("content-type", ""))
+    if len(rows) + len(errors) > COMMENTS_IMPORT_MAX_ROWS:
+        raise HTTPException(status_code=400, detail=f"Можно импортировать не более {COMMENTS_IMPORT_MAX_ROWS} строк за запрос")
+    valid: list[tuple[int, CommentImportIn]] = []
+    for number, obj in rows:
+        try:
+            valid.append((number, CommentImportIn.model_validate(obj)))
+        except ValidationError as exc:
+            errors.append(CommentImportError(row=number, detail=_describe(exc)))
+
+    # id читается заранее: после rollback сбойной пачки атрибуты объекта истекают
+    default_author = current.id
+    imported = 0
+    for start in range(0, len(valid), COMMENTS_IMPORT_CHUNK_SIZE):
+        chunk = valid[start:start + COMMENTS_IMPORT_CHUNK_SIZE]
+        author_ids = {item.user_id for _, item in chunk if item.user_id}
+        known = set()
+        if author_ids:
+            known = set((await db.execute(select(User.id).where(User.id.in_(author_ids), User.deleted_at.is_(None)))).scalars())
+        now = datetime.now(timezone.utc)
+        numbers, values, pages = [], [], Counter()
+        for number, item in chunk:
+            if item.user_id and item.user_id not in known:
+                errors.append(CommentImportError(row=number, detail="Пользователь не найден"))
+                continue
+            created_at = item.created_at or now
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            numbers.append(number)
+            values.append({
+                "id": str(uuid.uuid4()),
+                "user_id": item.user_id or default_author,
+                "game_name": item.game_name,
+                "page": item.page,
+                "title": item.title,
+                "comment_text": item.comment_text,
+                "created_at": created_at,
+                "updated_at": created_at,
+            })
+            pages[(item.game_name, item.page)] += 1
+        if not values:
+            continue
+        # Пачка и счётчики её страниц пишутся одним коммитом; сбой пачки не затрагивает остальные
+        try:
+            await db.execute(insert(Comment), values)
+            for (game_name, page), count in pages.items():
+                await bump_page(db, game_name, page, count_delta=count)
+            await db.commit()
+        except SQLAlchemyError:
+            await db.rollback()
+            logger.exception("Не удалось записать пачку импорта комментариев")
+            errors.extend(CommentImportError(row=number, detail="Ошибка записи в БД") for number in numbers)
+            continue
+        imported += len(values)
+        for game_name, page in pages:
+            await invalidation_bus.comment_page_changed(game_name, page)
+
+    errors.sort(key=lambda error: error.row)
+    return CommentImportOut(imported=imported, errors=errors)
+
+
+@admin.get("/account-deletions")
+async def list_account_deletions(db: Annotated[AsyncSession, Depends(get_db)]):
+    """
+    Аккаунты, ожидающие фонового удаления, и сколько их токенов и комментариев ещё осталось.
+    """
+    return await pending_deletions(db)
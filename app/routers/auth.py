@@ -8,10 +8,14 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 
 from ..config import ACCESS_TOKEN_TTL_MIN, EMAIL_VERIF_TTL_H, RESET_TTL_H, APP_BASE_URL, REFRESH_TOKEN_TTL_DAYS
-from ..dependencies import get_db
+from ..dependencies import get_db, require_service_token
 from ..models import User, Token
-from ..schemas import UserOut, LoginIn, TokenOut, RequestResetIn, ResetPasswordIn, UserRegisterBase as UserRegister
-from ..utils import mint_token, send_email, hash_token, pwd_ctx, get_user_by_refresh_token, normalize_email
+from ..schemas import UserOut, LoginIn, TokenOut, RequestResetIn, ResetPasswordIn, IntrospectIn, IntrospectOut, UserRegisterBase as UserRegister
+from ..signed_tokens import is_signed_token
+from ..invalidation import invalidation_bus
+from ..passwords import password_hasher
+from ..mailer import enqueue_email, outbox_sender
+from ..utils import TokenSpec, mint_tokens, issue_session_tokens, hash_token, rotate_refresh_token, revoke_user_sessions, normalize_email, introspect_access_tokens
 
 auth = APIRouter(prefix="/auth", tags=["auth"])
 
@@ -26,19 +30,21 @@ async def register(payload: UserRegister, db: Annotated[AsyncSession, Depends(ge
         id=str(uuid.uuid4()),
         username=payload.username,
         email=normalize_email(payload.email),
-        password=pwd_ctx.hash(payload.password),
+        password=await password_hasher.hash(payload.password),
         role="user",  # Роль всегда "user" при регистрации
         # Позже заменить на False, если нужна верификация email
         is_email_verified=True
     )
     db.add(user)
+    (token,) = await mint_tokens(db, user, [TokenSpec("email_verify", timedelta(hours=EMAIL_VERIF_TTL_H))], commit=False)
+    link = f"{APP_BASE_URL}/auth/verify-email?token={token}"
+    enqueue_email(db, user.email, "Подтверждение email", f"Перейдите по ссылке для подтверждения: {link}")
+    # Пользователь, токен подтверждения и письмо сохраняются одним коммитом
     await db.commit()
+    outbox_sender.wake()
+    await invalidation_bus.username_changed(user.id, user.username)
     await db.refresh(user)
 
-    token = await mint_token(db, user, "email_verify", ttl=timedelta(hours=EMAIL_VERIF_TTL_H))
-    link = f"{APP_BASE_URL}/auth/verify-email?token={token}"
-    send_email(user.email, "Подтверждение email", f"Перейдите по ссылке для подтверждения: {link}")
-
     return UserOut.model_validate(user.__dict__)
 
 @auth.get("/verify-email")
@@ -48,7 +54,8 @@ async def verify_email(token: str, db: Annotated[AsyncSession, Depends(get_db)])
     now = datetime.now(timezone.utc)
     res = await db.execute(
         select(Token, User).join(User, Token.user_id == User.id).where(
-            Token.token_hash == th, Token.type == "email_verify", Token.revoked == False, Token.expires_at > now
+            Token.token_hash == th, Token.type == "email_verify", Token.revoked == False, Token.expires_at > now,
+            User.deleted_at.is_(None)
         )
     )
     row = res.first()
@@ -60,19 +67,19 @@ async def verify_email(token: str, db: Annotated[AsyncSession, Depends(get_db)])
     u.is_email_verified = True
     t.revoked = True
     await db.commit()
+    await invalidation_bus.user_changed(u.id)
     return {"detail": "Email подтверждён"}
 
 @auth.post("/login", response_model=TokenOut)
 async def login(body: LoginIn, db: Annotated[AsyncSession, Depends(get_db)], response: Response):
     """Проверяет логин/пароль и выдаёт access- и refresh-токены."""
-    res = await db.execute(select(User).where(User.username == body.username))
+    res = await db.execute(select(User).where(User.username == body.username, User.deleted_at.is_(None)))
     user = res.scalar_one_or_none()
-    if not user or not pwd_ctx.verify(body.password, user.password):
+    if not user or not await password_hasher.verify(body.password, user.password):
         raise HTTPException(status_code=401, detail="Неверные учётные данные")
     if not user.is_email_verified:
         raise HTTPException(status_code=403, detail="Email не подтверждён")
-    access_token = await mint_token(db, user, "access", ttl=timedelta(minutes=ACCESS_TOKEN_TTL_MIN))
-    refresh_token = await mint_token(db, user, "refresh", ttl=timedelta(days=REFRESH_TOKEN_TTL_DAYS))
+    access_token, refresh_token = await issue_session_tokens(db, user)
     response.set_cookie(
         key="refresh_token",
         value=refresh_token,
@@ -83,7 +90,8 @@ async def login(body: LoginIn, db: Annotated[AsyncSession, Depends(get_db)], res
     )
     return TokenOut(
         access_token=access_token,
-        expires_in=ACCESS_TOKEN_TTL_MIN * 60
+        expires_in=ACCESS_TOKEN_TTL_MIN * 60,
+        token_type="signed" if is_signed_token(access_token) else "opaque"
     )
 
 @auth.post("/refresh", response_model=TokenOut)
@@ -92,15 +100,9 @@ async def refresh_token(request: Request, response: Response, db: Annotated[Asyn
     refresh_token = request.cookies.get("refresh_token")
     if not refresh_token:
         raise HTTPException(status_code=400, detail="Refresh token missing")
-    user = await get_user_by_refresh_token(db, refresh_token)
-    th = hash_token(refresh_token)
-    res = await db.execute(select(Token).where(Token.token_hash == th, Token.type == "refresh"))
-    token = res.scalar_one_or_none()
-    if token:
-        token.revoked = True
-        await db.commit()
-    access_token = await mint_token(db, user, "access", ttl=timedelta(minutes=ACCESS_TOKEN_TTL_MIN))
-    new_refresh_token = await mint_token(db, user, "refresh", ttl=timedelta(days=REFRESH_TOKEN_TTL_DAYS))
+    user, family_id = await rotate_refresh_token(db, refresh_token)
+    # Отзыв старого refresh-токена и выпуск новой пары того же семейства — одним коммитом
+    access_token, new_refresh_token = await issue_session_tokens(db, user, family_id=family_id)
     response.set_cookie(
         key="refresh_token",
         value=new_refresh_token,
@@ -112,25 +114,37 @@ async def refresh_token(request: Request, response: Response, db: Annotated[Asyn
     return TokenOut(
         access_token=access_token,
         expires_in=ACCESS_TOKEN_TTL_MIN * 60,
-        refresh_token=new_refresh_token
+        refresh_token=new_refresh_token,
+        token_type="signed" if is_signed_token(access_token) else "opaque"
     )
 
+@auth.post("/introspect", response_model=IntrospectOut, dependencies=[Depends(require_service_token)])
+async def introspect(body: IntrospectIn, db: Annotated[AsyncSession, Depends(get_db)]):
+    """Пакетно проверяет access-токены для других сервисов: id пользователя, роль и срок действия каждого.
+    Вызывающий сервис предъявляет общий секрет в заголовке X-Service-Token."""
+    return IntrospectOut(results=await introspect_access_tokens(db, body.tokens))
+
 @auth.post("/request-password-reset")
 async def request_password_reset(data: RequestResetIn, db: Annotated[AsyncSession, Depends(get_db)]):
     """Создаёт токен/код для сброса пароля и отправляет на email."""
-    res = await db.execute(select(User).where(User.email == normalize_email(data.email)))
+    res = await db.execute(select(User).where(User.email == normalize_email(data.email), User.deleted_at.is_(None)))
     user = res.scalar_one_or_none()
     if not user:
         return {"detail": "Если email существует, инструкция отправлена"}
-    token = await mint_token(db, user, "reset", ttl=timedelta(hours=RESET_TTL_H))
-    link = f"{APP_BASE_URL}/auth/reset-password?token={token}"
     code = f"{secrets.randbelow(10**6):06d}"
-    await mint_token(db, user, "reset", ttl=timedelta(hours=RESET_TTL_H), raw_token=code)
-    send_email(
+    token, _ = await mint_tokens(db, user, [
+        TokenSpec("reset", timedelta(hours=RESET_TTL_H)),
+        TokenSpec("reset", timedelta(hours=RESET_TTL_H), raw_token=code),
+    ], commit=False)
+    link = f"{APP_BASE_URL}/auth/reset-password?token={token}"
+    enqueue_email(
+        db,
         user.email,  # type: ignore
         "Сброс пароля",
         f"Для сброса перейдите по ссылке: {link}\nИли введите код: {code}"
     )
+    await db.commit()
+    outbox_sender.wake()
     return {"detail": "Если email существует, инструкция отправлена"}
 
 @auth.post("/reset-password")
@@ -149,13 +163,17 @@ async def reset_password(data: ResetPasswordIn, db: Annotated[AsyncSession, Depe
     res = await db.execute(
         select(Token, User)
         .join(User, Token.user_id == User.id)
-        .where(Token.token_hash.in_(token_hashes), Token.type == "reset", Token.revoked == False, Token.expires_at > now)
+        .where(Token.token_hash.in_(token_hashes), Token.type == "reset", Token.revoked == False, Token.expires_at > now,
+               User.deleted_at.is_(None))
     )
     row = res.first()
     if not row:
         raise HTTPException(status_code=400, detail="Неверный или просроченный токен/код")
     t, u = row
-    u.password = pwd_ctx.hash(data.new_password)
+    u.password = await password_hasher.hash(data.new_password)
     t.revoked = True
+    # После сброса пароля все прежние сессии пользователя недействительны
+    await revoke_user_sessions(db, u.id)
     await db.commit()
+    await invalidation_bus.sessions_revoked(u.id)
     return {"detail": "Пароль сброшен"}
\ No newline at end of file
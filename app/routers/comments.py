@@ -1,14 +1,25 @@
 import uuid
-from typing import Annotated, List
+from datetime import datetime
+from typing import Annotated, List, Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Header, Query, Response
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer
-from sqlalchemy import select, and_
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from ..comment_cache import comment_cache, CachedThread
+from ..comment_feed import comment_feed, sse_events
+from ..comment_search import search_comments
+from ..comment_pages import bump_page, get_comment_counts, get_page_state, make_etag, http_date, not_modified
+from ..config import COMMENTS_PAGE_DEFAULT_LIMIT, COMMENTS_PAGE_MAX_LIMIT, COMMENTS_BATCH_MAX_PAGES
 from ..dependencies import get_db, get_current_user
+from ..invalidation import invalidation_bus
 from ..models import Comment, User
-from ..schemas import CommentCreate, CommentOut, CommentUpdate
+from ..pagination import encode_cursor, decode_cursor
+from ..queries import fetch_comment_pages, fetch_comment_thread
+from ..schemas import CommentBatchOut, CommentCountsOut, CommentCreate, CommentOut, CommentUpdate
+from ..serialization import FastJSONResponse, comment_out
 
 security = HTTPBearer()
 
@@ -19,31 +30,144 @@ comments = APIRouter(prefix="/comments", tags=["comments"])
 async def get_comments(
         game_name: str = Query(..., description="Название игры"),
         page: str = Query(..., description="Страница правил"),
+        limit: int = Query(COMMENTS_PAGE_DEFAULT_LIMIT, ge=1, le=COMMENTS_PAGE_MAX_LIMIT, description="Сколько комментариев вернуть"),
+        cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor предыдущего ответа"),
+        if_none_match: Optional[str] = Header(None),
+        if_modified_since: Optional[str] = Header(None),
         db: Annotated[AsyncSession, Depends(get_db)] = None
 ):
     """
-    Возвращает список комментариев для указанной игры и страницы.
+    Возвращает список комментариев для указанной игры и страницы в порядке (created_at, id).
+    Если есть следующая порция, её курсор передаётся в заголовке X-Next-Cursor.
+    Поддерживает условные запросы: при совпадении ETag отвечает 304 без загрузки комментариев.
+    Горячие ветки отдаются из кэша без обращения к БД.
     """
-    result = await db.execute(
-        select(Comment, User.username).join(User, Comment.user_id == User.id).where(  # type: ignore
-            and_(Comment.game_name == game_name, Comment.page == page)  # type: ignore
-        ).order_by(Comment.created_at)
+    key = (game_name, page, limit, cursor)
+    cached = comment_cache.get(key)
+    if cached is not None:
+        if not_modified(cached.headers["ETag"], cached.last_modified, if_none_match, if_modified_since):
+            return Response(status_code=304, headers=cached.headers)
+        return Response(content=cached.body, media_type="application/json", headers=cached.headers)
+
+    started_at = comment_cache.read_started()
+    version, last_modified = await get_page_state(db, game_name, page)
+    etag = make_etag(version, last_modified, limit, cursor)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    if not_modified(etag, last_modified, if_none_match, if_modified_since):
+        return Response(status_code=304, headers=headers)
+
+    after = None
+    if cursor:
+        created_at, comment_id = decode_cursor(cursor, 2)
+        try:
+            after = (datetime.fromisoformat(created_at), comment_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Неверный курсор")
+    rows = await fetch_comment_thread(db, game_name, page, limit + 1, after)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers["X-Next-Cursor"] = encode_cursor(last.created_at.isoformat(), str(last.id))
+    response = FastJSONResponse([comment_out(row, row.username) for row in rows], headers=headers)
+    comment_cache.put(key, CachedThread(response.body, headers, last_modified), started_at, (row.user_id for row in rows))
+    return response
+
+
+@comments.get("/batch", response_model=CommentBatchOut)
+async def get_comments_batch(
+        game_name: str = Query(..., description="Название игры"),
+        pages: Optional[List[str]] = Query(None, description="Список страниц"),
+        page_from: Optional[int] = Query(None, ge=0, description="Первая страница диапазона"),
+        page_to: Optional[int] = Query(None, ge=0, description="Последняя страница диапазона (включительно)"),
+        limit: int = Query(COMMENTS_PAGE_DEFAULT_LIMIT, ge=1, le=COMMENTS_PAGE_MAX_LIMIT, description="Сколько комментариев вернуть на страницу"),
+        db: Annotated[AsyncSession, Depends(get_db)] = None
+):
+    """
+    Возвращает комментарии нескольких страниц игры одним запросом к БД, сгруппированные по странице.
+    Страницы задаются списком pages и/или диапазоном page_from..page_to.
+    """
+    requested = list(dict.fromkeys(pages or []))
+    if page_from is not None or page_to is not None:
+        if page_from is None or page_to is None or page_from > page_to:
+            raise HTTPException(status_code=400, detail="Неверный диапазон страниц")
+        if page_to - page_from + 1 > COMMENTS_BATCH_MAX_PAGES:
+            raise HTTPException(status_code=400, detail=f"Можно запросить не более {COMMENTS_BATCH_MAX_PAGES} страниц")
+        requested.extend(p for p in map(str, range(page_from, page_to + 1)) if p not in requested)
+    if not requested:
+        raise HTTPException(status_code=400, detail="Нужно передать pages или page_from/page_to")
+    if len(requested) > COMMENTS_BATCH_MAX_PAGES:
+        raise HTTPException(status_code=400, detail=f"Можно запросить не более {COMMENTS_BATCH_MAX_PAGES} страниц")
+
+    # Первые limit + 1 комментариев каждой страницы: лишний показывает, что у страницы есть продолжение
+    grouped: dict[str, list[dict]] = {page: [] for page in requested}
+    next_cursors: dict[str, str] = {}
+    for row in await fetch_comment_pages(db, game_name, requested, limit + 1):
+        items = grouped[row.page]
+        if len(items) == limit:
+            last = items[-1]
+            next_cursors[row.page] = encode_cursor(last["created_at"], last["id"])
+            continue
+        items.append(comment_out(row, row.username))
+    return FastJSONResponse({"game_name": game_name, "pages": grouped, "next_cursors": next_cursors})
+
+
+@comments.get("/search", response_model=List[CommentOut])
+async def search(
+        q: str = Query(..., min_length=1, max_length=200, description="Поисковый запрос"),
+        game_name: str = Query(..., description="Название игры"),
+        limit: int = Query(COMMENTS_PAGE_DEFAULT_LIMIT, ge=1, le=COMMENTS_PAGE_MAX_LIMIT, description="Сколько комментариев вернуть"),
+        cursor: Optional[str] = Query(None, description="Курсор из заголовка X-Next-Cursor предыдущего ответа"),
+        db: Annotated[AsyncSession, Depends(get_db)] = None
+):
+    """
+    Полнотекстовый поиск по заголовкам и текстам комментариев игры, по убыванию релевантности.
+    Если есть следующая порция, её курсор передаётся в заголовке X-Next-Cursor.
+    """
+    after = None
+    if cursor:
+        rank, comment_id = decode_cursor(cursor, 2)
+        try:
+            after = (float(rank), comment_id)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Неверный курсор")
+    rows = await search_comments(db, q, game_name, limit + 1, after)
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last, last_rank = rows[-1]
+        headers["X-Next-Cursor"] = encode_cursor(repr(last_rank), str(last.id))
+    return FastJSONResponse([comment_out(row, row.username) for row, _ in rows], headers=headers)
+
+
+@comments.get("/stream")
+async def stream_comments(
+        game_name: str = Query(..., description="Название игры"),
+        page: str = Query(..., description="Страница правил"),
+):
+    """
+    Живая лента страницы (Server-Sent Events): события created, updated и deleted с комментарием в data.
+    При удалении аккаунта приходит одно событие author_deleted с user_id автора, чьи комментарии убраны со страницы.
+    Событие dropped означает, что клиент не успевал читать ленту; после переподключения ветку нужно перечитать.
+    """
+    sub = comment_feed.subscribe(game_name, page)
+    return StreamingResponse(
+        sse_events(comment_feed, sub),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
     )
-    comment_rows = result.all()
-    return [
-        CommentOut(
-            id=str(comment.id),
-            user_id=str(comment.user_id),
-            username=username,
-            game_name=comment.game_name,
-            page=comment.page,
-            title=comment.title,
-            comment_text=comment.comment_text,
-            created_at=comment.created_at.isoformat(),
-            updated_at=comment.updated_at.isoformat(),
-        )
-        for comment, username in comment_rows
-    ]
+
+
+@comments.get("/counts", response_model=CommentCountsOut)
+async def get_counts(
+        game_name: str = Query(..., description="Название игры"),
+        db: Annotated[AsyncSession, Depends(get_db)] = None
+):
+    """
+    Возвращает число комментариев для всех страниц игры; страницы без комментариев не выводятся.
+    """
+    return CommentCountsOut(game_name=game_name, counts=await get_comment_counts(db, game_name))
 
 
 @comments.post("/", response_model=CommentOut, dependencies=[Depends(security)])
@@ -64,19 +188,12 @@ async def create_comment(
         comment_text=data.comment_text,
     )
     db.add(new_comment)
+    await bump_page(db, data.game_name, data.page, count_delta=1)
     await db.commit()
     await db.refresh(new_comment)
-    return CommentOut(
-        id=str(new_comment.id),
-        user_id=str(new_comment.user_id),
-        username=current.username,  # type: ignore
-        game_name=new_comment.game_name,
-        page=new_comment.page,
-        title=new_comment.title,
-        comment_text=new_comment.comment_text,
-        created_at=new_comment.created_at.isoformat(),
-        updated_at=new_comment.updated_at.isoformat(),
-    )
+    out = comment_out(new_comment, current.username)
+    await invalidation_bus.comment_page_changed(data.game_name, data.page, action="created", comment=out)
+    return FastJSONResponse(out)
 
 
 @comments.put("/{comment_id}", response_model=CommentOut, dependencies=[Depends(security)])
@@ -97,19 +214,12 @@ async def update_comment(
         raise HTTPException(status_code=403, detail="Нет прав на изменение этого комментария")
     comment.title = data.title
     comment.comment_text = data.comment_text
+    await bump_page(db, comment.game_name, comment.page)
     await db.commit()
     await db.refresh(comment)
-    return CommentOut(
-        id=str(comment.id),
-        user_id=str(comment.user_id),
-        username=current.username,  # type: ignore
-        game_name=comment.game_name,
-        page=comment.page,
-        title=comment.title,
-        comment_text=comment.comment_text,
-        created_at=comment.created_at.isoformat(),
-        updated_at=comment.updated_at.isoformat(),
-    )
+    out = comment_out(comment, current.username)
+    await invalidation_bus.comment_page_changed(comment.game_name, comment.page, action="updated", comment=out)
+    return FastJSONResponse(out)
 
 
 @comments.delete("/{comment_id}", status_code=204, dependencies=[Depends(security)])
@@ -128,4 +238,9 @@ async def delete_comment(
     if comment.user_id != current.id:  # type: ignore
         raise HTTPException(status_code=403, detail="Нет прав на удаление этого комментария")
     await db.delete(comment)
+    await bump_page(db, comment.game_name, comment.page, count_delta=-1)
     await db.commit()
+    await invalidation_bus.comment_page_changed(
+        comment.game_name, comment.page, action="deleted",
+        comment={"id": str(comment.id), "game_name": comment.game_name, "page": comment.page},
+    )
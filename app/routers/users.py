@@ -1,15 +1,24 @@
+import uuid
 from fastapi import APIRouter, Depends, HTTPException, status, Query, Body, Request
 from fastapi.security import HTTPBearer
-from sqlalchemy import select, asc
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from datetime import timedelta
+from datetime import datetime, timedelta, timezone
 from typing import Annotated, Optional
 from pydantic import BaseModel
 
-from ..schemas import UserOut, UserPublicOut, ChangeUsernameIn, ChangeEmailIn, ChangePasswordIn
-from ..models import User
+from ..schemas import UserOut, UserPublicOut, UsernameMatchOut, UsersBatchIn, UsersBatchOut, ChangeUsernameIn, ChangeEmailIn, ChangePasswordIn, SessionOut
+from ..account_purge import account_purger
+from ..comment_pages import bump_author_pages
+from ..models import User, Token
 from ..dependencies import get_db, get_current_user
-from ..utils import send_email, mint_token, pwd_ctx
+from ..invalidation import invalidation_bus
+from ..passwords import password_hasher
+from ..mailer import enqueue_email, outbox_sender
+from ..queries import UserRow, estimate_user_count, fetch_username_matches, fetch_users, fetch_users_by_keys
+from ..serialization import FastJSONResponse, user_out, user_public_out
+from ..username_index import username_index
+from ..utils import TokenSpec, mint_tokens, revoke_signed_token, revoke_user_sessions
 from ..config import EMAIL_VERIF_TTL_H, APP_BASE_URL
 
 security = HTTPBearer()
@@ -21,56 +30,81 @@ async def get_me(current: Annotated[User, Depends(get_current_user)]):
     """
     Возвращает данные текущего пользователя по access-токену.
     """
-    return UserOut(
-        id=str(current.id),
-        username=str(current.username),
-        email=current.email,
-        role=str(current.role),
-        is_email_verified=current.is_email_verified,
-        bio=str(current.bio) if current.bio is not None else None,
-        is_profile_public=bool(current.is_profile_public),
-        is_collection_public=bool(current.is_collection_public),
-    )
+    return FastJSONResponse(user_out(current))
+
+@users.get("/search", response_model=list[UsernameMatchOut])
+async def search_usernames(
+    db: Annotated[AsyncSession, Depends(get_db)],
+    prefix: str = Query(..., min_length=1, max_length=32, pattern=r"^[A-Za-z0-9_]+$", description="Начало username"),
+    limit: int = Query(10, ge=1, le=50, description="Сколько вариантов вернуть"),
+):
+    """
+    Автодополнение username по префиксу без учёта регистра, по алфавиту.
+    Отвечает из индекса в памяти, если он включён (USERNAME_INDEX_ENABLED), иначе из индекса БД.
+    """
+    matches = username_index.search(prefix, limit)
+    if matches is None:
+        matches = await fetch_username_matches(db, prefix, limit)
+    return FastJSONResponse([m._asdict() for m in matches])
 
 @users.get("/{username}", response_model=UserPublicOut)
 async def get_user_profile(username: str, db: Annotated[AsyncSession, Depends(get_db)]):
     """
     Получить публичный профиль пользователя по username (с учётом приватности).
     """
-    res = await db.execute(select(User).where(User.username == username))
+    res = await db.execute(select(User).where(User.username == username, User.deleted_at.is_(None)))
     user = res.scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     if not user.is_profile_public:
         raise HTTPException(status_code=403, detail="Профиль скрыт настройками приватности")
-    return UserPublicOut(
-        id=str(user.id),
-        username=str(user.username),
-        bio=str(user.bio) if user.bio is not None else None,
-        is_profile_public=bool(user.is_profile_public),
-        is_collection_public=bool(user.is_collection_public),
-        role=str(user.role),
-    )
+    return FastJSONResponse(user_public_out(user))
 
 @users.get("/id/{user_id}", response_model=UserPublicOut)
 async def get_user_by_id(user_id: str, db: Annotated[AsyncSession, Depends(get_db)]):
     """
     Получить публичный профиль пользователя по id.
     """
-    res = await db.execute(select(User).where(User.id == user_id))
+    res = await db.execute(select(User).where(User.id == user_id, User.deleted_at.is_(None)))
     user = res.scalar_one_or_none()
     if not user:
         raise HTTPException(status_code=404, detail="Пользователь не найден")
     if not user.is_profile_public:
         raise HTTPException(status_code=403, detail="Профиль скрыт настройками приватности")
-    return UserPublicOut(
-        id=str(user.id),
-        username=str(user.username),
-        bio=str(user.bio) if user.bio is not None else None,
-        is_profile_public=bool(user.is_profile_public),
-        is_collection_public=bool(user.is_collection_public),
-        role=str(user.role),
-    )
+    return FastJSONResponse(user_public_out(user))
+
+@users.post("/batch", response_model=UsersBatchOut)
+async def get_users_batch(body: UsersBatchIn, db: Annotated[AsyncSession, Depends(get_db)]):
+    """
+    Публичные профили нескольких пользователей по id и/или username одним запросом к БД.
+    Скрытые профили попадают в hidden (только id и username), ненайденные — в missing_ids/missing_usernames.
+    """
+    # id — UUID: некорректные строки сразу считаются ненайденными, остальные приводятся к каноническому виду
+    ids: dict[str, str] = {}
+    for raw in body.ids:
+        try:
+            ids.setdefault(raw, str(uuid.UUID(raw)))
+        except ValueError:
+            pass
+    rows = await fetch_users_by_keys(db, list(set(ids.values())), list(set(body.usernames)))
+    by_id = {str(row.id): row for row in rows}
+    by_username = {row.username: row for row in rows}
+
+    found: dict[str, UserRow] = {}
+    for raw in body.ids:
+        row = by_id.get(ids.get(raw))
+        if row is not None:
+            found.setdefault(str(row.id), row)
+    for username in body.usernames:
+        row = by_username.get(username)
+        if row is not None:
+            found.setdefault(str(row.id), row)
+    return FastJSONResponse({
+        "users": [user_public_out(row) for row in found.values() if row.is_profile_public],
+        "hidden": [{"id": str(row.id), "username": row.username} for row in found.values() if not row.is_profile_public],
+        "missing_ids": list(dict.fromkeys(raw for raw in body.ids if ids.get(raw) not in by_id)),
+        "missing_usernames": list(dict.fromkeys(u for u in body.usernames if u not in by_username)),
+    })
 
 @users.patch("/me/username", response_model=UserOut, dependencies=[Depends(security)])
 async def change_username(data: ChangeUsernameIn, current: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)]):
@@ -81,18 +115,14 @@ async def change_username(data: ChangeUsernameIn, current: Annotated[User, Depen
     if exists.scalar_one_or_none():
         raise HTTPException(status_code=400, detail="username уже занят")
     current.username = data.new_username
+    # username входит в ответы веток комментариев: их версии меняются тем же коммитом одним UPDATE,
+    # а кэш веток сбрасывается по автору событием username_changed, без события на каждую страницу
+    await bump_author_pages(db, current.id)
     await db.commit()
+    await invalidation_bus.user_changed(current.id)
+    await invalidation_bus.username_changed(current.id, current.username)
     await db.refresh(current)
-    return UserOut(
-        id=str(current.id),
-        username=str(current.username),
-        email=current.email,
-        role=str(current.role),
-        is_email_verified=current.is_email_verified,
-        bio=str(current.bio) if current.bio is not None else None,
-        is_profile_public=bool(current.is_profile_public),
-        is_collection_public=bool(current.is_collection_public),
-    )
+    return FastJSONResponse(user_out(current))
 
 @users.patch("/me/email", response_model=UserOut, dependencies=[Depends(security)])
 async def change_email(data: ChangeEmailIn, current: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)]):
@@ -105,31 +135,50 @@ async def change_email(data: ChangeEmailIn, current: Annotated[User, Depends(get
         raise HTTPException(status_code=400, detail="email уже используется")
     current.email = new_email
     current.is_email_verified = False
+    (token,) = await mint_tokens(db, current, [TokenSpec("email_verify", timedelta(hours=EMAIL_VERIF_TTL_H))], commit=False)
+    link = f"{APP_BASE_URL}/auth/verify-email?token={token}"
+    enqueue_email(db, str(current.email), "Подтверждение нового email", f"Перейдите по ссылке: {link}")
+    # Новый email, токен подтверждения и письмо сохраняются одним коммитом
     await db.commit()
+    outbox_sender.wake()
+    await invalidation_bus.user_changed(current.id)
     await db.refresh(current)
-    token = await mint_token(db, current, "email_verify", ttl=timedelta(hours=EMAIL_VERIF_TTL_H))
-    link = f"{APP_BASE_URL}/auth/verify-email?token={token}"
-    send_email(str(current.email), "Подтверждение нового email", f"Перейдите по ссылке: {link}")
-    return UserOut(
-        id=str(current.id),
-        username=str(current.username),
-        email=current.email,
-        role=str(current.role),
-        is_email_verified=current.is_email_verified,
-        bio=str(current.bio) if current.bio is not None else None,
-        is_profile_public=bool(current.is_profile_public),
-        is_collection_public=bool(current.is_collection_public),
-    )
+    return FastJSONResponse(user_out(current))
 
 @users.patch("/me/password", dependencies=[Depends(security)])
 async def change_password(data: ChangePasswordIn, current: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)]):
     """Меняет пароль после проверки текущего пароля."""
-    if not pwd_ctx.verify(data.current_password, current.password):
+    if not await password_hasher.verify(data.current_password, current.password):
         raise HTTPException(status_code=400, detail="Текущий пароль неверен")
-    current.password = pwd_ctx.hash(data.new_password)
+    current.password = await password_hasher.hash(data.new_password)
+    # Смена пароля завершает все сессии, включая текущую
+    await revoke_user_sessions(db, current.id)
     await db.commit()
+    await invalidation_bus.sessions_revoked(current.id)
     return {"detail": "Пароль изменён"}
 
+@users.get("/me/sessions", response_model=list[SessionOut], dependencies=[Depends(security)])
+async def list_sessions(current: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)]):
+    """Возвращает активные сессии (действующие refresh-токены) текущего пользователя."""
+    now = datetime.now(timezone.utc)
+    res = await db.execute(
+        select(Token.id, Token.family_id, Token.expires_at)
+        .where(Token.user_id == current.id, Token.type == "refresh", Token.revoked == False, Token.expires_at > now)
+        .order_by(Token.expires_at.desc())
+    )
+    return [
+        SessionOut(id=token_id, family_id=family_id, expires_at=expires_at.isoformat())
+        for token_id, family_id, expires_at in res.all()
+    ]
+
+@users.post("/me/sessions/revoke-all", dependencies=[Depends(security)])
+async def revoke_all_sessions(current: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)]):
+    """Завершает все сессии текущего пользователя одним UPDATE."""
+    revoked = await revoke_user_sessions(db, current.id)
+    await db.commit()
+    await invalidation_bus.sessions_revoked(current.id)
+    return {"detail": "Все сессии завершены", "revoked": revoked}
+
 class ChangeProfileIn(BaseModel):
     bio: Optional[str] = None
     is_profile_public: Optional[bool] = None
@@ -149,17 +198,9 @@ async def change_profile(
     if data.is_collection_public is not None:
         current.is_collection_public = data.is_collection_public
     await db.commit()
+    await invalidation_bus.user_changed(current.id)
     await db.refresh(current)
-    return UserOut(
-        id=str(current.id),
-        username=str(current.username),
-        email=current.email,
-        role=str(current.role),
-        is_email_verified=current.is_email_verified,
-        bio=str(current.bio) if current.bio is not None else None,
-        is_profile_public=bool(current.is_profile_public),
-        is_collection_public=bool(current.is_collection_public),
-    )
+    return FastJSONResponse(user_out(current))
 
 from fastapi.responses import JSONResponse
 
@@ -169,7 +210,10 @@ async def logout(
     current: Annotated[User, Depends(get_current_user)],
     db: Annotated[AsyncSession, Depends(get_db)]
 ):
-    """Отзывает refresh-токен и удаляет его из куки."""
+    """Отзывает refresh-токен и удаляет его из куки; подписанный access-токен попадает в список отзыва."""
+    authorization = request.headers.get("Authorization", "")
+    if " " in authorization:
+        await revoke_signed_token(db, authorization.split(" ", 1)[1].strip())
     refresh_token = request.cookies.get("refresh_token")
     if refresh_token:
         from ..utils import hash_token
@@ -180,37 +224,40 @@ async def logout(
         if token:
             token.revoked = True
             await db.commit()
+            await invalidation_bus.token_revoked(th)
     response = JSONResponse(status_code=status.HTTP_200_OK, content={"detail": "Logged out successfully"})
     response.delete_cookie("refresh_token")
     return response
 
 @users.delete("/me", dependencies=[Depends(security)])
 async def delete_account(current: Annotated[User, Depends(get_current_user)], db: Annotated[AsyncSession, Depends(get_db)]):
-    """Удаляет аккаунт текущего пользователя."""
-    await db.delete(current)
+    """Помечает аккаунт текущего пользователя удалённым и завершает его сессии.
+    Токены, комментарии и сама запись удаляются фоново пачками (AccountPurger)."""
+    current.deleted_at = datetime.now(timezone.utc)
+    await revoke_user_sessions(db, current.id)
     await db.commit()
-    return JSONResponse(status_code=status.HTTP_200_OK, content={"detail": "Account deleted"})
+    await invalidation_bus.sessions_revoked(current.id)
+    await invalidation_bus.user_changed(current.id)
+    await invalidation_bus.username_changed(current.id, None)
+    account_purger.wake()
+    return JSONResponse(status_code=status.HTTP_202_ACCEPTED, content={"detail": "Account deletion scheduled"})
 
 @users.get("/", response_model=list[UserOut])
 async def list_users(
     db: Annotated[AsyncSession, Depends(get_db)],
     limit: int = Query(20, ge=1, le=100, description="Сколько пользователей вернуть"),
-    offset: int = Query(0, ge=0, description="Смещение для пагинации")
+    offset: int = Query(0, ge=0, description="Смещение для пагинации"),
+    after_username: Optional[str] = Query(None, description="Вернуть пользователей после этого username (последнего на предыдущей странице)"),
+    with_total: bool = Query(False, description="Добавить в заголовок X-Total-Estimate примерное число пользователей"),
 ):
     """
     Получить список аккаунтов с пагинацией и сортировкой по алфавиту (username).
+    Для обхода всех пользователей используйте after_username вместо offset: глубокие страницы не сканируют пропущенные строки.
     """
-    res = await db.execute(
-        select(User).order_by(asc(User.username)).offset(offset).limit(limit)
-    )
-    users_list = res.scalars().all()
-    return [UserOut(
-        id=str(u.id),
-        username=str(u.username),
-        email=u.email,
-        role=str(u.role),
-        is_email_verified=u.is_email_verified,
-        bio=str(u.bio) if u.bio is not None else None,
-        is_profile_public=bool(u.is_profile_public),
-        is_collection_public=bool(u.is_collection_public),
-    ) for u in users_list]
+    if after_username is not None and offset:
+        raise HTTPException(status_code=400, detail="Нельзя использовать offset вместе с after_username")
+    headers = None
+    if with_total:
+        headers = {"X-Total-Estimate": str(await estimate_user_count(db))}
+    rows = await fetch_users(db, limit, offset, after_username)
+    return FastJSONResponse([user_out(u) for u in rows], headers=headers)
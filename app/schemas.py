@@ -1,7 +1,11 @@
 import re
+import uuid
+from datetime import datetime
 from typing import Annotated, Literal, Optional
 
-from pydantic import BaseModel, EmailStr, Field, field_validator
+from pydantic import BaseModel, EmailStr, Field, field_validator, model_validator
+
+from .config import INTROSPECT_MAX_TOKENS, USERS_BATCH_MAX_ITEMS
 
 USERNAME_RE = re.compile(r"^[a-zA-Z0-9_]{3,32}$")
 ALLOWED_ROLES = {"user", "admin"}
@@ -60,7 +64,28 @@ class TokenOut(BaseModel):
     access_token: str
     expires_in: int
     refresh_token: str | None = None  # refresh_token теперь опционален
-    token_type: Literal["opaque"] = "opaque"
+    token_type: Literal["opaque", "signed"] = "opaque"
+
+class IntrospectIn(BaseModel):
+    """Схема для пакетной проверки access-токенов."""
+    tokens: Annotated[list[str], Field(min_length=1, max_length=INTROSPECT_MAX_TOKENS, description="Проверяемые access-токены")]
+
+class TokenIntrospection(BaseModel):
+    """Результат проверки одного токена."""
+    active: bool
+    user_id: str | None = None
+    role: str | None = None
+    expires_at: str | None = None
+
+class IntrospectOut(BaseModel):
+    """Результаты проверки в порядке переданных токенов."""
+    results: list[TokenIntrospection]
+
+class SessionOut(BaseModel):
+    """Схема для вывода активной сессии пользователя."""
+    id: int
+    family_id: str | None = None
+    expires_at: str
 
 class RefreshTokenIn(BaseModel):  # схема для запроса обновления
     """Схема для обновления токена."""
@@ -131,6 +156,35 @@ class UserPublicOut(BaseModel):
     role: str
 
 
+class UsernameMatchOut(BaseModel):
+    """Схема варианта автодополнения username."""
+    id: str
+    username: str
+
+
+class UsersBatchIn(BaseModel):
+    """Схема пакетного запроса публичных профилей по id и/или username."""
+    ids: list[str] = []
+    usernames: list[str] = []
+
+    @model_validator(mode="after")
+    def validate_size(self):
+        total = len(self.ids) + len(self.usernames)
+        if not total:
+            raise ValueError("Нужно передать ids или usernames")
+        if total > USERS_BATCH_MAX_ITEMS:
+            raise ValueError(f"Не больше {USERS_BATCH_MAX_ITEMS} id и username за запрос")
+        return self
+
+
+class UsersBatchOut(BaseModel):
+    """Схема ответа пакетного запроса профилей: найденные публичные, скрытые настройками приватности и ненайденные."""
+    users: list[UserPublicOut]
+    hidden: list[UsernameMatchOut]
+    missing_ids: list[str]
+    missing_usernames: list[str]
+
+
 class CommentCreate(BaseModel):
     """Схема для создания комментария."""
     game_name: str
@@ -139,6 +193,35 @@ class CommentCreate(BaseModel):
     comment_text: Annotated[str, Field(min_length=1, max_length=1000)]
 
 
+class CommentImportIn(CommentCreate):
+    """Схема строки массового импорта: комментарий, автор (по умолчанию — импортирующий админ) и исходная дата."""
+    user_id: Optional[str] = None
+    created_at: Optional[datetime] = None
+
+    @field_validator("user_id")
+    @classmethod
+    def validate_user_id(cls, v: Optional[str]) -> Optional[str]:
+        # id пользователей — UUID: некорректное значение отклоняется здесь, а не ошибкой запроса к БД
+        if v is None:
+            return v
+        try:
+            return str(uuid.UUID(v))
+        except ValueError:
+            raise ValueError("user_id должен быть UUID")
+
+
+class CommentImportError(BaseModel):
+    """Ошибка в строке импорта (номер строки начинается с 1)."""
+    row: int
+    detail: str
+
+
+class CommentImportOut(BaseModel):
+    """Итог массового импорта комментариев."""
+    imported: int
+    errors: list[CommentImportError]
+
+
 class CommentOut(BaseModel):
     """Схема для вывода комментария."""
     id: str
@@ -152,6 +235,20 @@ class CommentOut(BaseModel):
     updated_at: str
 
 
+class CommentBatchOut(BaseModel):
+    """Схема для вывода комментариев нескольких страниц, сгруппированных по странице."""
+    game_name: str
+    pages: dict[str, list[CommentOut]]
+    # Курсоры для GET /comments/ по страницам, где комментариев больше limit
+    next_cursors: dict[str, str] = {}
+
+
+class CommentCountsOut(BaseModel):
+    """Схема для вывода числа комментариев по страницам игры."""
+    game_name: str
+    counts: dict[str, int]
+
+
 class CommentUpdate(BaseModel):
     """Схема для обновления комментария."""
     title: Annotated[str, Field(min_length=1, max_length=200)]
@@ -0,0 +1,69 @@
+import json
+from typing import Any
+
+from fastapi.responses import JSONResponse
+
+from .models import Comment, User
+from .queries import CommentRow, UserRow
+
+try:
+    import orjson
+except ImportError:  # без orjson сериализация остаётся корректной, только медленнее
+    orjson = None
+
+
+def dumps(content: Any) -> bytes:
+    """Сериализует готовые dict/list в JSON-байты: orjson, если установлен, иначе stdlib json."""
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON-ответ из уже собранных словарей. Возврат Response из обработчика отключает повторную
+    валидацию через response_model, который остаётся только для документации OpenAPI."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+# Отображения ORM-объектов и строк app/queries.py -> словарь в форме схем ответа (UserOut, UserPublicOut, CommentOut) без создания моделей Pydantic.
+# Набор и порядок ключей сверяется со схемами в тестах.
+
+def user_out(user: User | UserRow) -> dict:
+    """Данные пользователя для владельца аккаунта (форма UserOut)."""
+    return {
+        "id": str(user.id),
+        "username": user.username,
+        "email": user.email,
+        "role": user.role,
+        "is_email_verified": user.is_email_verified,
+        "bio": user.bio,
+        "is_profile_public": bool(user.is_profile_public),
+        "is_collection_public": bool(user.is_collection_public),
+    }
+
+def user_public_out(user: User | UserRow) -> dict:
+    """Публичный профиль пользователя (форма UserPublicOut)."""
+    return {
+        "id": str(user.id),
+        "username": user.username,
+        "bio": user.bio,
+        "is_profile_public": bool(user.is_profile_public),
+        "is_collection_public": bool(user.is_collection_public),
+        "role": user.role,
+    }
+
+def comment_out(comment: Comment | CommentRow, username: str) -> dict:
+    """Комментарий с именем автора (форма CommentOut)."""
+    return {
+        "id": str(comment.id),
+        "user_id": str(comment.user_id),
+        "username": username,
+        "game_name": comment.game_name,
+        "page": comment.page,
+        "title": comment.title,
+        "comment_text": comment.comment_text,
+        "created_at": comment.created_at.isoformat(),
+        "updated_at": comment.updated_at.isoformat(),
+    }
@@ -0,0 +1,141 @@
+import base64
+import hashlib
+import hmac
+import secrets
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from threading import Lock
+
+from .config import ACCESS_TOKEN_SECRET, ACCESS_TOKEN_TTL_MIN
+from .invalidation import invalidation_bus, TOKEN_REVOKED, SESSIONS_REVOKED
+from .metrics import register_metrics
+
+# Префикс отличает подписанные токены от opaque без обращения к БД
+SIGNED_PREFIX = "s1."
+
+
+@dataclass(frozen=True, slots=True)
+class SignedClaims:
+    """Данные, зашитые в подписанный access-токен."""
+    user_id: str
+    role: str
+    issued_at_ms: int
+    expires_at: datetime
+
+
+def _b64encode(raw: bytes) -> str:
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode()
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+def _sign(payload: str) -> str:
+    return _b64encode(hmac.new(ACCESS_TOKEN_SECRET.encode(), payload.encode(), hashlib.sha256).digest())
+
+def is_signed_token(raw: str) -> bool:
+    """Проверяет, что токен выпущен в подписанном (stateless) режиме."""
+    return raw.startswith(SIGNED_PREFIX)
+
+def sign_access_token(user_id: str, role: str, ttl: timedelta) -> tuple[str, datetime]:
+    """Выпускает HMAC-подписанный access-токен с id пользователя, ролью и сроком действия."""
+    now = datetime.now(timezone.utc)
+    expires = now + ttl
+    # Случайный nonce делает каждый токен уникальным (хеш токена — ключ кэша и списка отзыва);
+    # время выпуска в миллисекундах нужно для массового отзыва сессий пользователя
+    body = f"{user_id}|{role}|{int(now.timestamp() * 1000)}|{int(expires.timestamp())}|{secrets.token_urlsafe(6)}"
+    payload = _b64encode(body.encode())
+    return f"{SIGNED_PREFIX}{payload}.{_sign(payload)}", expires
+
+def verify_access_token(raw: str) -> SignedClaims | None:
+    """Проверяет подпись и срок действия токена; возвращает claims или None."""
+    if not is_signed_token(raw):
+        return None
+    try:
+        payload, signature = raw[len(SIGNED_PREFIX):].split(".", 1)
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        user_id, role, iat, exp, _nonce = _b64decode(payload).decode().split("|")
+        iat_ms, exp_ts = int(iat), int(exp)
+    except ValueError:
+        return None
+    if exp_ts <= time.time():
+        return None
+    return SignedClaims(
+        user_id=user_id, role=role, issued_at_ms=iat_ms, expires_at=datetime.fromtimestamp(exp_ts, timezone.utc)
+    )
+
+
+def issued_before(claims: SignedClaims, moment: datetime | None) -> bool:
+    """Проверяет, выпущен ли токен не позже moment (момента массового отзыва сессий из БД)."""
+    if moment is None:
+        return False
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return claims.issued_at_ms <= int(moment.timestamp() * 1000)
+
+
+class RevocationList:
+    """Небольшой список досрочно отозванных подписанных токенов: хеш -> момент истечения.
+    Дополнительно хранит для пользователей момент массового отзыва: токены, выпущенные раньше, недействительны."""
+
+    def __init__(self):
+        self._entries: dict[str, float] = {}
+        # user_id -> (момент отзыва в мс, когда запись можно забыть)
+        self._user_cutoffs: dict[str, tuple[int, float]] = {}
+        self._lock = Lock()
+
+    def add(self, token_hash: str, expires_at: datetime) -> None:
+        """Добавляет токен; запись хранится только до истечения самого токена."""
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            self._entries[token_hash] = expires_at.timestamp()
+
+    def revoke_user_before(self, user_id: str, cutoff_ms: int, max_ttl_s: float) -> None:
+        """Отзывает все токены пользователя, выпущенные до cutoff_ms; запись живёт, пока они могут быть действительны."""
+        now = time.time()
+        with self._lock:
+            self._prune(now)
+            previous = self._user_cutoffs.get(user_id, (0, 0.0))[0]
+            self._user_cutoffs[user_id] = (max(previous, cutoff_ms), now + max_ttl_s)
+
+    def is_revoked(self, token_hash: str, claims: "SignedClaims") -> bool:
+        """Проверяет токен по списку отзыва и по моменту массового отзыва сессий его владельца."""
+        if token_hash in self:
+            return True
+        with self._lock:
+            cutoff = self._user_cutoffs.get(claims.user_id)
+            return cutoff is not None and claims.issued_at_ms <= cutoff[0]
+
+    def __contains__(self, token_hash: str) -> bool:
+        with self._lock:
+            exp = self._entries.get(token_hash)
+            return exp is not None and exp > time.time()
+
+    def stats(self) -> dict:
+        """Возвращает размер списка отзыва."""
+        return {"size": len(self._entries), "users": len(self._user_cutoffs)}
+
+    def _prune(self, now: float) -> None:
+        expired = [h for h, exp in self._entries.items() if exp <= now]
+        for h in expired:
+            del self._entries[h]
+        stale = [u for u, (_, forget_at) in self._user_cutoffs.items() if forget_at <= now]
+        for u in stale:
+            del self._user_cutoffs[u]
+
+
+revoked_signed_tokens = RevocationList()
+register_metrics("signed_token_revocations", revoked_signed_tokens.stats)
+
+
+def _on_token_revoked(event: dict) -> None:
+    if event.get("signed") and event.get("expires_at"):
+        revoked_signed_tokens.add(event["token_hash"], datetime.fromtimestamp(event["expires_at"], timezone.utc))
+
+def _on_sessions_revoked(event: dict) -> None:
+    revoked_signed_tokens.revoke_user_before(event["user_id"], event["before_ms"], ACCESS_TOKEN_TTL_MIN * 60)
+
+invalidation_bus.subscribe(TOKEN_REVOKED, _on_token_revoked)
+invalidation_bus.subscribe(SESSIONS_REVOKED, _on_sessions_revoked)
@@ -0,0 +1,134 @@
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields
+from datetime import datetime, timezone
+from threading import Lock
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from .config import ACCESS_TOKEN_CACHE_SIZE, ACCESS_TOKEN_CACHE_TTL_S
+from .invalidation import invalidation_bus, TOKEN_REVOKED, USER_CHANGED, SESSIONS_REVOKED, RESYNC
+from .metrics import register_metrics
+from .models import User
+
+
+@dataclass(frozen=True, slots=True)
+class UserSnapshot:
+    """Лёгкий снимок колонок пользователя, достаточный для обработки запроса без обращения к БД."""
+    id: str
+    username: str
+    email: str
+    password: str
+    role: str
+    is_email_verified: bool
+    bio: str | None
+    is_profile_public: bool
+    is_collection_public: bool
+    deleted_at: datetime | None = None
+    sessions_revoked_at: datetime | None = None
+
+    @classmethod
+    def from_user(cls, user: User) -> "UserSnapshot":
+        """Снимает значения колонок с ORM-объекта пользователя."""
+        return cls(**{f.name: getattr(user, f.name) for f in fields(cls)})
+
+    async def attach(self, session: AsyncSession) -> User:
+        """Восстанавливает ORM-объект из снимка и прикрепляет его к сессии без SELECT."""
+        user = User(**{f.name: getattr(self, f.name) for f in fields(self)})
+        make_transient_to_detached(user)
+        return await session.merge(user, load=False)
+
+
+class TokenCache:
+    """Ограниченный LRU-кэш с TTL: хеш access-токена -> снимок пользователя."""
+
+    def __init__(self, maxsize: int, ttl_s: float):
+        self.maxsize = maxsize
+        self.ttl_s = ttl_s
+        self._entries: OrderedDict[str, tuple[float, UserSnapshot]] = OrderedDict()
+        self._by_user: dict[str, set[str]] = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token_hash: str) -> UserSnapshot | None:
+        """Возвращает снимок по хешу токена или None, если записи нет или она истекла."""
+        with self._lock:
+            entry = self._entries.get(token_hash)
+            if entry is None:
+                self.misses += 1
+                return None
+            deadline, snapshot = entry
+            if deadline <= time.time():
+                self._drop(token_hash)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token_hash)
+            self.hits += 1
+            return snapshot
+
+    def put(self, token_hash: str, snapshot: UserSnapshot, expires_at: datetime) -> None:
+        """Кладёт снимок в кэш; запись живёт не дольше TTL кэша и срока действия токена."""
+        if self.maxsize <= 0:
+            return
+        if expires_at.tzinfo is None:
+            expires_at = expires_at.replace(tzinfo=timezone.utc)
+        deadline = min(time.time() + self.ttl_s, expires_at.timestamp())
+        with self._lock:
+            self._drop(token_hash)
+            self._entries[token_hash] = (deadline, snapshot)
+            self._by_user.setdefault(snapshot.id, set()).add(token_hash)
+            while len(self._entries) > self.maxsize:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.evictions += 1
+
+    def invalidate(self, token_hash: str) -> None:
+        """Удаляет запись для отозванного токена."""
+        with self._lock:
+            self._drop(token_hash)
+
+    def invalidate_user(self, user_id: str) -> None:
+        """Удаляет все записи пользователя (смена данных, пароля, удаление аккаунта)."""
+        with self._lock:
+            for token_hash in list(self._by_user.get(str(user_id), ())):
+                self._drop(token_hash)
+
+    def clear(self) -> None:
+        """Полностью очищает кэш."""
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self) -> dict:
+        """Возвращает счётчики попаданий и промахов."""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": self.hits / total if total else 0.0,
+        }
+
+    def _drop(self, token_hash: str) -> None:
+        entry = self._entries.pop(token_hash, None)
+        if entry is None:
+            return
+        user_id = entry[1].id
+        hashes = self._by_user.get(user_id)
+        if hashes is not None:
+            hashes.discard(token_hash)
+            if not hashes:
+                del self._by_user[user_id]
+
+
+access_token_cache = TokenCache(maxsize=ACCESS_TOKEN_CACHE_SIZE, ttl_s=ACCESS_TOKEN_CACHE_TTL_S)
+register_metrics("access_token_cache", access_token_cache.stats)
+invalidation_bus.subscribe(TOKEN_REVOKED, lambda event: access_token_cache.invalidate(event["token_hash"]))
+invalidation_bus.subscribe(USER_CHANGED, lambda event: access_token_cache.invalidate_user(event["user_id"]))
+invalidation_bus.subscribe(SESSIONS_REVOKED, lambda event: access_token_cache.invalidate_user(event["user_id"]))
+invalidation_bus.subscribe(RESYNC, lambda event: access_token_cache.clear())
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import re
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import and_, delete, or_, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, async_sessionmaker
+
+from .config import (
+    TOKEN_REAPER_BATCH_SIZE, TOKEN_REAPER_INTERVAL_S, TOKEN_REAPER_MAX_BATCHES,
+    TOKENS_PARTITIONED, TOKENS_PARTITION_MONTHS_AHEAD, TOKENS_PARTITION_CHECK_INTERVAL_S, REFRESH_TOKEN_TTL_DAYS,
+)
+from .database import SessionLocal
+from .metrics import register_metrics
+from .models import Token
+
+logger = logging.getLogger(__name__)
+
+PARTITION_NAME_RE = re.compile(r"^tokens_p(\d{4})_(\d{2})$")
+
+
+def _add_months(year: int, month: int, delta: int) -> tuple[int, int]:
+    index = year * 12 + (month - 1) + delta
+    return index // 12, index % 12 + 1
+
+async def ensure_token_partitions(conn: AsyncConnection, months_ahead: int = TOKENS_PARTITION_MONTHS_AHEAD) -> list[str]:
+    """Создаёт помесячные партиции tokens по expires_at на текущий и months_ahead следующих месяцев (только PostgreSQL)."""
+    if not TOKENS_PARTITIONED or conn.dialect.name != "postgresql":
+        return []
+    # Партиции должны покрывать самый долгоживущий токен (refresh)
+    months_ahead = max(months_ahead, REFRESH_TOKEN_TTL_DAYS // 28 + 1)
+    now = datetime.now(timezone.utc)
+    created = []
+    for delta in range(months_ahead + 1):
+        year, month = _add_months(now.year, now.month, delta)
+        next_year, next_month = _add_months(year, month, 1)
+        name = f"tokens_p{year:04d}_{month:02d}"
+        await conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF tokens "
+            f"FOR VALUES FROM ('{year:04d}-{month:02d}-01') TO ('{next_year:04d}-{next_month:02d}-01')"
+        ))
+        created.append(name)
+    return created
+
+async def drop_expired_token_partitions(conn: AsyncConnection) -> list[str]:
+    """Удаляет партиции, все токены в которых уже истекли: DROP TABLE вместо построчного удаления."""
+    if not TOKENS_PARTITIONED or conn.dialect.name != "postgresql":
+        return []
+    res = await conn.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = 'tokens'"
+    ))
+    now = datetime.now(timezone.utc)
+    dropped = []
+    for (name,) in res.all():
+        match = PARTITION_NAME_RE.match(name)
+        if not match:
+            continue
+        end_year, end_month = _add_months(int(match.group(1)), int(match.group(2)), 1)
+        if datetime(end_year, end_month, 1, tzinfo=timezone.utc) <= now:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+    return dropped
+
+
+class TokenReaper:
+    """Периодически удаляет истёкшие и отозванные токены ограниченными пачками."""
+
+    def __init__(self, session_factory: async_sessionmaker, batch_size: int = TOKEN_REAPER_BATCH_SIZE,
+                 max_batches: int = TOKEN_REAPER_MAX_BATCHES, interval_s: float = TOKEN_REAPER_INTERVAL_S):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.max_batches = max_batches
+        self.interval_s = interval_s
+        self._task: asyncio.Task | None = None
+        self.runs = 0
+        self.errors = 0
+        self.deleted_total = 0
+        self.last_deleted = 0
+        self.last_duration_ms = 0.0
+        self.partitions_dropped = 0
+
+    async def reap_once(self) -> int:
+        """Один проход: удаляет до batch_size * max_batches строк, каждая пачка — отдельная короткая транзакция."""
+        started = time.perf_counter()
+        deleted = 0
+        for _ in range(self.max_batches):
+            now = datetime.now(timezone.utc)
+            batch = (
+                select(Token.id)
+                # Отозванные refresh-токены живут до истечения: по ним распознаётся повторное использование
+                .where(or_(Token.expires_at <= now, and_(Token.revoked == True, Token.type != "refresh")))
+                .limit(self.batch_size)
+                .scalar_subquery()
+            )
+            async with self.session_factory() as session:
+                res = await session.execute(
+                    delete(Token).where(Token.id.in_(batch)).execution_options(synchronize_session=False)
+                )
+                await session.commit()
+            deleted += res.rowcount or 0
+            if (res.rowcount or 0) < self.batch_size:
+                break
+        async with self.session_factory() as session:
+            conn = await session.connection()
+            self.partitions_dropped += len(await drop_expired_token_partitions(conn))
+            await session.commit()
+        self.runs += 1
+        self.deleted_total += deleted
+        self.last_deleted = deleted
+        self.last_duration_ms = (time.perf_counter() - started) * 1000
+        return deleted
+
+    async def run(self) -> None:
+        """Бесконечный цикл очистки с паузой interval_s между проходами."""
+        while True:
+            try:
+                await self.reap_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("Ошибка очистки таблицы tokens")
+            await asyncio.sleep(self.interval_s)
+
+    def start(self) -> None:
+        """Запускает фоновую задачу очистки."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу очистки."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Возвращает счётчики очистки."""
+        return {
+            "runs": self.runs,
+            "errors": self.errors,
+            "deleted_total": self.deleted_total,
+            "last_deleted": self.last_deleted,
+            "last_duration_ms": self.last_duration_ms,
+            "partitions_dropped": self.partitions_dropped,
+        }
+
+
+class TokenPartitionKeeper:
+    """Периодически создаёт партиции tokens на ближайшие месяцы. Работает независимо от TokenReaper:
+    без новых партиций вставка токенов начнёт падать, даже если очистка отключена."""
+
+    def __init__(self, session_factory: async_sessionmaker, interval_s: float = TOKENS_PARTITION_CHECK_INTERVAL_S):
+        self.session_factory = session_factory
+        self.interval_s = interval_s
+        self._task: asyncio.Task | None = None
+        self.runs = 0
+        self.errors = 0
+
+    async def ensure_once(self) -> list[str]:
+        """Создаёт недостающие партиции; возвращает имена партиций, покрывающих текущий и следующие месяцы."""
+        async with self.session_factory() as session:
+            partitions = await ensure_token_partitions(await session.connection())
+            await session.commit()
+        self.runs += 1
+        return partitions
+
+    async def run(self) -> None:
+        """Бесконечный цикл с паузой interval_s между проверками."""
+        while True:
+            try:
+                await self.ensure_once()
+            except Exception:
+                self.errors += 1
+                logger.exception("Ошибка создания партиций tokens")
+            await asyncio.sleep(self.interval_s)
+
+    def start(self) -> None:
+        """Запускает фоновую задачу."""
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self) -> None:
+        """Останавливает фоновую задачу."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Возвращает счётчики проверок."""
+        return {"runs": self.runs, "errors": self.errors}
+
+
+token_reaper = TokenReaper(SessionLocal)
+register_metrics("token_reaper", token_reaper.stats)
+token_partition_keeper = TokenPartitionKeeper(SessionLocal)
+register_metrics("token_partitions", token_partition_keeper.stats)
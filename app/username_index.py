@@ -0,0 +1,193 @@
+import asyncio
+import logging
+from bisect import bisect_left, insort
+from threading import Lock
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from .config import USERNAME_INDEX_ENABLED, USERNAME_INDEX_MAX_USERS, USERNAME_INDEX_RELOAD_INTERVAL_S
+from .invalidation import invalidation_bus, USERNAME_CHANGED
+from .metrics import register_metrics
+from .models import User
+from .queries import UsernameMatch, username_prefix_bounds
+
+logger = logging.getLogger(__name__)
+
+# Размер блока отсортированного списка: вставка и удаление сдвигают не больше 2 * _CHUNK элементов
+_CHUNK = 512
+
+
+class UsernameIndex:
+    """Отсортированный в памяти индекс username для автодополнения. Ключ — "lower(username)\\0username",
+    поэтому порядок совпадает с выдачей из БД, а префикс ищется двоичным поиском.
+    Записи (ключ, id) лежат блоками по _CHUNK, так что переименование не сдвигает весь список.
+    Загружается при старте, поддерживается событиями USERNAME_CHANGED со всех воркеров и периодически
+    перечитывается из БД (и после переподключения шины), чтобы исправить расхождения из-за потерянных событий.
+    Занимает порядка 300-400 байт на пользователя в каждом воркере; при числе пользователей больше max_users
+    не загружается, и поиск идёт по индексу БД."""
+
+    def __init__(self, enabled: bool = True, max_users: int = USERNAME_INDEX_MAX_USERS,
+                 reload_interval_s: float = USERNAME_INDEX_RELOAD_INTERVAL_S):
+        self.enabled = enabled
+        self.max_users = max_users
+        self.reload_interval_s = reload_interval_s
+        self.loaded = False
+        self._chunks: list[list[tuple[str, str]]] = []
+        self._maxes: list[tuple[str, str]] = []
+        self._by_id: dict[str, str] = {}
+        # События, пришедшие во время загрузки, применяются поверх загруженного снимка
+        self._pending: list[tuple[str, str | None]] | None = None
+        self._lock = Lock()
+        self._task: asyncio.Task | None = None
+        self.hits = 0
+        self.reloads = 0
+        self.too_large = False
+
+    async def load(self, session_factory: async_sessionmaker) -> None:
+        """Загружает username всех неудалённых пользователей (при первом запуске и при перечитывании)."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._pending = []
+        async with session_factory() as session:
+            res = await session.execute(
+                select(User.id, User.username).where(User.deleted_at.is_(None)).limit(self.max_users + 1)
+            )
+            rows = sorted((_key(username), str(user_id), username) for user_id, username in res)
+        if len(rows) > self.max_users:
+            with self._lock:
+                self._pending = None
+                self._chunks, self._maxes, self._by_id = [], [], {}
+                self.loaded = False
+            self.too_large = True
+            logger.warning("Индекс username не загружен: пользователей больше %d, поиск идёт по БД", self.max_users)
+            return
+        entries = [(key, user_id) for key, user_id, _ in rows]
+        with self._lock:
+            self._chunks = [entries[i:i + _CHUNK] for i in range(0, len(entries), _CHUNK)]
+            self._maxes = [chunk[-1] for chunk in self._chunks]
+            self._by_id = {user_id: username for _, user_id, username in rows}
+            pending, self._pending = self._pending, None
+            for user_id, username in pending:
+                self._apply(user_id, username)
+            self.loaded = True
+        self.too_large = False
+        self.reloads += 1
+        logger.info("Индекс username загружен: %d пользователей", len(self._by_id))
+
+    def search(self, prefix: str, limit: int) -> list[UsernameMatch] | None:
+        """Первые limit совпадений по префиксу без учёта регистра; None, если индекс не загружен."""
+        if not self.loaded:
+            return None
+        lo, hi = username_prefix_bounds(prefix)
+        matches: list[UsernameMatch] = []
+        with self._lock:
+            c = bisect_left(self._maxes, (lo,))
+            start = bisect_left(self._chunks[c], (lo,)) if c < len(self._chunks) else 0
+            while c < len(self._chunks) and len(matches) < limit:
+                for key, user_id in self._chunks[c][start:]:
+                    if key >= hi or len(matches) == limit:
+                        break
+                    matches.append(UsernameMatch(user_id, self._by_id[user_id]))
+                else:
+                    c, start = c + 1, 0
+                    continue
+                break
+        self.hits += 1
+        return matches
+
+    def set(self, user_id: str, username: str | None) -> None:
+        """Добавляет, переименовывает (username) или убирает (None) пользователя."""
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((user_id, username))
+            elif self.loaded:
+                self._apply(user_id, username)
+
+    def clear(self) -> None:
+        """Сбрасывает индекс в незагруженное состояние."""
+        with self._lock:
+            self._chunks, self._maxes, self._by_id = [], [], {}
+            self.loaded = False
+
+    async def run(self, session_factory: async_sessionmaker) -> None:
+        """Бесконечный цикл периодического перечитывания индекса из БД."""
+        while True:
+            await asyncio.sleep(self.reload_interval_s)
+            try:
+                await self.load(session_factory)
+            except Exception:
+                logger.exception("Ошибка перечитывания индекса username")
+
+    def start(self, session_factory: async_sessionmaker) -> None:
+        """Запускает фоновое перечитывание индекса."""
+        if self.enabled and self.reload_interval_s > 0 and self._task is None:
+            self._task = asyncio.create_task(self.run(session_factory))
+
+    async def stop(self) -> None:
+        """Останавливает фоновое перечитывание индекса."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> dict:
+        """Возвращает размер индекса и число обслуженных запросов."""
+        return {
+            "enabled": self.enabled,
+            "loaded": self.loaded,
+            "too_large": self.too_large,
+            "entries": len(self._by_id),
+            "hits": self.hits,
+            "reloads": self.reloads,
+        }
+
+    def _apply(self, user_id: str, username: str | None) -> None:
+        old = self._by_id.pop(user_id, None)
+        if old is not None:
+            self._remove((_key(old), user_id))
+        if username is not None:
+            self._insert((_key(username), user_id))
+            self._by_id[user_id] = username
+
+    def _insert(self, entry: tuple[str, str]) -> None:
+        if not self._chunks:
+            self._chunks, self._maxes = [[entry]], [entry]
+            return
+        c = min(bisect_left(self._maxes, entry), len(self._chunks) - 1)
+        chunk = self._chunks[c]
+        insort(chunk, entry)
+        self._maxes[c] = chunk[-1]
+        if len(chunk) > 2 * _CHUNK:
+            tail = chunk[_CHUNK:]
+            del chunk[_CHUNK:]
+            self._chunks.insert(c + 1, tail)
+            self._maxes[c] = chunk[-1]
+            self._maxes.insert(c + 1, tail[-1])
+
+    def _remove(self, entry: tuple[str, str]) -> None:
+        c = bisect_left(self._maxes, entry)
+        if c == len(self._chunks):
+            return
+        chunk = self._chunks[c]
+        i = bisect_left(chunk, entry)
+        if i < len(chunk) and chunk[i] == entry:
+            del chunk[i]
+            if chunk:
+                self._maxes[c] = chunk[-1]
+            else:
+                del self._chunks[c]
+                del self._maxes[c]
+
+
+def _key(username: str) -> str:
+    return f"{username.lower()}\0{username}"
+
+
+username_index = UsernameIndex(enabled=USERNAME_INDEX_ENABLED)
+register_metrics("username_index", username_index.stats)
+invalidation_bus.subscribe(USERNAME_CHANGED, lambda event: username_index.set(event["user_id"], event["username"]))
@@ -1,67 +1,225 @@
 import secrets
 import hashlib
+import uuid
 from datetime import datetime, timedelta, timezone
-from email.message import EmailMessage
-import smtplib
-from typing import Optional
-from passlib.context import CryptContext
+from typing import NamedTuple, Optional
 
 from fastapi import HTTPException, status
-from sqlalchemy import select
-from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker
 
 from .models import User, Token
-from .config import SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_FROM, SMTP_TLS
+from .schemas import TokenIntrospection
+from .passwords import pwd_ctx  # noqa: F401 — реэкспорт для обратной совместимости
+from .invalidation import invalidation_bus
+from .token_cache import access_token_cache, UserSnapshot
+from .signed_tokens import is_signed_token, issued_before, sign_access_token, verify_access_token, revoked_signed_tokens
+from .config import ACCESS_TOKEN_MODE, ACCESS_TOKEN_TTL_MIN, REFRESH_TOKEN_TTL_DAYS
 
-# Инициализация контекста для хеширования паролей
-pwd_ctx = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Тип строки tokens для досрочно отозванного подписанного токена: хранится до его истечения (затем удаляет reaper)
+SIGNED_REVOKED_TYPE = "signed_revoked"
 
 def hash_token(raw: str) -> str:
     """Возвращает SHA-256 хеш токена (не храним токен в открытом виде)."""
     return hashlib.sha256(raw.encode()).hexdigest()
 
-def send_email(to: str, subject: str, text: str) -> None:
-    """Отправляет письмо через SMTP; если SMTP не настроен — выводит в консоль."""
-    if not SMTP_HOST:
-        print("\n=== EMAIL (mock) ===\nTo:", to, "\nSubject:", subject, "\n", text, "\n====================\n")
-        return
-    msg = EmailMessage()
-    msg["From"] = SMTP_FROM
-    msg["To"] = to
-    msg["Subject"] = subject
-    msg.set_content(text)
-    with smtplib.SMTP(SMTP_HOST, SMTP_PORT) as s:
-        if SMTP_TLS:
-            s.starttls()
-        if SMTP_USERNAME and SMTP_PASSWORD:
-            s.login(SMTP_USERNAME, SMTP_PASSWORD)
-        s.send_message(msg)
+class TokenSpec(NamedTuple):
+    """Описание токена для пакетного выпуска: тип, TTL и (необязательно) готовое значение."""
+    ttype: str
+    ttl: timedelta
+    raw_token: Optional[str] = None
+
+async def mint_tokens(session: AsyncSession, user: User, specs: list[TokenSpec], commit: bool = True,
+                      family_id: Optional[str] = None) -> list[str]:
+    """Создаёт несколько opaque-токенов одной вставкой и одним коммитом; возвращает их значения в порядке specs.
+    С commit=False токены только добавляются в сессию — коммит делает вызывающий код."""
+    now = datetime.now(timezone.utc)
+    raw_tokens = [spec.raw_token or secrets.token_urlsafe(48) for spec in specs]
+    session.add_all([
+        Token(user_id=user.id, token_hash=hash_token(raw), type=spec.ttype, expires_at=now + spec.ttl, revoked=False,
+              family_id=family_id)
+        for spec, raw in zip(specs, raw_tokens)
+    ])
+    if commit:
+        await session.commit()
+    return raw_tokens
 
 async def mint_token(session: AsyncSession, user: User, ttype: str, ttl: timedelta, raw_token: Optional[str] = None) -> str:
     """Создаёт новый opaque-токен указанного типа и сохраняет его хеш и TTL. Если raw_token передан — использует его вместо генерации."""
-    if raw_token is None:
-        raw_token = secrets.token_urlsafe(48)
-    token_h = hash_token(raw_token)
-    expires = datetime.now(timezone.utc) + ttl
-    session.add(Token(user_id=user.id, token_hash=token_h, type=ttype, expires_at=expires, revoked=False))
-    await session.commit()
-    return raw_token
+    tokens = await mint_tokens(session, user, [TokenSpec(ttype, ttl, raw_token)])
+    return tokens[0]
+
+async def issue_session_tokens(session: AsyncSession, user: User, family_id: Optional[str] = None) -> tuple[str, str]:
+    """Выпускает пару access/refresh одним коммитом (вместе с прочими изменениями в сессии).
+    В режиме signed access-токен подписывается и в БД не пишется. Без family_id начинается новое семейство."""
+    family_id = family_id or str(uuid.uuid4())
+    access_ttl = timedelta(minutes=ACCESS_TOKEN_TTL_MIN)
+    refresh_spec = TokenSpec("refresh", timedelta(days=REFRESH_TOKEN_TTL_DAYS))
+    if ACCESS_TOKEN_MODE == "signed":
+        access_token, _ = sign_access_token(str(user.id), str(user.role), access_ttl)
+        (refresh_token,) = await mint_tokens(session, user, [refresh_spec], family_id=family_id)
+        return access_token, refresh_token
+    access_token, refresh_token = await mint_tokens(
+        session, user, [TokenSpec("access", access_ttl), refresh_spec], family_id=family_id
+    )
+    return access_token, refresh_token
+
+async def rotate_refresh_token(session: AsyncSession, token: str) -> tuple[User, str | None]:
+    """Атомарно отзывает refresh-токен одним условным UPDATE ... RETURNING и возвращает владельца и семейство.
+    Повторное предъявление уже отозванного токена считается кражей: отзывается всё семейство."""
+    th = hash_token(token)
+    now = datetime.now(timezone.utc)
+    res = await session.execute(
+        update(Token)
+        .where(Token.token_hash == th, Token.type == "refresh", Token.revoked == False, Token.expires_at > now)
+        .values(revoked=True)
+        .returning(Token.user_id, Token.family_id)
+        .execution_options(synchronize_session=False)
+    )
+    row = res.first()
+    if row is None:
+        reused_family = (
+            select(Token.family_id)
+            .where(Token.token_hash == th, Token.type == "refresh", Token.revoked == True, Token.family_id.is_not(None))
+            .scalar_subquery()
+        )
+        res = await session.execute(
+            update(Token)
+            .where(Token.family_id == reused_family, Token.revoked == False)
+            .values(revoked=True)
+            .returning(Token.token_hash)
+            .execution_options(synchronize_session=False)
+        )
+        revoked_hashes = res.scalars().all()
+        await session.commit()
+        for revoked_hash in revoked_hashes:
+            await invalidation_bus.token_revoked(revoked_hash)
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный или просроченный refresh-токен")
+    user_id, family_id = row
+    user = await session.get(User, user_id)
+    if not user:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный или просроченный refresh-токен")
+    return user, family_id
+
+async def revoke_user_sessions(session: AsyncSession, user_id: str) -> int:
+    """Отзывает все access- и refresh-токены пользователя одним UPDATE, не загружая User.tokens,
+    и запоминает момент отзыва в users.sessions_revoked_at для подписанных токенов.
+    Коммит и публикацию события sessions_revoked выполняет вызывающий код."""
+    await session.execute(
+        update(User).where(User.id == user_id).values(sessions_revoked_at=datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    res = await session.execute(
+        update(Token)
+        .where(Token.user_id == user_id, Token.type.in_(("access", "refresh")), Token.revoked == False)
+        .values(revoked=True)
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount or 0
+
+async def revoke_signed_token(session: AsyncSession, token: str) -> None:
+    """Досрочно отзывает подписанный access-токен через список отзыва (во всех воркерах).
+    Хеш сохраняется в tokens, чтобы новый или переподключившийся воркер восстановил список из БД."""
+    claims = verify_access_token(token)
+    if claims is None:
+        return
+    th = hash_token(token)
+    if (await session.execute(select(Token.id).where(Token.token_hash == th))).first() is None:
+        session.add(Token(user_id=claims.user_id, token_hash=th, type=SIGNED_REVOKED_TYPE, expires_at=claims.expires_at))
+        await session.commit()
+    await invalidation_bus.token_revoked(th, expires_at=claims.expires_at, signed=True)
+
+async def load_revoked_signed_tokens(session_factory: async_sessionmaker) -> int:
+    """Заполняет список отзыва подписанными токенами, отозванными до старта или за время разрыва шины."""
+    now = datetime.now(timezone.utc)
+    async with session_factory() as session:
+        res = await session.execute(
+            select(Token.token_hash, Token.expires_at).where(Token.type == SIGNED_REVOKED_TYPE, Token.expires_at > now)
+        )
+        rows = res.all()
+    for th, expires_at in rows:
+        revoked_signed_tokens.add(th, expires_at if expires_at.tzinfo else expires_at.replace(tzinfo=timezone.utc))
+    return len(rows)
 
 async def get_user_by_access_token(session: AsyncSession, token: str) -> User:
-    """Возвращает пользователя по access-токену (проверяет хеш и TTL)."""
+    """Возвращает пользователя по access-токену (проверяет хеш и TTL). Сначала смотрит в кэш."""
+    if is_signed_token(token):
+        return await get_user_by_signed_token(session, token)
     th = hash_token(token)
+    snapshot = access_token_cache.get(th)
+    if snapshot is not None and snapshot.deleted_at is None:
+        return await snapshot.attach(session)
     now = datetime.now(timezone.utc)
     stmt = (
-        select(User)
+        select(User, Token.expires_at)
         .join(Token, Token.user_id == User.id)
-        .where(Token.token_hash == th, Token.type == "access", Token.revoked == False, Token.expires_at > now)
+        .where(Token.token_hash == th, Token.type == "access", Token.revoked == False, Token.expires_at > now,
+               User.deleted_at.is_(None))
     )
     res = await session.execute(stmt)
-    user: User | None = res.scalar_one_or_none()
-    if not user:
+    row = res.first()
+    if not row:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный или просроченный токен")
+    user, expires_at = row
+    access_token_cache.put(th, UserSnapshot.from_user(user), expires_at)
     return user
 
+async def get_user_by_signed_token(session: AsyncSession, token: str) -> User:
+    """Возвращает пользователя по подписанному access-токену: подпись и срок проверяются в памяти."""
+    claims = verify_access_token(token)
+    th = hash_token(token)
+    if claims is None or revoked_signed_tokens.is_revoked(th, claims):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный или просроченный токен")
+    snapshot = access_token_cache.get(th)
+    if snapshot is not None and snapshot.deleted_at is None:
+        return await snapshot.attach(session)
+    # Снимок в кэше сбрасывается событиями user_changed/sessions_revoked при удалении аккаунта,
+    # а при промахе удалённый пользователь отсекается прямо в запросе
+    res = await session.execute(select(User).where(User.id == claims.user_id, User.deleted_at.is_(None)))
+    user = res.scalar_one_or_none()
+    if not user or issued_before(claims, user.sessions_revoked_at):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Неверный или просроченный токен")
+    access_token_cache.put(th, UserSnapshot.from_user(user), claims.expires_at)
+    return user
+
+async def introspect_access_tokens(session: AsyncSession, tokens: list[str]) -> list[TokenIntrospection]:
+    """Проверяет пачку access-токенов: opaque — одним запросом WHERE token_hash IN (...), у подписанных подпись
+    проверяется в памяти, а пользователи загружаются одним запросом, чтобы не отдавать удалённых и устаревшую роль."""
+    hashes = [hash_token(t) for t in tokens]
+    opaque_hashes = {th for t, th in zip(tokens, hashes) if not is_signed_token(t)}
+    found: dict[str, TokenIntrospection] = {}
+    if opaque_hashes:
+        now = datetime.now(timezone.utc)
+        res = await session.execute(
+            select(Token.token_hash, Token.user_id, User.role, Token.expires_at)
+            .join(User, Token.user_id == User.id)
+            .where(Token.token_hash.in_(opaque_hashes), Token.type == "access", Token.revoked == False,
+                   Token.expires_at > now, User.deleted_at.is_(None))
+        )
+        for th, user_id, role, expires_at in res.all():
+            found[th] = TokenIntrospection(active=True, user_id=str(user_id), role=role, expires_at=expires_at.isoformat())
+    signed_claims = {}
+    for token, th in zip(tokens, hashes):
+        if is_signed_token(token):
+            claims = verify_access_token(token)
+            if claims is not None and not revoked_signed_tokens.is_revoked(th, claims):
+                signed_claims[th] = claims
+    users: dict[str, tuple[str, datetime | None]] = {}
+    if signed_claims:
+        res = await session.execute(
+            select(User.id, User.role, User.sessions_revoked_at)
+            .where(User.id.in_({claims.user_id for claims in signed_claims.values()}), User.deleted_at.is_(None))
+        )
+        users = {str(user_id): (role, revoked_at) for user_id, role, revoked_at in res.all()}
+    for th, claims in signed_claims.items():
+        if claims.user_id in users:
+            role, revoked_at = users[claims.user_id]
+            if not issued_before(claims, revoked_at):
+                found[th] = TokenIntrospection(
+                    active=True, user_id=claims.user_id, role=role, expires_at=claims.expires_at.isoformat()
+                )
+    return [found.get(th, TokenIntrospection(active=False)) for th in hashes]
+
 async def get_user_by_refresh_token(session: AsyncSession, token: str) -> User:
     """Возвращает пользователя по refresh-токену (проверяет хеш и TTL)."""
     th = hash_token(token)
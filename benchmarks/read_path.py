@@ -0,0 +1,98 @@
+"""Сравнение чтения списков через ORM (сущности в identity map) и через Core-слой app/queries.py
+(только нужные колонки в NamedTuple): время и пик выделенной памяти.
+
+Запуск: python -m benchmarks.read_path [число комментариев]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+from app.database import Base
+from app.models import Comment, User
+from app.queries import fetch_comment_thread, fetch_users
+
+
+async def seed(session_factory: async_sessionmaker, n: int) -> None:
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    users = [
+        {"id": str(uuid.uuid4()), "username": f"user_{i:05d}", "email": f"user_{i}@example.com", "password": "x",
+         "role": "user", "is_email_verified": True, "is_profile_public": True, "is_collection_public": True}
+        for i in range(1000)
+    ]
+    async with session_factory() as session:
+        await session.execute(insert(User), users)
+        await session.execute(insert(Comment), [
+            {"id": str(uuid.uuid4()), "user_id": users[i % len(users)]["id"], "game_name": "Catan", "page": "1",
+             "title": f"Вопрос №{i}", "comment_text": "Можно ли строить дорогу через чужое поселение? " * 3,
+             "created_at": started + timedelta(seconds=i), "updated_at": started + timedelta(seconds=i)}
+            for i in range(n)
+        ])
+        await session.commit()
+
+
+async def orm_comments(session, n):
+    res = await session.execute(
+        select(Comment, User.username).join(User, Comment.user_id == User.id)
+        .where(Comment.game_name == "Catan", Comment.page == "1")
+        .order_by(Comment.created_at, Comment.id).limit(n)
+    )
+    return res.all()
+
+async def core_comments(session, n):
+    return await fetch_comment_thread(session, "Catan", "1", n)
+
+async def orm_users(session, n):
+    res = await session.execute(select(User).where(User.deleted_at.is_(None)).order_by(User.username).limit(n))
+    return res.scalars().all()
+
+async def core_users(session, n):
+    return await fetch_users(session, n, 0)
+
+
+async def measure(session_factory, fn, n: int, repeat: int = 5) -> tuple[float, int]:
+    best = float("inf")
+    for _ in range(repeat):
+        async with session_factory() as session:
+            started = time.perf_counter()
+            await fn(session, n)
+            best = min(best, time.perf_counter() - started)
+    async with session_factory() as session:
+        tracemalloc.start()
+        rows = await fn(session, n)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        assert len(rows) == n
+    return best, peak
+
+
+async def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_async_engine(f"sqlite+aiosqlite:///{os.path.join(tmp, 'bench.db')}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        session_factory = async_sessionmaker(engine, expire_on_commit=False)
+        await seed(session_factory, n)
+        for title, orm_fn, core_fn, size in [
+            (f"{n} комментариев ветки", orm_comments, core_comments, n),
+            ("1000 пользователей", orm_users, core_users, 1000),
+        ]:
+            orm_time, orm_peak = await measure(session_factory, orm_fn, size)
+            core_time, core_peak = await measure(session_factory, core_fn, size)
+            print(title)
+            print(f"  ORM:  {orm_time * 1000:8.1f} ms, пик памяти {orm_peak / 1024:8.0f} KiB")
+            print(f"  Core: {core_time * 1000:8.1f} ms, пик памяти {core_peak / 1024:8.0f} KiB")
+            print(f"  ускорение {orm_time / core_time:.1f}x, памяти меньше в {orm_peak / core_peak:.1f} раза")
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,87 @@
+"""Сравнение сериализации ответа со списком комментариев: прежний путь через модели Pydantic
+и response_model против отображения ORM -> dict с orjson (app/serialization.py).
+
+Запуск: python -m benchmarks.serialization [число комментариев]
+"""
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from app.models import Comment
+from app.schemas import CommentOut
+from app.serialization import FastJSONResponse, comment_out
+
+
+def make_rows(n: int) -> list[tuple[Comment, str]]:
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    return [
+        (
+            Comment(
+                id=str(uuid.uuid4()),
+                user_id=str(uuid.uuid4()),
+                game_name="Catan",
+                page=str(i % 40),
+                title=f"Вопрос по правилам №{i}",
+                comment_text="Можно ли строить дорогу через чужое поселение? " * 3,
+                created_at=started + timedelta(seconds=i),
+                updated_at=started + timedelta(seconds=i),
+            ),
+            f"user_{i % 500}",
+        )
+        for i in range(n)
+    ]
+
+
+def pydantic_path(rows: list[tuple[Comment, str]]) -> bytes:
+    """Как было: модели в обработчике, затем повторная валидация по response_model и stdlib json."""
+    items = [
+        CommentOut(
+            id=str(comment.id),
+            user_id=str(comment.user_id),
+            username=username,
+            game_name=comment.game_name,
+            page=comment.page,
+            title=comment.title,
+            comment_text=comment.comment_text,
+            created_at=comment.created_at.isoformat(),
+            updated_at=comment.updated_at.isoformat(),
+        )
+        for comment, username in rows
+    ]
+    validated = TypeAdapter(list[CommentOut]).validate_python(items, from_attributes=True)
+    return JSONResponse(jsonable_encoder(validated)).body
+
+
+def fast_path(rows: list[tuple[Comment, str]]) -> bytes:
+    """Как стало: словари в форме CommentOut сразу в orjson."""
+    return FastJSONResponse([comment_out(comment, username) for comment, username in rows]).body
+
+
+def measure(fn, rows, repeat: int = 5) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(rows)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+def main() -> None:
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    rows = make_rows(n)
+    assert TypeAdapter(list[CommentOut]).validate_json(fast_path(rows)) == TypeAdapter(list[CommentOut]).validate_json(pydantic_path(rows))
+    slow = measure(pydantic_path, rows)
+    fast = measure(fast_path, rows)
+    print(f"{n} комментариев")
+    print(f"pydantic + response_model: {slow * 1000:8.1f} ms")
+    print(f"dict + orjson:             {fast * 1000:8.1f} ms")
+    print(f"ускорение:                 {slow / fast:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
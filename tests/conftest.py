@@ -2,7 +2,7 @@ import pytest
 import pytest_asyncio
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from app.dependencies import get_db
+from app.dependencies import get_db, get_session_factory
 from app.main import app
 
 TEST_DATABASE_URL = "sqlite+aiosqlite:///./test.db"
@@ -29,17 +29,25 @@ def override_get_db(db_session):
         async with db_session() as session:
             yield session
     app.dependency_overrides[get_db] = _override_get_db
+    app.dependency_overrides[get_session_factory] = lambda: db_session
     yield
     app.dependency_overrides.pop(get_db, None)
+    app.dependency_overrides.pop(get_session_factory, None)
 
 @pytest_asyncio.fixture(scope="function")
 async def setup_clean_test_data(db_session):
     from sqlalchemy import text
+    from app.comment_cache import comment_cache
+    from app.username_index import username_index
+    # Комментарии и пользователи удаляются в обход API, поэтому кэш веток и индекс username сбрасываются вручную
+    comment_cache.clear()
+    username_index.clear()
     async with db_session() as db:
         await db.execute(
             text("DELETE FROM comments WHERE user_id IN (SELECT id FROM users WHERE email LIKE '%@example.com')"))
         await db.execute(text("DELETE FROM tokens WHERE user_id IN (SELECT id FROM users WHERE email LIKE '%@example.com')"))
         await db.execute(text("DELETE FROM users WHERE email LIKE '%@example.com'"))
+        await db.execute(text("DELETE FROM email_outbox WHERE recipient LIKE '%@example.com'"))
         await db.commit()
     yield
     async with db_session() as db:
@@ -47,4 +55,7 @@ async def setup_clean_test_data(db_session):
             text("DELETE FROM comments WHERE user_id IN (SELECT id FROM users WHERE email LIKE '%@example.com')"))
         await db.execute(text("DELETE FROM tokens WHERE user_id IN (SELECT id FROM users WHERE email LIKE '%@example.com')"))
         await db.execute(text("DELETE FROM users WHERE email LIKE '%@example.com'"))
+        await db.execute(text("DELETE FROM email_outbox WHERE recipient LIKE '%@example.com'"))
         await db.commit()
+    comment_cache.clear()
+    username_index.clear()
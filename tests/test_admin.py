@@ -0,0 +1,162 @@
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from httpx import AsyncClient, ASGITransport
+from sqlalchemy import text, update
+
+from app.main import app
+from app.models import User
+
+
+async def _login(ac: AsyncClient, db_session, username: str, role: str = "user") -> dict:
+    await ac.post("/auth/register", json={
+        "username": username,
+        "email": f"{username}@example.com",
+        "password": "Test1234"
+    })
+    if role != "user":
+        async with db_session() as db:
+            await db.execute(text("UPDATE users SET role = :role WHERE username = :username"), {"role": role, "username": username})
+            await db.commit()
+    login = await ac.post("/auth/login", json={"username": username, "password": "Test1234"})
+    return {"Authorization": f"Bearer {login.json()['access_token']}"}
+
+
+@pytest.mark.asyncio
+async def test_export_comments_ndjson(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        headers = await _login(ac, db_session, "exportadmin", role="admin")
+        for game, page in [("ExportGame", "1"), ("ExportGame", "2"), ("OtherExportGame", "1")]:
+            await ac.post("/comments/", json={
+                "game_name": game,
+                "page": page,
+                "title": "Заголовок",
+                "comment_text": "Text"
+            }, headers=headers)
+
+        resp = await ac.get("/admin/comments/export", params={"game_name": "ExportGame"}, headers=headers)
+        assert resp.status_code == 200
+        assert resp.headers["content-type"].startswith("application/x-ndjson")
+        rows = [json.loads(line) for line in resp.text.splitlines()]
+        assert [(r["game_name"], r["page"]) for r in rows] == [("ExportGame", "1"), ("ExportGame", "2")]
+        assert rows[0]["username"] == "exportadmin"
+        assert rows[0]["title"] == "Заголовок"
+
+        since = (datetime.now(timezone.utc) - timedelta(minutes=1)).isoformat()
+        resp = await ac.get("/admin/comments/export", params={"since": since}, headers=headers)
+        rows = [json.loads(line) for line in resp.text.splitlines()]
+        assert len(rows) == 3
+        assert [(r["updated_at"], r["id"]) for r in rows] == sorted((r["updated_at"], r["id"]) for r in rows)
+        # Прерванная выгрузка продолжается с последней полученной строки
+        resp = await ac.get("/admin/comments/export", params={
+            "since": rows[0]["updated_at"], "after_id": rows[0]["id"]
+        }, headers=headers)
+        assert [json.loads(line)["id"] for line in resp.text.splitlines()] == [r["id"] for r in rows[1:]]
+        assert (await ac.get("/admin/comments/export", params={"after_id": rows[0]["id"]}, headers=headers)).status_code == 400
+
+        # Комментарии удалённых аккаунтов не выгружаются
+        writer = await _login(ac, db_session, "exportwriter")
+        await ac.post("/comments/", json={
+            "game_name": "ExportGame", "page": "3", "title": "Заголовок", "comment_text": "Text"
+        }, headers=writer)
+        await ac.delete("/users/me", headers=writer)
+        resp = await ac.get("/admin/comments/export", params={"game_name": "ExportGame"}, headers=headers)
+        assert len(resp.text.splitlines()) == 2
+
+        since = (datetime.now(timezone.utc) + timedelta(minutes=1)).isoformat()
+        resp = await ac.get("/admin/comments/export", params={"game_name": "ExportGame", "since": since}, headers=headers)
+        assert resp.status_code == 200
+        assert resp.text == ""
+
+
+@pytest.mark.asyncio
+async def test_export_comments_requires_admin(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        headers = await _login(ac, db_session, "exportuser")
+        resp = await ac.get("/admin/comments/export", headers=headers)
+        assert resp.status_code == 403
+
+        resp = await ac.get("/admin/comments/export")
+        assert resp.status_code in (401, 403)
+
+
+@pytest.mark.asyncio
+async def test_import_comments(db_session, setup_clean_test_data, monkeypatch):
+    monkeypatch.setattr("app.routers.admin.COMMENTS_IMPORT_CHUNK_SIZE", 2)
+    # Счётчики comment_pages не очищаются между запусками, поэтому игра своя на каждый запуск
+    game = f"ImportGame-{uuid.uuid4().hex[:8]}"
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        headers = await _login(ac, db_session, "importadmin", role="admin")
+        author = (await ac.post("/auth/register", json={
+            "username": "importauthor",
+            "email": "importauthor@example.com",
+            "password": "Test1234"
+        })).json()
+        deleted = (await ac.post("/auth/register", json={
+            "username": "importdeleted",
+            "email": "importdeleted@example.com",
+            "password": "Test1234"
+        })).json()
+        async with db_session() as db:
+            await db.execute(
+                update(User).where(User.id == deleted["id"]).values(deleted_at=datetime.now(timezone.utc))
+            )
+            await db.commit()
+        rows = [
+            {"game_name": game, "page": "1", "title": "A", "comment_text": "Text"},
+            {"game_name": game, "page": "1", "title": "", "comment_text": "Text"},
+            {"game_name": game, "page": "2", "title": "B", "comment_text": "Text",
+             "user_id": author["id"], "created_at": "2020-01-01T00:00:00+00:00"},
+            {"game_name": game, "page": "2", "title": "C", "comment_text": "Text", "user_id": "missing"},
+            {"game_name": game, "page": "1", "title": "D", "comment_text": "Text"},
+            {"game_name": game, "page": "1", "title": "E", "comment_text": "Text",
+             "user_id": "00000000-0000-4000-8000-000000000000"},
+            {"game_name": game, "page": "1", "title": "F", "comment_text": "Text", "user_id": deleted["id"]},
+        ]
+        resp = await ac.post("/admin/comments/import", json=rows, headers=headers)
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["imported"] == 3
+        assert [e["row"] for e in data["errors"]] == [2, 4, 6, 7]
+        assert data["errors"][0]["detail"].startswith("title")
+        assert data["errors"][1]["detail"].startswith("user_id")
+        assert data["errors"][2]["detail"] == data["errors"][3]["detail"] == "Пользователь не найден"
+
+        resp = await ac.get("/comments/", params={"game_name": game, "page": "2"})
+        assert [(c["username"], c["created_at"][:10]) for c in resp.json()] == [("importauthor", "2020-01-01")]
+        resp = await ac.get("/comments/counts", params={"game_name": game})
+        assert resp.json()["counts"] == {"1": 2, "2": 1}
+
+        body = "\n".join(json.dumps(r) for r in rows[:1]) + "\nnot json\n"
+        resp = await ac.post("/admin/comments/import", content=body.encode(),
+                             headers={**headers, "Content-Type": "application/x-ndjson"})
+        assert resp.json() == {"imported": 1, "errors": [{"row": 2, "detail": "Неверный JSON"}]}
+
+        resp = await ac.post("/admin/comments/import", json={"not": "a list"}, headers=headers)
+        assert resp.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_account_deletions_progress(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        admin_headers = await _login(ac, db_session, "deletionadmin", role="admin")
+        user_headers = await _login(ac, db_session, "deletionuser")
+        await ac.post("/comments/", json={
+            "game_name": "DeletionGame",
+            "page": "1",
+            "title": "Title",
+            "comment_text": "Text"
+        }, headers=user_headers)
+        await ac.delete("/users/me", headers=user_headers)
+
+        resp = await ac.get("/admin/account-deletions", headers=admin_headers)
+        assert resp.status_code == 200
+        [pending] = [d for d in resp.json() if d["username"] == "deletionuser"]
+        assert pending["comments_left"] == 1
+        assert pending["tokens_left"] >= 1
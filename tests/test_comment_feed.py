@@ -0,0 +1,173 @@
+import pytest
+from fastapi import HTTPException
+from httpx import AsyncClient, ASGITransport
+
+from app.comment_feed import CommentFeed, comment_feed, sse_events
+from app.main import app
+
+
+@pytest.mark.asyncio
+async def test_feed_fans_out_to_page_subscribers():
+    feed = CommentFeed(queue_size=10, max_connections=10)
+    first = feed.subscribe("Game", "1")
+    second = feed.subscribe("Game", "1")
+    other = feed.subscribe("Game", "2")
+    feed.publish("Game", "1", {"action": "created", "comment": {"id": "a"}})
+    assert first.queue.get_nowait()["comment"] == {"id": "a"}
+    assert second.queue.get_nowait()["comment"] == {"id": "a"}
+    assert other.queue.empty()
+    assert feed.stats()["connections"] == 3
+    assert feed.stats()["delivered"] == 2
+
+
+@pytest.mark.asyncio
+async def test_feed_drops_slow_consumer():
+    feed = CommentFeed(queue_size=2, max_connections=10)
+    slow = feed.subscribe("Game", "1")
+    for i in range(3):
+        feed.publish("Game", "1", {"action": "created", "comment": {"id": str(i)}})
+    assert slow.dropped
+    assert slow.queue.get_nowait() is None
+    assert feed.stats() == {
+        "connections": 0, "pages": 0, "pages_reloading": 0, "published": 3, "delivered": 2, "dropped": 1, "rejected": 0,
+    }
+
+
+def test_feed_rejects_over_connection_limit():
+    feed = CommentFeed(queue_size=2, max_connections=1)
+    feed.subscribe("Game", "1")
+    with pytest.raises(HTTPException) as exc:
+        feed.subscribe("Game", "1")
+    assert exc.value.status_code == 503
+    assert feed.stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_sse_events_format_and_unsubscribe():
+    feed = CommentFeed(queue_size=10, max_connections=10)
+    sub = feed.subscribe("Game", "1")
+    stream = sse_events(feed, sub, heartbeat_s=0.01)
+    assert await stream.__anext__() == "retry: 3000\n\n"
+    assert await stream.__anext__() == ": ping\n\n"
+    feed.publish("Game", "1", {"action": "updated", "comment": {"id": "a", "title": "Заголовок"}})
+    assert await stream.__anext__() == 'event: updated\ndata: {"id": "a", "title": "Заголовок"}\n\n'
+    await stream.aclose()
+    assert feed.stats()["connections"] == 0
+
+
+@pytest.mark.asyncio
+async def test_comment_handlers_publish_to_feed(db_session, setup_clean_test_data):
+    sub = comment_feed.subscribe("FeedGame", "1")
+    try:
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            await ac.post("/auth/register", json={
+                "username": "feeduser",
+                "email": "feeduser@example.com",
+                "password": "Test1234"
+            })
+            login = await ac.post("/auth/login", json={"username": "feeduser", "password": "Test1234"})
+            headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+            resp = await ac.post("/comments/", json={
+                "game_name": "FeedGame",
+                "page": "1",
+                "title": "Title",
+                "comment_text": "Text"
+            }, headers=headers)
+            comment_id = resp.json()["id"]
+            await ac.put(f"/comments/{comment_id}", json={"title": "New", "comment_text": "Text"}, headers=headers)
+            await ac.delete(f"/comments/{comment_id}", headers=headers)
+
+        events = [sub.queue.get_nowait() for _ in range(3)]
+        assert [e["action"] for e in events] == ["created", "updated", "deleted"]
+        assert events[0]["comment"]["username"] == "feeduser"
+        assert events[1]["comment"]["title"] == "New"
+        assert events[2]["comment"] == {"id": comment_id, "game_name": "FeedGame", "page": "1"}
+    finally:
+        comment_feed.unsubscribe(sub)
+
+
+@pytest.mark.asyncio
+async def test_remote_events_carry_keys_and_reload_comment(db_session, setup_clean_test_data, monkeypatch):
+    import asyncio
+    from app.invalidation import COMMENT_PAGE_CHANGED, invalidation_bus
+
+    broadcast = []
+
+    async def capture(event):
+        broadcast.append(event)
+
+    monkeypatch.setattr(invalidation_bus, "_broadcast", capture)
+    monkeypatch.setattr(comment_feed, "session_factory", db_session)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "remotefeed",
+            "email": "remotefeed@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={"username": "remotefeed", "password": "Test1234"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        resp = await ac.post("/comments/", json={
+            "game_name": "RemoteFeedGame",
+            "page": "1",
+            "title": "Title",
+            "comment_text": "Ж" * 1000
+        }, headers=headers)
+        comment_id = resp.json()["id"]
+
+    # Между воркерами уходят только ключи, без тела комментария
+    (event,) = [e for e in broadcast if e["kind"] == COMMENT_PAGE_CHANGED]
+    assert "comment" not in event
+    assert event["comment_id"] == comment_id
+
+    # Воркер-получатель перечитывает комментарий для своих подписчиков
+    sub = comment_feed.subscribe("RemoteFeedGame", "1")
+    try:
+        invalidation_bus._dispatch(event)
+        received = await asyncio.wait_for(sub.queue.get(), timeout=5)
+    finally:
+        comment_feed.unsubscribe(sub)
+    assert received["action"] == "created"
+    assert received["comment"]["id"] == comment_id
+    assert received["comment"]["username"] == "remotefeed"
+    assert received["comment"]["comment_text"] == "Ж" * 1000
+
+
+@pytest.mark.asyncio
+async def test_remote_page_events_delivered_in_order(db_session, setup_clean_test_data, monkeypatch):
+    import asyncio
+    from app.invalidation import COMMENT_PAGE_CHANGED, invalidation_bus
+
+    monkeypatch.setattr(comment_feed, "session_factory", db_session)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "orderfeed",
+            "email": "orderfeed@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={"username": "orderfeed", "password": "Test1234"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        resp = await ac.post("/comments/", json={
+            "game_name": "OrderFeedGame",
+            "page": "1",
+            "title": "Title",
+            "comment_text": "Text"
+        }, headers=headers)
+        comment_id = resp.json()["id"]
+
+    sub = comment_feed.subscribe("OrderFeedGame", "1")
+    try:
+        # created перечитывается из БД, а deleted готов сразу, но раздаётся только после него
+        for action in ["created", "deleted"]:
+            invalidation_bus._dispatch({
+                "kind": COMMENT_PAGE_CHANGED, "game_name": "OrderFeedGame", "page": "1",
+                "action": action, "comment_id": comment_id,
+            })
+        received = [await asyncio.wait_for(sub.queue.get(), timeout=5) for _ in range(2)]
+    finally:
+        comment_feed.unsubscribe(sub)
+    assert [event["action"] for event in received] == ["created", "deleted"]
+    assert received[0]["comment"]["title"] == "Title"
+    assert comment_feed.stats()["pages_reloading"] == 0
@@ -676,3 +676,325 @@ async def test_comment_updated_at_changes(db_session, setup_clean_test_data):
         }, headers=headers)
         updated_comment = resp.json()
         assert updated_comment["updated_at"] != initial_updated_at
+
+
+@pytest.mark.asyncio
+async def test_get_comments_cursor_pagination(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "pager",
+            "email": "pager@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "pager",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        for i in range(5):
+            resp = await ac.post("/comments/", json={
+                "game_name": "PagedGame",
+                "page": "1",
+                "title": f"Title {i}",
+                "comment_text": f"Comment {i}"
+            }, headers=headers)
+            assert resp.status_code == 200
+
+        # Проходим ветку порциями по 2 комментария
+        seen = []
+        cursor = None
+        for _ in range(3):
+            params = {"game_name": "PagedGame", "page": "1", "limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            resp = await ac.get("/comments/", params=params)
+            assert resp.status_code == 200
+            seen.extend(c["comment_text"] for c in resp.json())
+            cursor = resp.headers.get("X-Next-Cursor")
+        assert seen == [f"Comment {i}" for i in range(5)]
+        assert cursor is None
+
+        resp = await ac.get("/comments/", params={"game_name": "PagedGame", "page": "1", "cursor": "broken"})
+        assert resp.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_get_comments_conditional_etag(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "etaguser",
+            "email": "etaguser@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "etaguser",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        params = {"game_name": "EtagGame", "page": "1"}
+        resp = await ac.post("/comments/", json={
+            "game_name": "EtagGame",
+            "page": "1",
+            "title": "Title",
+            "comment_text": "Text"
+        }, headers=headers)
+        comment_id = resp.json()["id"]
+
+        resp = await ac.get("/comments/", params=params)
+        assert resp.status_code == 200
+        etag = resp.headers["ETag"]
+        assert "Last-Modified" in resp.headers
+
+        # Ветка не менялась — 304 без тела
+        resp = await ac.get("/comments/", params=params, headers={"If-None-Match": etag})
+        assert resp.status_code == 304
+        assert resp.content == b""
+
+        # Изменение комментария меняет ETag
+        await ac.put(f"/comments/{comment_id}", json={"title": "New", "comment_text": "New text"}, headers=headers)
+        resp = await ac.get("/comments/", params=params, headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.headers["ETag"] != etag
+        etag = resp.headers["ETag"]
+
+        await ac.delete(f"/comments/{comment_id}", headers=headers)
+        resp = await ac.get("/comments/", params=params, headers={"If-None-Match": etag})
+        assert resp.status_code == 200
+        assert resp.json() == []
+
+
+@pytest.mark.asyncio
+async def test_get_comments_served_from_cache(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "cacheuser",
+            "email": "cacheuser@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "cacheuser",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        params = {"game_name": "CacheGame", "page": "1"}
+        await ac.post("/comments/", json={
+            "game_name": "CacheGame",
+            "page": "1",
+            "title": "Title",
+            "comment_text": "Text"
+        }, headers=headers)
+
+        first = await ac.get("/comments/", params=params)
+        hits = (await ac.get("/metrics")).json()["comment_cache"]["hits"]
+        second = await ac.get("/comments/", params=params)
+        assert second.status_code == 200
+        assert second.json() == first.json()
+        assert second.headers["ETag"] == first.headers["ETag"]
+        assert (await ac.get("/metrics")).json()["comment_cache"]["hits"] == hits + 1
+
+        resp = await ac.get("/comments/", params=params, headers={"If-None-Match": first.headers["ETag"]})
+        assert resp.status_code == 304
+
+        # Смена username инвалидирует ветки, где пользователь оставлял комментарии
+        await ac.patch("/users/me/username", json={"new_username": "cacheuser2"}, headers=headers)
+        resp = await ac.get("/comments/", params=params, headers={"If-None-Match": first.headers["ETag"]})
+        assert resp.status_code == 200
+        assert resp.json()[0]["username"] == "cacheuser2"
+        assert resp.headers["ETag"] != first.headers["ETag"]
+
+
+def test_comment_cache_max_age_and_invalidation_pruning(monkeypatch):
+    from app import comment_cache as module
+    from app.comment_cache import CachedThread, CommentThreadCache
+
+    clock = [100.0]
+    monkeypatch.setattr(module.time, "monotonic", lambda: clock[0])
+    cache = CommentThreadCache(max_entries=10, max_bytes=1024, max_age_s=30)
+    entry = CachedThread(b"[]", {"ETag": "x"}, None)
+
+    # Запись устаревает по возрасту даже без события инвалидации
+    cache.put(("G", "1", 50, None), entry, cache.read_started())
+    clock[0] += 10
+    assert cache.get(("G", "1", 50, None)) is entry
+    clock[0] += 21
+    assert cache.get(("G", "1", 50, None)) is None
+    assert cache.stats()["expired"] == 1
+
+    # Ответ, прочитанный до инвалидации, в кэш не попадает
+    started = cache.read_started()
+    clock[0] += 1
+    cache.invalidate_page("G", "1")
+    cache.put(("G", "1", 50, None), entry, started)
+    assert cache.get(("G", "1", 50, None)) is None
+
+    # Смена username сбрасывает только записи с комментариями этого автора
+    cache.put(("G", "2", 50, None), entry, cache.read_started(), ["author-1"])
+    cache.put(("G", "3", 50, None), entry, cache.read_started(), ["author-2"])
+    cache.invalidate_author("author-1")
+    assert cache.get(("G", "2", 50, None)) is None
+    assert cache.get(("G", "3", 50, None)) is entry
+    started = cache.read_started()
+    clock[0] += 1
+    cache.invalidate_author("author-2")
+    cache.put(("G", "3", 50, None), entry, started, ["author-2"])
+    assert cache.get(("G", "3", 50, None)) is None
+
+    # Метки инвалидации старше max_age_s удаляются
+    for i in range(100):
+        cache.invalidate_page("G", str(i))
+    clock[0] += 31
+    cache.invalidate_page("G", "last")
+    assert list(cache._invalidated_at) == [("G", "last")]
+
+
+@pytest.mark.asyncio
+async def test_get_comment_counts_and_rebuild(db_session, setup_clean_test_data):
+    from sqlalchemy import text
+    from app.comment_pages import rebuild_comment_counts
+
+    game = f"CountsGame-{uuid.uuid4().hex[:8]}"
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "countsuser",
+            "email": "countsuser@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "countsuser",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        ids = []
+        for page in ["1", "1", "2"]:
+            resp = await ac.post("/comments/", json={
+                "game_name": game,
+                "page": page,
+                "title": "Title",
+                "comment_text": "Text"
+            }, headers=headers)
+            ids.append(resp.json()["id"])
+        await ac.delete(f"/comments/{ids[0]}", headers=headers)
+
+        resp = await ac.get("/comments/counts", params={"game_name": game})
+        assert resp.status_code == 200
+        assert resp.json() == {"game_name": game, "counts": {"1": 1, "2": 1}}
+
+        # Комментарий, удалённый в обход API, исправляется пересчётом
+        async with db_session() as db:
+            await db.execute(text("DELETE FROM comments WHERE id = :id"), {"id": ids[2]})
+            await db.commit()
+            assert await rebuild_comment_counts(db, game) == 1
+            assert await rebuild_comment_counts(db, game) == 0
+
+        resp = await ac.get("/comments/counts", params={"game_name": game})
+        assert resp.json()["counts"] == {"1": 1}
+
+
+@pytest.mark.asyncio
+async def test_get_comments_batch(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "batchuser",
+            "email": "batchuser@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "batchuser",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        for page, n in [("1", 3), ("2", 1), ("5", 1)]:
+            for i in range(n):
+                await ac.post("/comments/", json={
+                    "game_name": "BatchGame",
+                    "page": page,
+                    "title": f"Title {page}-{i}",
+                    "comment_text": "Text"
+                }, headers=headers)
+
+        resp = await ac.get("/comments/batch", params={"game_name": "BatchGame", "page_from": 1, "page_to": 3, "limit": 2})
+        assert resp.status_code == 200
+        data = resp.json()
+        assert list(data["pages"]) == ["1", "2", "3"]
+        assert [c["title"] for c in data["pages"]["1"]] == ["Title 1-0", "Title 1-1"]
+        assert len(data["pages"]["2"]) == 1
+        assert data["pages"]["3"] == []
+        assert list(data["next_cursors"]) == ["1"]
+
+        # Курсор продолжает ветку через обычный GET /comments/
+        resp = await ac.get("/comments/", params={
+            "game_name": "BatchGame", "page": "1", "cursor": data["next_cursors"]["1"]
+        })
+        assert [c["title"] for c in resp.json()] == ["Title 1-2"]
+
+        resp = await ac.get("/comments/batch", params=[("game_name", "BatchGame"), ("pages", "5"), ("pages", "2")])
+        assert resp.status_code == 200
+        assert list(resp.json()["pages"]) == ["5", "2"]
+        assert resp.json()["pages"]["5"][0]["username"] == "batchuser"
+
+        resp = await ac.get("/comments/batch", params={"game_name": "BatchGame"})
+        assert resp.status_code == 400
+        resp = await ac.get("/comments/batch", params={"game_name": "BatchGame", "page_from": 1, "page_to": 1000})
+        assert resp.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_search_comments(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "searchuser",
+            "email": "searchuser@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "searchuser",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        ids = {}
+        for title, text_ in [
+            ("Фаза торговли", "Можно ли торговать ресурсами"),
+            ("Вопрос", "Как работает торговли порт"),
+            ("Разбойник", "Куда ставить разбойника"),
+        ]:
+            resp = await ac.post("/comments/", json={
+                "game_name": "SearchGame",
+                "page": "1",
+                "title": title,
+                "comment_text": text_
+            }, headers=headers)
+            ids[title] = resp.json()["id"]
+        await ac.post("/comments/", json={
+            "game_name": "OtherSearchGame",
+            "page": "1",
+            "title": "Фаза торговли",
+            "comment_text": "Text"
+        }, headers=headers)
+
+        params = {"q": "торговли", "game_name": "SearchGame"}
+        resp = await ac.get("/comments/search", params=params)
+        assert resp.status_code == 200
+        # Совпадение в заголовке ранжируется выше, чем в тексте
+        assert [c["id"] for c in resp.json()] == [ids["Фаза торговли"], ids["Вопрос"]]
+
+        resp = await ac.get("/comments/search", params={**params, "limit": 1})
+        assert [c["id"] for c in resp.json()] == [ids["Фаза торговли"]]
+        resp = await ac.get("/comments/search", params={**params, "limit": 1, "cursor": resp.headers["X-Next-Cursor"]})
+        assert [c["id"] for c in resp.json()] == [ids["Вопрос"]]
+        assert "X-Next-Cursor" not in resp.headers
+
+        # Индекс следует за изменением и удалением комментариев
+        await ac.put(f"/comments/{ids['Разбойник']}", json={"title": "Торговли нет", "comment_text": "Text"}, headers=headers)
+        await ac.delete(f"/comments/{ids['Вопрос']}", headers=headers)
+        resp = await ac.get("/comments/search", params=params)
+        assert {c["id"] for c in resp.json()} == {ids["Фаза торговли"], ids["Разбойник"]}
+
+        resp = await ac.get("/comments/search", params={"q": "\"*(", "game_name": "SearchGame"})
+        assert resp.status_code == 200
+        assert resp.json() == []
@@ -0,0 +1,163 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app.mailer import OutboxSender, SMTPConnection, enqueue_email
+from app.models import EmailOutbox
+
+
+class FakeSMTPServer:
+    """Минимальный SMTP-сервер для тестов: принимает письма и считает соединения."""
+
+    def __init__(self):
+        self.messages: list[str] = []
+        self.connections = 0
+        self.server = None
+
+    async def start(self) -> int:
+        self.server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        self.connections += 1
+        writer.write(b"220 fake ESMTP\r\n")
+        while line := await reader.readline():
+            command = line.decode().strip().upper()
+            if command.startswith("DATA"):
+                writer.write(b"354 go ahead\r\n")
+                await writer.drain()
+                body = []
+                while (data_line := await reader.readline()) != b".\r\n":
+                    body.append(data_line.decode())
+                self.messages.append("".join(body))
+                writer.write(b"250 queued\r\n")
+            elif command.startswith("QUIT"):
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 ok\r\n")
+            await writer.drain()
+        writer.close()
+
+
+@pytest.mark.asyncio
+async def test_outbox_sender_delivers_batch_over_one_connection(db_session, setup_clean_test_data):
+    server = FakeSMTPServer()
+    port = await server.start()
+    async with db_session() as db:
+        enqueue_email(db, "outbox1@example.com", "Первое", "текст 1")
+        enqueue_email(db, "outbox2@example.com", "Второе", "текст 2")
+        await db.commit()
+
+    sender = OutboxSender(db_session, SMTPConnection("127.0.0.1", port, None, None, False), batch_size=10)
+    try:
+        assert await sender.send_pending() == 2
+    finally:
+        await sender.stop()
+        await server.stop()
+
+    assert len(server.messages) == 2
+    assert server.connections == 1
+    async with db_session() as db:
+        res = await db.execute(select(EmailOutbox).where(EmailOutbox.recipient.like("outbox%@example.com")))
+        items = res.scalars().all()
+        assert all(item.sent_at is not None for item in items)
+        # Ссылки и коды из тела письма не хранятся после отправки
+        assert all(item.body == "" for item in items)
+    stats = sender.stats()
+    assert stats["sent"] == 2
+    assert stats["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_outbox_sender_retries_with_backoff(db_session, setup_clean_test_data):
+    server = FakeSMTPServer()
+    port = await server.start()
+    await server.stop()  # порт закрыт — соединение не установится
+    async with db_session() as db:
+        enqueue_email(db, "retry@example.com", "Повтор", "текст")
+        await db.commit()
+
+    sender = OutboxSender(db_session, SMTPConnection("127.0.0.1", port, None, None, False), interval_s=10)
+    assert await sender.send_pending() == 0
+    async with db_session() as db:
+        res = await db.execute(select(EmailOutbox).where(EmailOutbox.recipient == "retry@example.com"))
+        item = res.scalar_one()
+        assert item.sent_at is None
+        assert item.attempts == 1
+        assert item.last_error
+        assert item.next_attempt_at.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+    assert sender.stats()["failed"] == 1
+    assert sender.stats()["queue_depth"] >= 1
+
+
+@pytest.mark.asyncio
+async def test_outbox_claim_leases_batch(db_session, setup_clean_test_data):
+    async with db_session() as db:
+        enqueue_email(db, "lease@example.com", "Аренда", "текст")
+        await db.commit()
+
+    sender = OutboxSender(db_session, SMTPConnection(None, 0, None, None, False), lease_s=60)
+    claimed = [item for item in await sender._claim() if item.recipient == "lease@example.com"]
+    assert len(claimed) == 1 and claimed[0].attempts == 1
+    # Пока аренда не истекла, письмо не берёт ни один отправитель, хотя транзакция захвата уже закрыта
+    other = OutboxSender(db_session, SMTPConnection(None, 0, None, None, False))
+    await other.send_pending()
+    async with db_session() as db:
+        item = (await db.execute(select(EmailOutbox).where(EmailOutbox.recipient == "lease@example.com"))).scalar_one()
+        assert item.sent_at is None
+        assert item.attempts == 1
+        assert item.next_attempt_at.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc) + timedelta(seconds=30)
+
+
+@pytest.mark.asyncio
+async def test_outbox_dead_letters_and_retention(db_session, setup_clean_test_data):
+    server = FakeSMTPServer()
+    port = await server.start()
+    await server.stop()
+    async with db_session() as db:
+        enqueue_email(db, "dead@example.com", "Сброс", "код 123456")
+        await db.commit()
+
+    sender = OutboxSender(db_session, SMTPConnection("127.0.0.1", port, None, None, False), max_attempts=1)
+    assert await sender.send_pending() == 0
+    stats = sender.stats()
+    assert stats["dead_lettered"] == 1
+    assert stats["dead"] >= 1
+    async with db_session() as db:
+        item = (await db.execute(select(EmailOutbox).where(EmailOutbox.recipient == "dead@example.com"))).scalar_one()
+        assert item.body == ""
+        # Свежая строка переживает очистку, устаревшая удаляется
+        await sender.purge_old()
+        await db.refresh(item)
+        item.created_at = datetime.now(timezone.utc) - timedelta(hours=sender.retention_h + 1)
+        await db.commit()
+    assert await sender.purge_old() >= 1
+    async with db_session() as db:
+        res = await db.execute(select(EmailOutbox).where(EmailOutbox.recipient == "dead@example.com"))
+        assert res.scalar_one_or_none() is None
+
+
+@pytest.mark.asyncio
+async def test_register_writes_outbox_row(db_session, setup_clean_test_data):
+    from httpx import AsyncClient, ASGITransport
+    from app.main import app
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        resp = await ac.post("/auth/register", json={
+            "username": "outboxuser",
+            "email": "outboxuser@example.com",
+            "password": "Test1234"
+        })
+        assert resp.status_code == 201
+    async with db_session() as db:
+        res = await db.execute(select(EmailOutbox).where(EmailOutbox.recipient == "outboxuser@example.com"))
+        item = res.scalar_one()
+        assert "verify-email?token=" in item.body
@@ -0,0 +1,27 @@
+import asyncio
+
+import pytest
+from fastapi import HTTPException
+
+from app.passwords import PasswordHasher
+
+
+@pytest.mark.asyncio
+async def test_hash_and_verify_off_loop():
+    hasher = PasswordHasher(workers=0, max_queue=4)
+    hashed = await hasher.hash("Test1234")
+    assert await hasher.verify("Test1234", hashed)
+    assert not await hasher.verify("Wrong1234", hashed)
+    stats = hasher.stats()
+    assert stats["calls"] == 3
+    assert stats["queue_depth"] == 0
+
+
+@pytest.mark.asyncio
+async def test_rejects_when_queue_full():
+    hasher = PasswordHasher(workers=0, max_queue=1)
+    results = await asyncio.gather(hasher.hash("Test1234"), hasher.hash("Test1234"), return_exceptions=True)
+    rejected = [r for r in results if isinstance(r, HTTPException)]
+    assert len(rejected) == 1
+    assert rejected[0].status_code == 503
+    assert hasher.stats()["rejected"] == 1
@@ -0,0 +1,53 @@
+import json
+from datetime import datetime, timezone
+
+from app import serialization
+from app.models import Comment, User
+from app.queries import CommentRow, UserRow
+from app.schemas import CommentOut, UserOut, UserPublicOut
+from app.serialization import comment_out, dumps, user_out, user_public_out
+
+
+def make_user() -> User:
+    return User(
+        id="u1", username="user1", email="user1@example.com", password="hash", role="user",
+        is_email_verified=True, bio=None, is_profile_public=True, is_collection_public=False,
+    )
+
+
+def test_mappers_match_response_schemas():
+    user = make_user()
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    comment = Comment(
+        id="c1", user_id="u1", game_name="Game", page="1", title="Заголовок", comment_text="Text",
+        created_at=now, updated_at=now,
+    )
+    # Ключи в том же порядке, что и поля схем, а значения проходят их валидацию
+    for mapped, schema in [
+        (user_out(user), UserOut),
+        (user_public_out(user), UserPublicOut),
+        (comment_out(comment, "user1"), CommentOut),
+    ]:
+        assert list(mapped) == list(schema.model_fields)
+        assert schema.model_validate(mapped).model_dump() == mapped
+
+
+def test_dumps_without_orjson(monkeypatch):
+    content = [{"title": "Заголовок", "n": 1, "bio": None}]
+    fast = dumps(content)
+    monkeypatch.setattr(serialization, "orjson", None)
+    assert dumps(content) == fast
+    assert json.loads(fast) == content
+
+
+def test_mappers_accept_core_rows():
+    user = make_user()
+    now = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    comment = Comment(
+        id="c1", user_id="u1", game_name="Game", page="1", title="Заголовок", comment_text="Text",
+        created_at=now, updated_at=now,
+    )
+    user_row = UserRow._make(getattr(user, name) for name in UserRow._fields)
+    comment_row = CommentRow._make("user1" if name == "username" else getattr(comment, name) for name in CommentRow._fields)
+    assert user_out(user_row) == user_out(user)
+    assert comment_out(comment_row, comment_row.username) == comment_out(comment, "user1")
@@ -0,0 +1,52 @@
+from datetime import datetime, timedelta, timezone
+
+from app.token_cache import TokenCache, UserSnapshot
+
+
+def make_snapshot(user_id: str) -> UserSnapshot:
+    return UserSnapshot(
+        id=user_id,
+        username=f"user_{user_id}",
+        email=f"{user_id}@example.com",
+        password="hash",
+        role="user",
+        is_email_verified=True,
+        bio=None,
+        is_profile_public=True,
+        is_collection_public=True,
+    )
+
+
+def test_lru_eviction_and_counters():
+    cache = TokenCache(maxsize=2, ttl_s=60)
+    expires = datetime.now(timezone.utc) + timedelta(minutes=5)
+    cache.put("a", make_snapshot("1"), expires)
+    cache.put("b", make_snapshot("2"), expires)
+    assert cache.get("a") is not None
+    cache.put("c", make_snapshot("3"), expires)
+    # "b" дольше всех не использовался и должен быть вытеснен
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    stats = cache.stats()
+    assert stats["hits"] == 3
+    assert stats["misses"] == 1
+    assert stats["evictions"] == 1
+
+
+def test_entry_never_outlives_token():
+    cache = TokenCache(maxsize=10, ttl_s=60)
+    cache.put("a", make_snapshot("1"), datetime.now(timezone.utc) - timedelta(seconds=1))
+    assert cache.get("a") is None
+
+
+def test_invalidate_user_drops_all_tokens():
+    cache = TokenCache(maxsize=10, ttl_s=60)
+    expires = datetime.now(timezone.utc) + timedelta(minutes=5)
+    cache.put("a", make_snapshot("1"), expires)
+    cache.put("b", make_snapshot("1"), expires)
+    cache.put("c", make_snapshot("2"), expires)
+    cache.invalidate_user("1")
+    assert cache.get("a") is None
+    assert cache.get("b") is None
+    assert cache.get("c") is not None
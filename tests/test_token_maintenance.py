@@ -0,0 +1,69 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select
+
+from app.models import Token, User
+from app.token_maintenance import TokenReaper
+
+
+@pytest.mark.asyncio
+async def test_reaper_deletes_expired_and_revoked_in_batches(db_session, setup_clean_test_data):
+    now = datetime.now(timezone.utc)
+    user_id = str(uuid.uuid4())
+    async with db_session() as db:
+        db.add(User(id=user_id, username="reaperuser", email="reaperuser@example.com", password="x"))
+        await db.flush()
+        for i in range(5):
+            db.add(Token(user_id=user_id, token_hash=f"expired-{user_id}-{i}", type="access",
+                         expires_at=now - timedelta(minutes=1), revoked=False))
+        db.add(Token(user_id=user_id, token_hash=f"revoked-{user_id}", type="access",
+                     expires_at=now + timedelta(days=1), revoked=True))
+        # Отозванный, но не истёкший refresh-токен нужен для распознавания повторного использования
+        db.add(Token(user_id=user_id, token_hash=f"rotated-{user_id}", type="refresh",
+                     expires_at=now + timedelta(days=1), revoked=True))
+        db.add(Token(user_id=user_id, token_hash=f"live-{user_id}", type="access",
+                     expires_at=now + timedelta(days=1), revoked=False))
+        await db.commit()
+
+    reaper = TokenReaper(db_session, batch_size=2, max_batches=10)
+    deleted = await reaper.reap_once()
+    assert deleted >= 6
+
+    async with db_session() as db:
+        res = await db.execute(select(Token.token_hash).where(Token.user_id == user_id))
+        assert sorted(res.scalars().all()) == sorted([f"live-{user_id}", f"rotated-{user_id}"])
+    stats = reaper.stats()
+    assert stats["runs"] == 1
+    assert stats["deleted_total"] == deleted
+
+
+@pytest.mark.asyncio
+async def test_partition_keeper_runs_without_reaper(db_session, monkeypatch):
+    import asyncio
+    from app import token_maintenance
+    from app.token_maintenance import TokenPartitionKeeper
+
+    calls = []
+
+    async def fake_ensure(conn):
+        calls.append(conn)
+        return ["tokens_p2099_01"]
+
+    monkeypatch.setattr(token_maintenance, "ensure_token_partitions", fake_ensure)
+    # Партиции создаёт отдельная задача, а не проход очистки
+    await TokenReaper(db_session).reap_once()
+    assert calls == []
+
+    keeper = TokenPartitionKeeper(db_session, interval_s=0.01)
+    keeper.start()
+    try:
+        for _ in range(100):
+            if keeper.stats()["runs"] >= 2:
+                break
+            await asyncio.sleep(0.01)
+    finally:
+        await keeper.stop()
+    assert len(calls) >= 2
+    assert keeper.stats()["errors"] == 0
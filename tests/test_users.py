@@ -92,8 +92,8 @@ async def test_logout_and_delete_account(db_session, setup_clean_test_data):
         assert resp.status_code == 200
         # Удаление аккаунта
         resp = await ac.delete("/users/me", headers=headers)
-        assert resp.status_code == 200
-        assert resp.json()["detail"] == "Account deleted"
+        assert resp.status_code == 202
+        assert resp.json()["detail"] == "Account deletion scheduled"
 
 @pytest.mark.asyncio
 async def test_get_me_and_user_profile(db_session, setup_clean_test_data):
@@ -204,3 +204,498 @@ async def test_change_password(db_session, setup_clean_test_data):
         resp = await ac.patch("/users/me/password", json={"current_password": "Test1234", "new_password": "Newpass123"}, headers=headers)
         assert resp.status_code == 200
         assert resp.json()["detail"] == "Пароль изменён"
+
+@pytest.mark.asyncio
+async def test_access_token_cache_hits_and_invalidation(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "cacheuser",
+            "email": "cacheuser@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "cacheuser",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        hits_before = (await ac.get("/metrics")).json()["access_token_cache"]["hits"]
+        assert (await ac.get("/users/me", headers=headers)).status_code == 200
+        assert (await ac.get("/users/me", headers=headers)).status_code == 200
+        hits_after = (await ac.get("/metrics")).json()["access_token_cache"]["hits"]
+        assert hits_after > hits_before
+        # После смены username кэшированный снимок не должен отдавать старые данные
+        resp = await ac.patch("/users/me/username", json={"new_username": "cacheuser2"}, headers=headers)
+        assert resp.status_code == 200
+        resp = await ac.get("/users/me", headers=headers)
+        assert resp.json()["username"] == "cacheuser2"
+
+@pytest.mark.asyncio
+async def test_signed_access_token_mode(db_session, setup_clean_test_data, monkeypatch):
+    from datetime import datetime, timezone
+    from sqlalchemy import update
+    from app.models import User
+    from app.signed_tokens import RevocationList
+    from app.token_cache import access_token_cache
+    from app.utils import load_revoked_signed_tokens
+    monkeypatch.setattr("app.utils.ACCESS_TOKEN_MODE", "signed")
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        reg = await ac.post("/auth/register", json={
+            "username": "signeduser",
+            "email": "signeduser@example.com",
+            "password": "Test1234"
+        })
+        user_id = reg.json()["id"]
+        login = await ac.post("/auth/login", json={
+            "username": "signeduser",
+            "password": "Test1234"
+        })
+        assert login.status_code == 200
+        assert login.json()["token_type"] == "signed"
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        resp = await ac.get("/users/me", headers=headers)
+        assert resp.status_code == 200
+        assert resp.json()["id"] == user_id
+        # access-токен не сохраняется в таблице tokens
+        async with db_session() as db:
+            res = await db.execute(text("SELECT COUNT(*) FROM tokens WHERE user_id = :uid AND type = 'access'"), {"uid": user_id})
+            assert res.scalar() == 0
+        # Подделанная подпись отклоняется
+        forged = login.json()["access_token"][:-2] + "xx"
+        resp = await ac.get("/users/me", headers={"Authorization": f"Bearer {forged}"})
+        assert resp.status_code == 401
+        # Логаут отзывает подписанный токен
+        resp = await ac.post("/users/logout", headers=headers)
+        assert resp.status_code == 200
+        resp = await ac.get("/users/me", headers=headers)
+        assert resp.status_code == 401
+        # Новый воркер восстанавливает список отзыва из БД
+        monkeypatch.setattr("app.utils.revoked_signed_tokens", RevocationList())
+        access_token_cache.clear()
+        assert await load_revoked_signed_tokens(db_session) >= 1
+        resp = await ac.get("/users/me", headers=headers)
+        assert resp.status_code == 401
+        # Удалённый пользователь не проходит проверку и при промахе кэша
+        login = await ac.post("/auth/login", json={
+            "username": "signeduser",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        async with db_session() as db:
+            await db.execute(update(User).where(User.id == user_id).values(deleted_at=datetime.now(timezone.utc)))
+            await db.commit()
+        access_token_cache.clear()
+        resp = await ac.get("/users/me", headers=headers)
+        assert resp.status_code == 401
+
+def test_signed_mode_requires_shared_secret():
+    import os
+    import subprocess
+    import sys
+
+    env = {k: v for k, v in os.environ.items() if k != "ACCESS_TOKEN_SECRET"}
+    check = [sys.executable, "-c", "import app.config"]
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    # Случайный секрет на процесс сломал бы проверку токенов между воркерами: без секрета старт невозможен
+    result = subprocess.run(check, env={**env, "ACCESS_TOKEN_MODE": "signed"}, cwd=root, capture_output=True, text=True)
+    assert result.returncode != 0
+    assert "ACCESS_TOKEN_SECRET" in result.stderr
+    result = subprocess.run(check, env={**env, "ACCESS_TOKEN_MODE": "signed", "ACCESS_TOKEN_SECRET": "s"}, cwd=root)
+    assert result.returncode == 0
+    assert subprocess.run(check, env={**env, "ACCESS_TOKEN_MODE": "opaque"}, cwd=root).returncode == 0
+
+@pytest.mark.asyncio
+async def test_refresh_rotation_single_commit(db_session, setup_clean_test_data):
+    from sqlalchemy import event
+    from sqlalchemy.orm import Session
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "rotateuser",
+            "email": "rotateuser@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "rotateuser",
+            "password": "Test1234"
+        })
+        old_refresh = login.cookies.get("refresh_token")
+        commits = []
+        listener = lambda session: commits.append(session)
+        event.listen(Session, "after_commit", listener)
+        try:
+            ac.cookies.set("refresh_token", old_refresh)
+            resp = await ac.post("/auth/refresh")
+        finally:
+            event.remove(Session, "after_commit", listener)
+        assert resp.status_code == 200
+        assert len(commits) == 1
+        # Старый refresh-токен больше не принимается
+        ac.cookies.set("refresh_token", old_refresh)
+        resp = await ac.post("/auth/refresh")
+        assert resp.status_code == 401
+
+@pytest.mark.asyncio
+async def test_introspect_tokens_batch(db_session, setup_clean_test_data, monkeypatch):
+    from datetime import datetime, timezone
+    from sqlalchemy import update
+    from app.models import User
+    monkeypatch.setattr("app.config.INTROSPECT_SERVICE_TOKEN", "service-secret")
+    service = {"X-Service-Token": "service-secret"}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        reg = await ac.post("/auth/register", json={
+            "username": "introuser",
+            "email": "introuser@example.com",
+            "password": "Test1234"
+        })
+        user_id = reg.json()["id"]
+        login = await ac.post("/auth/login", json={
+            "username": "introuser",
+            "password": "Test1234"
+        })
+        token = login.json()["access_token"]
+        monkeypatch.setattr("app.utils.ACCESS_TOKEN_MODE", "signed")
+        login = await ac.post("/auth/login", json={
+            "username": "introuser",
+            "password": "Test1234"
+        })
+        signed = login.json()["access_token"]
+        # Без сервисного токена или с неверным эндпоинт недоступен
+        resp = await ac.post("/auth/introspect", json={"tokens": [token]})
+        assert resp.status_code == 401
+        resp = await ac.post("/auth/introspect", json={"tokens": [token]}, headers={"X-Service-Token": "wrong"})
+        assert resp.status_code == 401
+        resp = await ac.post("/auth/introspect", json={"tokens": ["bogus", token, signed]}, headers=service)
+        assert resp.status_code == 200
+        results = resp.json()["results"]
+        assert results[0] == {"active": False, "user_id": None, "role": None, "expires_at": None}
+        assert results[1]["active"] is True
+        assert results[1]["user_id"] == user_id
+        assert results[1]["role"] == "user"
+        assert results[2]["active"] is True
+        assert results[2]["user_id"] == user_id
+        # Роль подписанного токена берётся из БД, а не из claims; удалённый пользователь неактивен
+        async with db_session() as db:
+            await db.execute(update(User).where(User.id == user_id).values(role="admin"))
+            await db.commit()
+        resp = await ac.post("/auth/introspect", json={"tokens": [signed]}, headers=service)
+        assert resp.json()["results"][0]["role"] == "admin"
+        async with db_session() as db:
+            await db.execute(update(User).where(User.id == user_id).values(deleted_at=datetime.now(timezone.utc)))
+            await db.commit()
+        resp = await ac.post("/auth/introspect", json={"tokens": [token, signed]}, headers=service)
+        assert [r["active"] for r in resp.json()["results"]] == [False, False]
+        # Пустой список и превышение лимита отклоняются валидацией
+        resp = await ac.post("/auth/introspect", json={"tokens": []}, headers=service)
+        assert resp.status_code == 422
+        resp = await ac.post("/auth/introspect", json={"tokens": ["t"] * 1000}, headers=service)
+        assert resp.status_code == 422
+
+@pytest.mark.asyncio
+async def test_refresh_reuse_revokes_family(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "reuseuser",
+            "email": "reuseuser@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "reuseuser",
+            "password": "Test1234"
+        })
+        stolen = login.cookies.get("refresh_token")
+        ac.cookies.set("refresh_token", stolen)
+        rotated = await ac.post("/auth/refresh")
+        assert rotated.status_code == 200
+        new_refresh = rotated.json()["refresh_token"]
+        new_headers = {"Authorization": f"Bearer {rotated.json()['access_token']}"}
+        assert (await ac.get("/users/me", headers=new_headers)).status_code == 200
+        # Повторное предъявление уже использованного токена отзывает всё семейство
+        ac.cookies.set("refresh_token", stolen)
+        assert (await ac.post("/auth/refresh")).status_code == 401
+        ac.cookies.set("refresh_token", new_refresh)
+        assert (await ac.post("/auth/refresh")).status_code == 401
+        assert (await ac.get("/users/me", headers=new_headers)).status_code == 401
+
+@pytest.mark.asyncio
+async def test_list_and_revoke_all_sessions(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "sessionuser",
+            "email": "sessionuser@example.com",
+            "password": "Test1234"
+        })
+        logins = [await ac.post("/auth/login", json={
+            "username": "sessionuser",
+            "password": "Test1234"
+        }) for _ in range(2)]
+        headers = {"Authorization": f"Bearer {logins[0].json()['access_token']}"}
+        other_headers = {"Authorization": f"Bearer {logins[1].json()['access_token']}"}
+        resp = await ac.get("/users/me/sessions", headers=headers)
+        assert resp.status_code == 200
+        assert len(resp.json()) == 2
+        resp = await ac.post("/users/me/sessions/revoke-all", headers=headers)
+        assert resp.status_code == 200
+        assert resp.json()["revoked"] == 4
+        assert (await ac.get("/users/me", headers=headers)).status_code == 401
+        assert (await ac.get("/users/me", headers=other_headers)).status_code == 401
+
+@pytest.mark.asyncio
+async def test_change_password_revokes_sessions(db_session, setup_clean_test_data, monkeypatch):
+    from app.signed_tokens import RevocationList
+    from app.token_cache import access_token_cache
+    monkeypatch.setattr("app.utils.ACCESS_TOKEN_MODE", "signed")
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await ac.post("/auth/register", json={
+            "username": "pwdsessions",
+            "email": "pwdsessions@example.com",
+            "password": "Test1234"
+        })
+        login = await ac.post("/auth/login", json={
+            "username": "pwdsessions",
+            "password": "Test1234"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        resp = await ac.patch("/users/me/password", json={"current_password": "Test1234", "new_password": "Newpass123"}, headers=headers)
+        assert resp.status_code == 200
+        # Подписанный токен, выпущенный до смены пароля, больше не принимается
+        assert (await ac.get("/users/me", headers=headers)).status_code == 401
+        # В том числе новым воркером, у которого пусты список отзыва и кэш: момент отзыва хранится в БД
+        monkeypatch.setattr("app.utils.revoked_signed_tokens", RevocationList())
+        access_token_cache.clear()
+        assert (await ac.get("/users/me", headers=headers)).status_code == 401
+        ac.cookies.set("refresh_token", login.cookies.get("refresh_token"))
+        assert (await ac.post("/auth/refresh")).status_code == 401
+        login = await ac.post("/auth/login", json={
+            "username": "pwdsessions",
+            "password": "Newpass123"
+        })
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        assert (await ac.get("/users/me", headers=headers)).status_code == 200
+
+@pytest.mark.asyncio
+async def test_delete_account_purged_in_background(db_session, setup_clean_test_data, monkeypatch):
+    from sqlalchemy import func, select
+    from app.account_purge import AccountPurger
+    from app.comment_feed import comment_feed
+    from app.invalidation import COMMENT_PAGE_CHANGED, invalidation_bus
+    from app.models import Token, User
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        reg = await ac.post("/auth/register", json={
+            "username": "purgeuser",
+            "email": "purgeuser@example.com",
+            "password": "Test1234"
+        })
+        user_id = reg.json()["id"]
+        login = await ac.post("/auth/login", json={"username": "purgeuser", "password": "Test1234"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        for page in ["1", "1", "2"]:
+            await ac.post("/comments/", json={
+                "game_name": "PurgeGame",
+                "page": page,
+                "title": "Title",
+                "comment_text": "Text"
+            }, headers=headers)
+
+        resp = await ac.delete("/users/me", headers=headers)
+        assert resp.status_code == 202
+        # Аккаунт недоступен сразу, хотя данные ещё не удалены
+        assert (await ac.get("/users/me", headers=headers)).status_code == 401
+        assert (await ac.get("/users/purgeuser")).status_code == 404
+        login = await ac.post("/auth/login", json={"username": "purgeuser", "password": "Test1234"})
+        assert login.status_code == 401
+
+        async with db_session() as db:
+            assert (await db.execute(select(func.count()).select_from(User).where(User.id == user_id))).scalar() == 1
+        published = []
+        original_publish = invalidation_bus.publish
+
+        async def capture(kind, local=None, **payload):
+            published.append((kind, payload))
+            await original_publish(kind, local, **payload)
+
+        monkeypatch.setattr(invalidation_bus, "publish", capture)
+        sub = comment_feed.subscribe("PurgeGame", "1")
+        try:
+            purger = AccountPurger(db_session, batch_size=10)
+            assert await purger.purge_once() == 1
+        finally:
+            comment_feed.unsubscribe(sub)
+        assert purger.stats()["comments_deleted"] == 3
+        # Одно событие на страницу, а не на каждый из трёх комментариев
+        page_events = [payload for kind, payload in published if kind == COMMENT_PAGE_CHANGED]
+        assert sorted(event["page"] for event in page_events) == ["1", "2"]
+        assert all(event["action"] == "author_deleted" for event in page_events)
+        event = sub.queue.get_nowait()
+        assert event["action"] == "author_deleted"
+        assert event["comment"]["user_id"] == user_id
+        assert sub.queue.empty()
+        assert purger.stats()["tokens_deleted"] >= 2
+
+        async with db_session() as db:
+            # Через ORM: в SQLite колонки UUID хранятся без дефисов, и сравнение с текстом в сыром SQL ничего не находит
+            assert (await db.execute(select(func.count()).select_from(User).where(User.id == user_id))).scalar() == 0
+            assert (await db.execute(select(func.count()).select_from(Token).where(Token.user_id == user_id))).scalar() == 0
+        resp = await ac.get("/comments/counts", params={"game_name": "PurgeGame"})
+        assert resp.json()["counts"] == {}
+
+@pytest.mark.asyncio
+async def test_list_users_keyset_pagination(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        for name in ["keyset_c", "keyset_a", "keyset_b"]:
+            await ac.post("/auth/register", json={
+                "username": name,
+                "email": f"{name}@example.com",
+                "password": "Test1234"
+            })
+
+        # Обход курсором даёт то же, что и обход через offset
+        by_cursor, after = [], None
+        while True:
+            params = {"limit": 2} if after is None else {"limit": 2, "after_username": after}
+            page = (await ac.get("/users/", params=params)).json()
+            by_cursor += [u["username"] for u in page]
+            if len(page) < 2:
+                break
+            after = page[-1]["username"]
+        by_offset = []
+        while True:
+            page = (await ac.get("/users/", params={"limit": 2, "offset": len(by_offset)})).json()
+            by_offset += [u["username"] for u in page]
+            if len(page) < 2:
+                break
+        assert by_cursor == by_offset == sorted(by_offset)
+        assert [n for n in by_cursor if n.startswith("keyset_")] == ["keyset_a", "keyset_b", "keyset_c"]
+
+        resp = await ac.get("/users/", params={"after_username": "keyset_a", "limit": 1})
+        assert [u["username"] for u in resp.json()] == ["keyset_b"]
+        assert "X-Total-Estimate" not in resp.headers
+
+        resp = await ac.get("/users/", params={"with_total": True}, headers={"Origin": "http://localhost:3000"})
+        assert int(resp.headers["X-Total-Estimate"]) == len(by_cursor)
+        # Браузерный клиент может прочитать заголовок только если он явно открыт CORS
+        assert "X-Total-Estimate" in resp.headers["Access-Control-Expose-Headers"]
+
+        resp = await ac.get("/users/", params={"after_username": "keyset_a", "offset": 1})
+        assert resp.status_code == 400
+
+async def _register_users(ac, names):
+    ids = {}
+    for name in names:
+        resp = await ac.post("/auth/register", json={
+            "username": name,
+            "email": f"{name.lower()}@example.com",
+            "password": "Test1234"
+        })
+        ids[name] = resp.json()["id"]
+    return ids
+
+@pytest.mark.asyncio
+async def test_search_usernames_by_prefix(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        await _register_users(ac, ["prefixcarl", "Prefix_Bob", "prefix_alice", "otherprefix"])
+
+        resp = await ac.get("/users/search", params={"prefix": "PREFIX"})
+        assert resp.status_code == 200
+        assert [m["username"] for m in resp.json()] == ["prefix_alice", "Prefix_Bob", "prefixcarl"]
+        assert set(resp.json()[0]) == {"id", "username"}
+        # "_" — обычный символ, а не шаблон LIKE
+        resp = await ac.get("/users/search", params={"prefix": "prefix_", "limit": 1})
+        assert [m["username"] for m in resp.json()] == ["prefix_alice"]
+        assert (await ac.get("/users/search", params={"prefix": "pre%"})).status_code == 422
+
+        login = await ac.post("/auth/login", json={"username": "prefixcarl", "password": "Test1234"})
+        await ac.delete("/users/me", headers={"Authorization": f"Bearer {login.json()['access_token']}"})
+        resp = await ac.get("/users/search", params={"prefix": "prefixc"})
+        assert resp.json() == []
+
+@pytest.mark.asyncio
+async def test_search_usernames_memory_index(db_session, setup_clean_test_data, monkeypatch):
+    from app.queries import fetch_username_matches
+    from app.username_index import username_index
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        ids = await _register_users(ac, ["memo_b", "Memo_a"])
+        monkeypatch.setattr(username_index, "enabled", True)
+        await username_index.load(db_session)
+        assert username_index.loaded
+
+        # Индекс поддерживается регистрацией, сменой username и удалением аккаунта
+        await _register_users(ac, ["memo_c"])
+        login = await ac.post("/auth/login", json={"username": "memo_b", "password": "Test1234"})
+        headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+        await ac.patch("/users/me/username", json={"new_username": "memo_0"}, headers=headers)
+        login = await ac.post("/auth/login", json={"username": "memo_c", "password": "Test1234"})
+        await ac.delete("/users/me", headers={"Authorization": f"Bearer {login.json()['access_token']}"})
+
+        hits = username_index.hits
+        resp = await ac.get("/users/search", params={"prefix": "memo"})
+        assert username_index.hits == hits + 1
+        assert resp.json() == [
+            {"id": ids["memo_b"], "username": "memo_0"},
+            {"id": ids["Memo_a"], "username": "Memo_a"},
+        ]
+        async with db_session() as db:
+            assert [m._asdict() for m in await fetch_username_matches(db, "memo", 10)] == resp.json()
+
+        # Если пользователей больше лимита, индекс не загружается и поиск идёт по БД
+        monkeypatch.setattr(username_index, "max_users", 1)
+        await username_index.load(db_session)
+        assert not username_index.loaded
+        assert username_index.stats()["too_large"] is True
+        resp = await ac.get("/users/search", params={"prefix": "memo"})
+        assert [u["username"] for u in resp.json()] == ["memo_0", "Memo_a"]
+
+def test_username_index_chunks_split_and_merge(monkeypatch):
+    from app import username_index as module
+
+    monkeypatch.setattr(module, "_CHUNK", 2)
+    index = module.UsernameIndex(enabled=True)
+    index.loaded = True
+    for i in range(20):
+        index.set(str(i), f"chunk_{i:02d}")
+    # Блоки делятся по мере вставки, порядок выдачи сохраняется
+    assert len(index._chunks) > 1
+    assert [m.username for m in index.search("chunk_1", 3)] == ["chunk_10", "chunk_11", "chunk_12"]
+    for i in range(10, 20):
+        index.set(str(i), None)
+    index.set("5", "chunk_99")
+    assert [m.username for m in index.search("chunk_", 20)] == [f"chunk_{i:02d}" for i in range(10) if i != 5] + ["chunk_99"]
+    assert all(index._chunks)
+
+
+@pytest.mark.asyncio
+async def test_users_batch_lookup(db_session, setup_clean_test_data):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        ids = await _register_users(ac, ["batch_a", "batch_b", "batch_private"])
+        login = await ac.post("/auth/login", json={"username": "batch_private", "password": "Test1234"})
+        await ac.patch("/users/me/profile", json={"is_profile_public": False},
+                       headers={"Authorization": f"Bearer {login.json()['access_token']}"})
+        unknown_id = "00000000-0000-4000-8000-000000000000"
+
+        resp = await ac.post("/users/batch", json={
+            "ids": [ids["batch_a"].upper(), ids["batch_private"], unknown_id, "not-a-uuid"],
+            "usernames": ["batch_b", "batch_a", "batch_nobody"],
+        })
+        assert resp.status_code == 200
+        data = resp.json()
+        # batch_a запрошен дважды, но возвращается один раз
+        assert [u["username"] for u in data["users"]] == ["batch_a", "batch_b"]
+        assert set(data["users"][0]) == {"id", "username", "bio", "is_profile_public", "is_collection_public", "role"}
+        assert data["hidden"] == [{"id": ids["batch_private"], "username": "batch_private"}]
+        assert data["missing_ids"] == [unknown_id, "not-a-uuid"]
+        assert data["missing_usernames"] == ["batch_nobody"]
+
+        assert (await ac.post("/users/batch", json={})).status_code == 422
+        assert (await ac.post("/users/batch", json={"usernames": ["u"] * 301})).status_code == 422